@@ -6,17 +6,46 @@ The ASR120B100B driver has 2 dials controlling axes 1 and 2 respectively.
 - Pressing a dial stops travel along the corresponding axis.
 """
 
+import contextlib
+
 import zaber_motion
 
+from zaber_motion import (ConnectionClosedException, ConnectionFailedException,
+                          MovementFailedException, MovementInterruptedException,
+                          RequestTimeoutException)
 from zaber_motion.ascii import Connection
 from zaber_motion.ascii import Axis
+from zaber_motion.ascii import TriggerAction, TriggerCondition
+
+from src.devices.faults import (DeviceError, DeviceTimeout, StuckMoveError, move_deadline,
+                                recovering, wait_until)
+from src.devices.stage import Stage
+from src.functions import timeline
+from src.functions.telemetry import ActivityLock
+
+# Errors after which the serial link is reopened and the call retried
+_TRANSIENT = (ConnectionClosedException, ConnectionFailedException)
 
-class ASR:
+
+@contextlib.contextmanager
+def _translated(what):
+    """
+    Re-raise zaber request timeouts and motion faults as device errors.
+    """
+    try:
+        yield
+    except RequestTimeoutException as e:
+        raise DeviceTimeout(f"{what}: {e}") from e
+    except (MovementFailedException, MovementInterruptedException) as e:
+        raise StuckMoveError(f"{what}: {e}") from e
+
+
+class ASR(Stage):
     """
     Class to manage connection, control, and settings of the ASR120B100B device.
     """
 
-    def __init__(self, port=8):
+    def __init__(self, port=8, timeout=0.5):
         """
         Initialize the ASR device.
 
@@ -24,31 +53,26 @@ class ASR:
         ----------
         port : int
             The COM port for the ASR device connection.
+        timeout : float, optional
+            Reply deadline for each request [s]. The default is 0.5.
         """
         self.port = f"COM{port}"
+        self.timeout = timeout
         self.zaberdevice = None
         self.connection = None
         self.axes = []
         self.settings = self.Settings(self)
+        self.lock = ActivityLock()
+        self._travel = None
+        self._dynamics = None
         
     def __enter__(self):
         """
         Establish connection and initialize the ASR device.
         """
         try:
-            self.connection = Connection.open_serial_port(self.port)
-            self.zaberdevice = self.connection.detect_devices()[0]
+            self._open()
             print("ASR Connected")
-    
-            axis_count = self.zaberdevice.axis_count
-            for ax in range(axis_count):
-                axis_name = f"axis{ax + 1}"
-                axis_instance = Axis(self.zaberdevice, ax + 1)
-                setattr(self, axis_name, axis_instance)
-                axis = getattr(self, axis_name)
-                axis.name = axis_name
-                self.axes.append(axis)
-    
             print(f"ASR axes initialized: {[axis.name for axis in self.axes]}")
 
             if not self.zaberdevice.all_axes.is_homed():
@@ -70,7 +94,94 @@ class ASR:
                 print("ASR Disconnected")
             except Exception as e:
                 raise ConnectionError(f"Couldn't disconnect from ASR: {e}")
-                
+
+    def _open(self):
+        """
+        Open the serial port and build the axis objects.
+        """
+        self.connection = Connection.open_serial_port(self.port)
+        self.connection.default_request_timeout = int(self.timeout * 1000)
+        self.zaberdevice = self.connection.detect_devices()[0]
+        self.axes = []
+        for ax in range(self.zaberdevice.axis_count):
+            axis_name = f"axis{ax + 1}"
+            axis = Axis(self.zaberdevice, ax + 1)
+            axis.name = axis_name
+            setattr(self, axis_name, axis)
+            self.axes.append(axis)
+
+    def _recover(self):
+        """
+        Reopen the port after a dropped connection and check the axes kept
+        their home reference. Homing needs user confirmation, so a lost
+        reference is reported rather than fixed here.
+        """
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+        self._open()
+        if not self.zaberdevice.all_axes.is_homed():
+            raise DeviceError("ASR lost its home reference after reconnect; re-home the stage")
+
+    def _dynamic_limits(self):
+        """
+        Max speed [um/s] and acceleration [um/s^2] of each axis, read from
+        the device once and refreshed when either setting is changed.
+        """
+        if self._dynamics is None:
+            velocity = zaber_motion.Units.VELOCITY_MICROMETRES_PER_SECOND
+            accel = zaber_motion.Units.ACCELERATION_MICROMETRES_PER_SECOND_SQUARED
+            with self.lock:
+                self._dynamics = ([axis.settings.get("maxspeed", velocity) for axis in self.axes],
+                                  [axis.settings.get("accel", accel) for axis in self.axes])
+        return self._dynamics
+
+    def _wait(self, indices, distances, what, minimum=0.2):
+        """
+        Wait for the given axes to stop, within a deadline derived from the
+        travel distances [um], then surface any motion fault.
+        """
+        axes = [self.axes[i] for i in indices]
+        speed, accel = self._dynamic_limits()
+        deadline = move_deadline(distances, [speed[i] for i in indices],
+                                 [accel[i] for i in indices], minimum=minimum)
+        with _translated(what):
+            wait_until(lambda: not any(axis.is_busy() for axis in axes), deadline,
+                       progress=lambda: [axis.get_position() for axis in axes],
+                       poll=0.01, what=what)
+            for axis in axes:
+                axis.wait_until_idle()
+
+    @recovering(_TRANSIENT)
+    def _move_axes(self, targets, units):
+        """
+        Start axes towards absolute targets together and wait for them all.
+
+        Parameters
+        ----------
+        targets : dict
+            Axis index -> absolute target.
+        units : str
+            Unit of the targets (mm, um, nm, or native).
+        """
+        unit = ASR.utils.resolve(units)
+        um = zaber_motion.Units.LENGTH_MICROMETRES
+        indices = list(targets)
+        what = f"ASR move {[self.axes[i].name for i in indices]}"
+        with _translated(what):
+            distances = []
+            for i, value in targets.items():
+                axis = self.axes[i]
+                start = axis.get_position(um)
+                axis.move_absolute(float(value), unit, wait_until_idle=False)
+                if units in ASR.utils.um_scale:
+                    distances.append(abs(value * ASR.utils.um_scale[units] - start))
+                else:
+                    low, high = self._limits()
+                    distances.append(high[i] - low[i])
+        self._wait(indices, distances, what)
+
     def home(self, axis):
        """
        Home the specified axis.
@@ -80,11 +191,13 @@ class ASR:
        axis : zaber_motion.ascii.Axis
            The axis to home.
        """
-       try:
-           axis.home(wait_until_idle=True)
-           print(f"ASR homed: {axis.name}")
-       except Exception as e:
-           print(f"ASR couldn't home {axis.name}: {e}")
+       i = self.axes.index(axis)
+       low, high = self._limits()
+       with self.lock, timeline.span("ASR", f"home {axis.name}"):
+           with _translated(f"ASR home {axis.name}"):
+               axis.home(wait_until_idle=False)
+           self._wait([i], [high[i] - low[i]], f"ASR home {axis.name}", minimum=1.0)
+       print(f"ASR homed: {axis.name}")
            
     def get_position(self, axis, units):
         """
@@ -102,11 +215,11 @@ class ASR:
         float
             The position of the axis.
         """
-        unit = ASR.utils.length_conversion(units)
-        try:
-            return axis.get_position(zaber_motion.Units[unit])
-        except Exception as e:
-            raise ValueError(f"Failed to retrieve position for {axis.name}: {e}")
+        unit = ASR.utils.resolve(units)
+        with self.lock, _translated(f"ASR position {axis.name}"):
+            pos = axis.get_position(unit)
+        timeline.record("ASR", f"position {axis.name}", pos)
+        return pos
             
     def move_absolute(self, targets, units):
         """
@@ -122,13 +235,10 @@ class ASR:
         if len(targets) != len(self.axes):
             raise ValueError("Number of targets does not match number of axes.")
         
-        unit = ASR.utils.length_conversion(units)
-        for axis, target in zip(self.axes, targets):
-            try:
-                axis.move_absolute(target, zaber_motion.Units[unit])
-                print(f"Moved {axis.name} to {target} {units}.")
-            except Exception as e:
-                print(f"Failed to move {axis.name}: {e}")
+        for i, (axis, target) in enumerate(zip(self.axes, targets)):
+            with self.lock, timeline.span("ASR", f"move_absolute {axis.name}", target):
+                self._move_axes({i: target}, units)
+            print(f"Moved {axis.name} to {target} {units}.")
             
     def move_relative(self, steps, units):
         """
@@ -144,14 +254,105 @@ class ASR:
         if len(steps) != len(self.axes):
             raise ValueError("Number of steps does not match number of axes.")
         
-        unit = ASR.utils.length_conversion(units)
-        for axis, step in zip(self.axes, steps):
-            try:
-                axis.move_relative(step, zaber_motion.Units[unit])
-                print(f"Moved {axis.name} by {step} {units}.")
-            except Exception as e:
-                print(f"Failed to move {axis.name}: {e}")
+        for i, (axis, step) in enumerate(zip(self.axes, steps)):
+            with self.lock, timeline.span("ASR", f"move_relative {axis.name}", step):
+                # Issued as an absolute move so a retry after reconnecting
+                # cannot add the step twice
+                target = self.get_position(axis, units) + step
+                self._move_axes({i: target}, units)
+            print(f"Moved {axis.name} by {step} {units}.")
                 
+    def setPos(self, targets, units="um"):
+        """
+        Stage interface: move all axes to absolute positions.
+
+        Parameters
+        ----------
+        targets : list of float
+            Target positions for each axis.
+        units : str, optional
+            Unit of measurement. The default is "um".
+        """
+        self.move_absolute(targets, units)
+
+    def getPos(self, units="um"):
+        """
+        Stage interface: query the position of all axes.
+
+        Returns
+        -------
+        list of float
+            Position of each axis.
+        """
+        return [self.get_position(axis, units) for axis in self.axes]
+
+    def _limits(self):
+        """
+        Travel limits of each axis in micrometres, read from the device once.
+        """
+        if self._travel is None:
+            um = zaber_motion.Units.LENGTH_MICROMETRES
+            with self.lock:
+                self._travel = ([axis.settings.get("limit.min", um) for axis in self.axes],
+                                [axis.settings.get("limit.max", um) for axis in self.axes])
+        return self._travel
+
+    def _unit_scale(self, units):
+        if units not in ASR.utils.um_scale:
+            raise ValueError(f"Unsupported unit for batch moves: {units}")
+        return ASR.utils.um_scale[units]
+
+    def _move_to(self, target):
+        """
+        Start all axes towards the target together, then wait for them all.
+        """
+        with self.lock, timeline.span("ASR", "move_to"):
+            self._move_axes(dict(enumerate(target)), "um")
+
+    def configure_trigger(self, spec, trigger=1):
+        """
+        Program a controller trigger to pulse a digital output.
+
+        Position trains use distance-travelled triggers (armed at the
+        current position, so move to spec.start first) and single positions
+        fire when the axis position crosses spec.position. Motion-complete
+        triggers fire on reaching the move target; the controller has no
+        settled state to trigger on, so on-target triggers are not
+        supported.
+
+        Parameters
+        ----------
+        spec : TriggerSpec
+            Positions in micrometres; output is the digital output channel.
+        trigger : int, optional
+            Controller trigger number. The default is 1.
+        """
+        if spec.condition == "on_target":
+            raise ValueError("ASR triggers support 'position' and 'motion_complete' conditions only")
+        um = zaber_motion.Units.LENGTH_MICROMETRES
+        axis = self.axes[spec.axis - 1]
+        count = spec.count
+        with self.lock, timeline.span("ASR", "configure_trigger", trigger):
+            zaber_trigger = self.zaberdevice.triggers.get_trigger(trigger)
+            zaber_trigger.disable()
+            if spec.condition == "position" and spec.step is not None:
+                zaber_trigger.fire_when_distance_travelled(spec.axis, abs(spec.step), um)
+                if not count:
+                    count = int(abs(spec.stop - spec.start) // abs(spec.step)) + 1
+            else:
+                rising = spec.position >= axis.get_position(um)
+                condition = TriggerCondition.GE if rising else TriggerCondition.LE
+                zaber_trigger.fire_when_setting(spec.axis, "pos", condition, spec.position, um)
+            active, idle = (1, 0) if spec.polarity else (0, 1)
+            pulse = max(int(round(spec.pulse_width * 1e3)), 1)
+            zaber_trigger.on_fire(TriggerAction.A, 0,
+                                  f"io set do {spec.output} {active} schedule {pulse} {idle}")
+            zaber_trigger.enable(count)
+
+    def disable_trigger(self, trigger=1):
+        with self.lock:
+            self.zaberdevice.triggers.get_trigger(trigger).disable()
+
     def _confirm_and_home_axes(self):
         """
         Confirm and home all axes if required.
@@ -178,6 +379,11 @@ class ASR:
             "native": "NATIVE"
         }
 
+        # Resolved once, so per-call unit lookups are a single dict access
+        units = {key: getattr(zaber_motion.Units, value) for key, value in length_map.items()}
+
+        um_scale = {"mm": 1e3, "um": 1.0, "nm": 1e-3}
+
         @staticmethod
         def length_conversion(unit):
             """
@@ -193,7 +399,28 @@ class ASR:
             str
                 Internal unit representation.
             """
-            return ASR.utils.length_map.get(unit, None) or ValueError("Invalid unit.")
+            if unit not in ASR.utils.length_map:
+                raise ValueError(f"Invalid unit: {unit}")
+            return ASR.utils.length_map[unit]
+
+        @staticmethod
+        def resolve(unit):
+            """
+            Return the zaber_motion.Units member for a human-readable unit.
+
+            Parameters
+            ----------
+            unit : str
+                Human-readable unit (mm, um, nm, or native).
+
+            Returns
+            -------
+            zaber_motion.Units
+            """
+            try:
+                return ASR.utils.units[unit]
+            except KeyError:
+                raise ValueError(f"Invalid unit: {unit}")
         
     class Settings:
         """
@@ -218,9 +445,12 @@ class ASR:
                 print("Value count does not match axis count.")
                 return
             
+            if setting in ("maxspeed", "accel"):
+                self._parent._dynamics = None
             for axis, value in zip(self._parent.axes, values):
                 try:
-                    axis.settings.set(setting, value)
+                    with self._parent.lock:
+                        axis.settings.set(setting, value)
                     print(f"Set {setting} for {axis.name}.")
                 except Exception as e:
                     print(f"Failed to set {setting} for {axis.name}: {e}")
@@ -244,13 +474,14 @@ class ASR:
             v_const = 0.15625e-3/1.6348
             
         
-            return {
-                "accel": [axis.settings.get("accel")*a_const for axis in self._parent.axes],
-                "drive_temp": [axis.settings.get("driver.temperature") for axis in self._parent.axes],
-                "knob_dir": [axis.settings.get("knob.dir") for axis in self._parent.axes],
-                "knob_mode": [axis.settings.get("knob.mode") for axis in self._parent.axes],
-                "maxspeed": [axis.settings.get("maxspeed")*v_const for axis in self._parent.axes]
-                }
+            with self._parent.lock:
+                return {
+                    "accel": [axis.settings.get("accel")*a_const for axis in self._parent.axes],
+                    "drive_temp": [axis.settings.get("driver.temperature") for axis in self._parent.axes],
+                    "knob_dir": [axis.settings.get("knob.dir") for axis in self._parent.axes],
+                    "knob_mode": [axis.settings.get("knob.mode") for axis in self._parent.axes],
+                    "maxspeed": [axis.settings.get("maxspeed")*v_const for axis in self._parent.axes]
+                    }
             
 
 if __name__ == "__main__":
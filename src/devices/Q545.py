@@ -1,7 +1,19 @@
 
-from pipython import GCSDevice, pitools
+from pipython import GCSDevice, GCSError
 
-class Q545():
+from src.devices.faults import DeviceError, move_deadline, recovering, wait_until
+from src.devices.stage import Stage
+from src.functions import timeline
+from src.functions.telemetry import ActivityLock
+
+def _is_interface_error(error):
+    """
+    PI reports PC-side communication failures with negative error codes.
+    """
+    return getattr(error, "val", 0) < 0
+
+
+class Q545(Stage):
     """
     Physike Instrumente Q545 Piezoelectric stage
     """
@@ -28,6 +40,8 @@ class Q545():
         self.UpperLim = -5.0
         self.LowerLim = -6.5
         self.home = 0.0
+        self.lock = ActivityLock()
+        self.velocity = None
 
     def __enter__(self):
         self.pidevice = GCSDevice(self.model)
@@ -38,27 +52,26 @@ class Q545():
                 if not self.isReferenced():
                     prompt = input("Confirm the piezo is safe to reference? (y/n)")
                     if prompt == "y":
-                        self.refernce()
+                        self.reference()
                         print("Q-545 Referenced")
                     elif prompt == "n":
                         self.__exit__(None,None,None)
                         break
                     else:
-                        ValueError("Unrecognised input. Specify y or n") 
-                        raise
+                        raise ValueError("Unrecognised input. Specify y or n")
                 else:
                     break
         except Exception as e:
             print(f"Error connecting to Q-545: {e}")
             raise
-        pitools.waitontarget(self.pidevice, 1)
+        self._wait_on_target(self.UpperLim - self.LowerLim)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         if exc_type:
             print(f"An error occurred: {exc_value}")
         self.pidevice.MOV(1, 0.0)
-        pitools.waitontarget(self.pidevice, 1)
+        self._wait_on_target(abs(self.get_position()))
         self.pidevice.__exit__(None, None, None)
         print("Q-545 Disconnected")
         
@@ -72,30 +85,137 @@ class Q545():
     
     def move_absolute(self, target):
         if target < self.LowerLim or target > self.UpperLim:
-            raise ValueError("Target location out of bounds: -6.5 to 6.5mm")
-        try:
-            self.pidevice.MOV(1, target)
-            pitools.waitontarget(self.pidevice, 1)
-            pos = self.get_position()
-            print(f"PI Position: {pos}")
-        except Exception as e:
-            print(e)
+            raise ValueError(f"Target location out of bounds: {self.LowerLim} to {self.UpperLim}mm")
+        with self.lock, timeline.span("Q545", "move_absolute", target):
+            self._move(target)
+        pos = self.get_position()
+        print(f"PI Position: {pos}")
             
     def move_relative(self, step):
             pos = self.get_position()
             if pos + step < self.LowerLim or pos + step > self.UpperLim:
                 raise ValueError("Specified travel would move stage out of range")
             else:
-                try:
-                    self.pidevice.MVR(1,step)
-                    pitools.waitontarget(self.pidevice, 1)
-                    pos = self.get_position()
-                    print(f"PI Position: {pos}")
-                except Exception as e:
-                    print(e)
+                # Issued as an absolute move so a retry after reconnecting
+                # cannot add the step twice
+                with self.lock, timeline.span("Q545", "move_relative", step):
+                    self._move(pos + step)
+                pos = self.get_position()
+                print(f"PI Position: {pos}")
 
+    @recovering((GCSError,), is_transient=_is_interface_error)
     def get_position(self):
-        return self.pidevice.qPOS(1)[1]
+        with self.lock:
+            pos = self.pidevice.qPOS(1)[1]
+        timeline.record("Q545", "position", pos)
+        return pos
+
+    @recovering((GCSError,), is_transient=_is_interface_error)
+    def _move(self, target):
+        """
+        Issue a MOV and wait for the servo to report on target, within a
+        deadline based on the travel distance.
+        """
+        start = self.pidevice.qPOS(1)[1]
+        self.pidevice.MOV(1, target)
+        self._wait_on_target(abs(target - start))
+
+    def _wait_on_target(self, distance):
+        """
+        Wait for on-target, raising MoveTimeout/StuckMoveError instead of
+        blocking indefinitely like pitools.waitontarget.
+        """
+        if self.velocity is None:
+            try:
+                self.velocity = self.pidevice.qVEL(1)[1]
+            except GCSError:
+                # Velocity control off: fall back to a conservative 1 mm/s
+                self.velocity = 1.0
+        wait_until(lambda: self.pidevice.qONT(1)[1],
+                   move_deadline(distance, self.velocity, margin=2.0, minimum=0.2),
+                   progress=lambda: self.pidevice.qPOS(1)[1],
+                   what="Q-545 move")
+
+    # E-873 CTO parameter IDs and trigger modes
+    CTO_STEP, CTO_AXIS, CTO_MODE, CTO_POLARITY, CTO_START, CTO_STOP = 1, 2, 3, 7, 8, 9
+    CTO_POSITION_DISTANCE, CTO_ON_TARGET = 0, 2
+
+    def configure_trigger(self, spec):
+        """
+        Load a TriggerSpec into an E-873 trigger output and enable it.
+
+        Position triggers use position-distance mode (a single position is
+        a one-step range) and on-target triggers the on-target mode.
+        Motion-complete triggers are a single position trigger at the move
+        target, so like the software model (and the ASR) they fire when the
+        axis reaches spec.position, before settling, and not at the end of
+        moves to other targets.
+
+        Parameters
+        ----------
+        spec : TriggerSpec
+            Positions in mm.
+        """
+        line = spec.output
+        with self.lock, timeline.span("Q545", "configure_trigger", line):
+            self.pidevice.TRO(line, False)
+            self.pidevice.CTO(line, self.CTO_AXIS, spec.axis)
+            if spec.condition == "on_target":
+                self.pidevice.CTO(line, self.CTO_MODE, self.CTO_ON_TARGET)
+            else:
+                train = spec.condition == "position" and spec.step is not None
+                start = spec.start if train else spec.position
+                stop = spec.stop if train else spec.position
+                step = spec.step if train else self.UpperLim - self.LowerLim
+                self.pidevice.CTO(line, self.CTO_MODE, self.CTO_POSITION_DISTANCE)
+                self.pidevice.CTO(line, self.CTO_STEP, abs(step))
+                self.pidevice.CTO(line, self.CTO_START, start)
+                self.pidevice.CTO(line, self.CTO_STOP, stop)
+            self.pidevice.CTO(line, self.CTO_POLARITY, spec.polarity)
+            self.pidevice.TRO(line, True)
+
+    def disable_trigger(self, line=1):
+        with self.lock:
+            self.pidevice.TRO(line, False)
+
+    def _recover(self):
+        """
+        Reconnect over USB after a dropped connection and check the servo is
+        still referenced. Re-referencing needs user confirmation, so a lost
+        reference is reported rather than fixed here.
+        """
+        try:
+            self.pidevice.CloseConnection()
+        except Exception:
+            pass
+        self.pidevice.ConnectUSB(serialnum=self.serial)
+        if not self.pidevice.qSVO(1)[1]:
+            raise DeviceError("Q-545 servo lost after reconnect; re-reference the stage")
+
+    def setPos(self, target):
+        """
+        Stage interface: move to an absolute position [mm].
+        """
+        self.move_absolute(target)
+
+    def getPos(self):
+        """
+        Stage interface: query the position [mm].
+        """
+        return self.get_position()
+
+    def _limits(self):
+        return [self.LowerLim], [self.UpperLim]
+
+    def _unit_scale(self, units):
+        scale = {"mm": 1.0, "um": 1e-3, "nm": 1e-6}
+        if units not in scale:
+            raise ValueError(f"Unsupported unit: {units}")
+        return scale[units]
+
+    def _move_to(self, target):
+        with self.lock, timeline.span("Q545", "move_to", float(target[0])):
+            self._move(float(target[0]))
     
 if __name__ == "__main__":
     with Q545() as Q545:
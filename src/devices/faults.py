@@ -0,0 +1,194 @@
+"""
+Typed device errors, deadline-bounded waits and reconnect-and-resync helpers
+shared by the drivers.
+
+Every device call has a deadline: serial queries use a short per-command
+timeout, and moves are given a deadline derived from the expected travel
+time instead of waiting indefinitely on the controller. A move that stops
+making progress before reaching its target is reported as stuck straight
+away rather than at the deadline. Transient USB/serial drops are recovered
+by reconnecting, resynchronising the driver state and retrying the call
+once.
+"""
+
+import functools
+import time
+
+import numpy as np
+
+
+class DeviceError(Exception):
+    """
+    Base class for device failures.
+    """
+    pass
+
+
+class DeviceTimeout(DeviceError, TimeoutError):
+    """
+    The device did not answer or finish within its deadline.
+    """
+    pass
+
+
+class MoveTimeout(DeviceTimeout):
+    """
+    A move did not reach its target within the expected travel time.
+    """
+    pass
+
+
+class StuckMoveError(MoveTimeout):
+    """
+    A move stopped making progress before reaching its target.
+    """
+    pass
+
+
+class DeviceDisconnected(DeviceError, ConnectionError):
+    """
+    The connection to the device is closed or was lost.
+    """
+    pass
+
+
+class CommandError(DeviceError, ValueError):
+    """
+    The device rejected a command or returned an unexpected response.
+    """
+    pass
+
+
+def move_deadline(distance, speed, accel=np.inf, margin=1.5, minimum=0.1):
+    """
+    Time allowed for a move: the trapezoidal-profile travel time scaled by a
+    safety margin, plus a fixed minimum for command and settle overhead.
+
+    Parameters
+    ----------
+    distance : float or array_like
+        Distance per axis, in the units of speed and accel.
+    speed : float or array_like
+        Maximum speed per axis.
+    accel : float or array_like, optional
+        Acceleration per axis. The default is infinite.
+    margin : float, optional
+        Multiplier on the expected time. The default is 1.5.
+    minimum : float, optional
+        Added allowance [s]. The default is 0.1.
+
+    Returns
+    -------
+    float
+        Allowed time [s] for the slowest axis.
+
+    """
+    distance = np.abs(np.atleast_1d(np.asarray(distance, dtype=np.float64)))
+    speed = np.asarray(speed, dtype=np.float64)
+    accel = np.asarray(accel, dtype=np.float64)
+    ramp = speed ** 2 / accel
+    t = np.where(distance < ramp, 2 * np.sqrt(distance / accel), distance / speed + speed / accel)
+    return float(np.max(t)) * margin + minimum
+
+
+def wait_until(done, timeout, progress=None, stall_time=0.5, poll=0.002, what="move"):
+    """
+    Poll until done() is true, with a hard deadline and early stall detection.
+
+    Parameters
+    ----------
+    done : callable
+        Returns True once the operation is complete.
+    timeout : float
+        Deadline from now [s].
+    progress : callable, optional
+        Returns the current position (scalar or sequence). If it does not
+        change for stall_time while done() is still False, the move is
+        reported as stuck.
+    stall_time : float, optional
+        See progress. The default is 0.5.
+    poll : float, optional
+        Polling period [s]. The default is 0.002.
+    what : str, optional
+        Description used in error messages.
+
+    Raises
+    ------
+    StuckMoveError
+        No progress for stall_time.
+    MoveTimeout
+        Not done by the deadline.
+
+    Returns
+    -------
+    float
+        Time waited [s].
+
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    last_position = progress() if progress is not None else None
+    last_change = start
+    while not done():
+        now = time.monotonic()
+        if now > deadline:
+            raise MoveTimeout(f"{what} not complete after {timeout:.3f} s")
+        if progress is not None:
+            position = progress()
+            if not np.array_equal(position, last_position):
+                last_position = position
+                last_change = now
+            elif now - last_change > stall_time:
+                raise StuckMoveError(f"{what} stalled at {position} for {stall_time:.3f} s")
+        time.sleep(poll)
+    return time.monotonic() - start
+
+
+def recovering(transient, attempts=2, is_transient=None):
+    """
+    Decorator for driver methods: on a transient connection error, call the
+    driver's _recover() (reconnect and resynchronise) and retry the method.
+    DeviceErrors raised by the method itself (timeouts, stuck moves, a
+    deliberately closed connection) are never treated as transient, even
+    though some of them are OSError subclasses.
+
+    Parameters
+    ----------
+    transient : tuple of Exception types
+        Transport errors treated as a transient connection drop, e.g.
+        serial.SerialException. Avoid bare OSError, which also matches
+        DeviceTimeout and DeviceDisconnected.
+    attempts : int, optional
+        Total attempts including the first. The default is 2.
+    is_transient : callable, optional
+        is_transient(error) narrows down which of the `transient` errors are
+        connection drops (e.g. by error code). The default treats them all
+        as transient.
+
+    Raises
+    ------
+    DeviceDisconnected
+        The connection could not be restored.
+
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            for attempt in range(attempts):
+                try:
+                    return method(self, *args, **kwargs)
+                except DeviceError:
+                    raise
+                except transient as e:
+                    if is_transient is not None and not is_transient(e):
+                        raise
+                    if attempt == attempts - 1:
+                        raise DeviceDisconnected(f"{type(self).__name__}.{method.__name__} failed: {e}") from e
+                    print(f"{type(self).__name__} connection lost ({e}), reconnecting")
+                    try:
+                        self._recover()
+                    except Exception as reconnect_error:
+                        raise DeviceDisconnected(f"{type(self).__name__} could not reconnect: "
+                                                 f"{reconnect_error}") from e
+        return wrapper
+    return decorator
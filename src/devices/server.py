@@ -0,0 +1,585 @@
+"""
+Local device server. A single process owns the connections to the stage and
+laser hardware (ASR, Q545, Vortran) and exposes their methods to any number
+of client processes over a localhost socket.
+
+- Requests are pipelined: a client may issue many calls without waiting and
+  the replies are matched back to their request ids.
+- Each device has its own worker thread, so commands to one device run in the
+  order they were received while different devices run concurrently.
+- Telemetry is pushed to clients that have subscribed to a topic.
+
+Messages are length-prefixed pickles, and unpickling a message can run
+arbitrary code, so every process that can connect is fully trusted: it can
+both drive the hardware and execute code in the server process. The server
+therefore only binds to a Unix socket (the default where available,
+created with owner-only permissions so only the same user can connect) or
+the loopback interface. On loopback TCP (the default on Windows) any local
+user can connect, so only use it on single-user machines, and never expose
+the server to a network.
+
+Example usage
+-------------
+Server process:
+
+    with ASR(8) as asr, Q545() as q545:
+        server = DeviceServer({"asr": asr, "q545": q545})
+        server.add_telemetry("asr.settings", "asr", "settings.get", interval=5.0)
+        server.serve_forever()
+
+Client process:
+
+    with DeviceClient() as client:
+        asr = client.proxy("asr")
+        asr.move_absolute([1000, 2000], "um")
+        client.subscribe("asr.settings", print)
+"""
+
+import os
+import pickle
+import queue
+import socket
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+if hasattr(socket, "AF_UNIX") and os.name != "nt":
+    DEFAULT_ADDRESS = os.path.join(tempfile.gettempdir(), f"scimitar-devices-{os.getuid()}.sock")
+else:
+    DEFAULT_ADDRESS = ("127.0.0.1", 50545)
+
+_HEADER = struct.Struct("!I")
+_PROTOCOL = pickle.HIGHEST_PROTOCOL
+
+# Message kinds
+CALL = 0
+SUBSCRIBE = 1
+UNSUBSCRIBE = 2
+REPLY = 3
+ERROR = 4
+EVENT = 5
+
+
+class RemoteError(Exception):
+    """
+    Raised on the client when a device call fails inside the server and the
+    original exception could not be transferred.
+    """
+    pass
+
+
+def _open_socket(address):
+    """
+    Create a socket for the given address. A string address is a Unix socket
+    path, a (host, port) tuple is TCP.
+    """
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def _send(sock, lock, message):
+    """
+    Pickle a message and write it with its length prefix in a single call.
+    """
+    _send_payload(sock, lock, pickle.dumps(message, protocol=_PROTOCOL))
+
+
+def _send_payload(sock, lock, payload):
+    """
+    Write an already pickled message with its length prefix.
+    """
+    with lock:
+        sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exact(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        raise ConnectionError("Connection closed")
+    return data
+
+
+def _recv(stream):
+    """
+    Read a single length-prefixed message from a buffered socket stream.
+    """
+    (size,) = _HEADER.unpack(_recv_exact(stream, _HEADER.size))
+    return pickle.loads(_recv_exact(stream, size))
+
+
+def _resolve(device, path):
+    """
+    Resolve a dotted public attribute path (e.g. "settings.get") on a device.
+    """
+    target = device
+    for name in path.split("."):
+        if name.startswith("_"):
+            raise AttributeError(f"Private attribute '{name}' is not exposed")
+        target = getattr(target, name)
+    return target
+
+
+class _DeviceWorker:
+    """
+    Serialises all commands for one device onto a dedicated thread.
+    """
+
+    def __init__(self, name, device):
+        self.name = name
+        self.device = device
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name=f"device-{name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, path, args, kwargs, reply):
+        self.queue.put((path, args, kwargs, reply))
+
+    def stop(self):
+        self.queue.put(None)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            path, args, kwargs, reply = item
+            try:
+                result = _resolve(self.device, path)(*args, **kwargs)
+                kind = REPLY
+            except Exception as e:
+                result, kind = e, ERROR
+            try:
+                reply(kind, result)
+            except Exception as e:
+                # A failed reply must never take the device worker down
+                print(f"Device server couldn't reply to {self.name}.{path}: {e}")
+
+
+class _ClientSession:
+    """
+    Server side state for one connected client.
+    """
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.stream = sock.makefile("rb")
+        self.lock = threading.Lock()
+        self.topics = set()
+        self.closed = False
+
+    def send(self, message):
+        self.send_payload(pickle.dumps(message, protocol=_PROTOCOL))
+
+    def send_payload(self, payload):
+        if self.closed:
+            return
+        try:
+            _send_payload(self.sock, self.lock, payload)
+        except OSError:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.server._drop_session(self)
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def run(self):
+        try:
+            while True:
+                message = _recv(self.stream)
+                kind = message[0]
+                if kind == CALL:
+                    self._call(*message[1:])
+                elif kind == SUBSCRIBE:
+                    self.topics.add(message[1])
+                elif kind == UNSUBSCRIBE:
+                    self.topics.discard(message[1])
+        except (ConnectionError, OSError, EOFError):
+            pass
+        finally:
+            self.close()
+
+    def _call(self, request_id, device, path, args, kwargs):
+        def reply(kind, value):
+            try:
+                payload = pickle.dumps((kind, request_id, value), protocol=_PROTOCOL)
+            except Exception as e:
+                if kind == ERROR:
+                    value = RemoteError(f"{type(value).__name__}: {value}")
+                else:
+                    value = RemoteError(f"{device}.{path} returned an unpicklable "
+                                        f"{type(value).__name__}: {e}")
+                payload = pickle.dumps((ERROR, request_id, value), protocol=_PROTOCOL)
+            self.send_payload(payload)
+
+        worker = self.server.workers.get(device)
+        if worker is None:
+            reply(ERROR, KeyError(f"Unknown device '{device}'"))
+            return
+        worker.submit(path, args, kwargs, reply)
+
+
+class DeviceServer:
+    """
+    Owns the device connections and serves their methods to local clients.
+    """
+
+    def __init__(self, devices, address=DEFAULT_ADDRESS):
+        """
+        Parameters
+        ----------
+        devices : dict
+            Mapping of name to an already connected device instance.
+        address : tuple or str, optional
+            (host, port) for TCP or a filesystem path for a Unix socket.
+            The default is a per-user Unix socket in the temp directory, or
+            127.0.0.1:50545 where Unix sockets are unavailable.
+
+        Returns
+        -------
+        None.
+
+        """
+        if not isinstance(address, str) and address[0] not in ("127.0.0.1", "localhost", "::1"):
+            raise ValueError("The device server may only bind to the loopback interface")
+        self.address = address
+        self.workers = {name: _DeviceWorker(name, device) for name, device in devices.items()}
+        self.sessions = set()
+        self._sessions_lock = threading.Lock()
+        self._listener = None
+        self._running = threading.Event()
+        self._telemetry = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """
+        Bind the listening socket and accept clients on a background thread.
+        """
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        self._listener = _open_socket(self.address)
+        if isinstance(self.address, str):
+            # Owner-only from the moment the socket file exists
+            umask = os.umask(0o177)
+            try:
+                self._listener.bind(self.address)
+            finally:
+                os.umask(umask)
+        else:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._listener.bind(self.address)
+        self._listener.listen()
+        self._running.set()
+        threading.Thread(target=self._accept_loop, name="device-server", daemon=True).start()
+        for args in self._telemetry:
+            self._start_telemetry(*args)
+        print(f"Device server listening on {self.address}")
+
+    def serve_forever(self):
+        """
+        Start the server and block until interrupted.
+        """
+        self.start()
+        try:
+            while self._running.is_set():
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Close all client sessions and stop the device workers. The devices
+        themselves are left connected; they belong to the caller.
+        """
+        if not self._running.is_set():
+            return
+        self._running.clear()
+        try:
+            self._listener.close()
+        except OSError:
+            pass
+        with self._sessions_lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.close()
+        for worker in self.workers.values():
+            worker.stop()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        print("Device server stopped")
+
+    def publish(self, topic, value):
+        """
+        Push a telemetry value to every client subscribed to the topic.
+
+        Parameters
+        ----------
+        topic : str
+            Topic name.
+        value : object
+            Any picklable value.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self._sessions_lock:
+            sessions = [s for s in self.sessions if topic in s.topics]
+        if not sessions:
+            return
+        payload = pickle.dumps((EVENT, topic, time.monotonic(), value), protocol=_PROTOCOL)
+        for session in sessions:
+            session.send_payload(payload)
+
+    def add_telemetry(self, topic, device, path, interval, *args, **kwargs):
+        """
+        Periodically call a device method through its worker (so it never
+        interleaves with client commands) and publish the result.
+
+        Parameters
+        ----------
+        topic : str
+            Topic the result is published on.
+        device : str
+            Device name.
+        path : str
+            Dotted method path on the device, e.g. "settings.get".
+        interval : float
+            Polling period [s].
+
+        Returns
+        -------
+        None.
+
+        """
+        self._telemetry.append((topic, device, path, interval, args, kwargs))
+        if self._running.is_set():
+            self._start_telemetry(topic, device, path, interval, args, kwargs)
+
+    def _start_telemetry(self, topic, device, path, interval, args, kwargs):
+        worker = self.workers[device]
+        # Set while a poll is queued or running on the worker
+        busy = threading.Event()
+
+        def reply(kind, value):
+            busy.clear()
+            if kind == REPLY:
+                self.publish(topic, value)
+
+        def loop():
+            deadline = time.monotonic()
+            while self._running.is_set():
+                # Skip the tick rather than queue polls behind a slow device
+                if not busy.is_set():
+                    busy.set()
+                    worker.submit(path, args, kwargs, reply)
+                deadline += interval
+                time.sleep(max(0.0, deadline - time.monotonic()))
+
+        threading.Thread(target=loop, name=f"telemetry-{topic}", daemon=True).start()
+
+    def _accept_loop(self):
+        while self._running.is_set():
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                return
+            if sock.family != getattr(socket, "AF_UNIX", None):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _ClientSession(self, sock)
+            with self._sessions_lock:
+                self.sessions.add(session)
+            threading.Thread(target=session.run, name="device-session", daemon=True).start()
+
+    def _drop_session(self, session):
+        with self._sessions_lock:
+            self.sessions.discard(session)
+
+
+class DeviceClient:
+    """
+    Connection to a DeviceServer. Calls may be issued from any thread and are
+    pipelined over the single socket.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        """
+        Parameters
+        ----------
+        address : tuple or str, optional
+            Server address. The default is DEFAULT_ADDRESS, as for the server.
+        timeout : float, optional
+            Default time to wait for a reply [s]. The default is None (wait
+            indefinitely).
+
+        Returns
+        -------
+        None.
+
+        """
+        self.address = address
+        self.timeout = timeout
+        self.sock = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._next_id = 0
+        self._subscribers = {}
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connect(self):
+        self.sock = _open_socket(self.address)
+        self.sock.connect(self.address)
+        threading.Thread(target=self._read_loop, name="device-client", daemon=True).start()
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def submit(self, device, method, *args, **kwargs):
+        """
+        Issue a call without waiting for it to complete.
+
+        Parameters
+        ----------
+        device : str
+            Device name on the server.
+        method : str
+            Dotted method path, e.g. "move_absolute" or "settings.get".
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the return value of the remote call.
+
+        """
+        future = Future()
+        with self._pending_lock:
+            request_id = self._next_id
+            self._next_id += 1
+            self._pending[request_id] = future
+        _send(self.sock, self._lock, (CALL, request_id, device, method, args, kwargs))
+        return future
+
+    def call(self, device, method, *args, **kwargs):
+        """
+        Issue a call and block until its reply arrives.
+        """
+        return self.submit(device, method, *args, **kwargs).result(self.timeout)
+
+    def proxy(self, device):
+        """
+        Return an object whose method calls are forwarded to the named device.
+        """
+        return _DeviceProxy(self, device)
+
+    def subscribe(self, topic, callback):
+        """
+        Register a callback(t_monotonic, value) for a telemetry topic. The
+        callback runs on the client reader thread and should return quickly.
+        """
+        first = topic not in self._subscribers
+        self._subscribers.setdefault(topic, []).append(callback)
+        if first:
+            _send(self.sock, self._lock, (SUBSCRIBE, topic))
+
+    def unsubscribe(self, topic, callback=None):
+        callbacks = self._subscribers.get(topic, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if callback is None or not callbacks:
+            self._subscribers.pop(topic, None)
+            _send(self.sock, self._lock, (UNSUBSCRIBE, topic))
+
+    def _read_loop(self):
+        stream = self.sock.makefile("rb")
+        try:
+            while True:
+                message = _recv(stream)
+                kind = message[0]
+                if kind == EVENT:
+                    _, topic, t, value = message
+                    for callback in list(self._subscribers.get(topic, ())):
+                        try:
+                            callback(t, value)
+                        except Exception as e:
+                            # A failing subscriber must not stop the replies
+                            print(f"Device client callback for '{topic}' failed: {e}")
+                    continue
+                _, request_id, value = message
+                with self._pending_lock:
+                    future = self._pending.pop(request_id, None)
+                if future is None:
+                    continue
+                if kind == REPLY:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        except (ConnectionError, OSError, EOFError):
+            pass
+        finally:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(ConnectionError("Device server connection closed"))
+
+
+class _DeviceProxy:
+    """
+    Forwards attribute calls to a remote device, e.g. proxy.settings.get().
+    """
+
+    def __init__(self, client, device, path=""):
+        self._client = client
+        self._device = device
+        self._path = path
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        path = f"{self._path}.{name}" if self._path else name
+        return _DeviceProxy(self._client, self._device, path)
+
+    def __call__(self, *args, **kwargs):
+        return self._client.call(self._device, self._path, *args, **kwargs)
+
+
+if __name__ == "__main__":
+
+    from src.devices.ASR import ASR
+    from src.devices.Q545 import Q545
+
+    with ASR(8) as asr, Q545() as q545:
+        server = DeviceServer({"asr": asr, "q545": q545})
+        server.add_telemetry("asr.settings", "asr", "settings.get", interval=5.0)
+        server.serve_forever()
@@ -1,6 +1,8 @@
 
 from abc import ABC, abstractmethod
 
+import numpy as np
+
 class Stage(ABC):
     """
     Abstract base class for all stages
@@ -34,6 +36,74 @@ class Stage(ABC):
         """
         pass
 
+    def move_sequence(self, points, units, on_arrival=None):
+        """
+        Move through a sequence of points. The whole trajectory is converted
+        to device units and checked against the travel limits before the
+        first move, so an out-of-range point fails the call up front instead
+        of part way through a scan.
+
+        Parameters
+        ----------
+        points : array_like
+            Targets, shape (n, axes). A 1D array is taken as n single-axis
+            targets.
+        units : str
+            Unit of the targets (e.g. "mm", "um", "nm").
+        on_arrival : callable, optional
+            on_arrival(index, point) called once the stage is at each point,
+            e.g. to trigger an acquisition. The default is None.
+
+        Raises
+        ------
+        ValueError
+            A point is out of range or has the wrong number of axes.
+
+        Returns
+        -------
+        list
+            Return values of on_arrival for each point (None if not given).
+
+        """
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim == 1:
+            points = points[:, None]
+        lower, upper = (np.asarray(lim, dtype=np.float64) for lim in self._limits())
+        if points.shape[1] != lower.size:
+            raise ValueError(f"Points have {points.shape[1]} axes, stage has {lower.size}")
+        native = points * self._unit_scale(units)
+        bad = np.flatnonzero(np.any((native < lower) | (native > upper), axis=1))
+        if bad.size:
+            raise ValueError(f"{bad.size} point(s) out of range, first is #{bad[0]}: "
+                             f"{points[bad[0]].tolist()} {units} (limits {lower.tolist()} to {upper.tolist()} native)")
+        results = []
+        for index, target in enumerate(native):
+            self._move_to(target)
+            results.append(on_arrival(index, points[index]) if on_arrival is not None else None)
+        return results
+
+    @abstractmethod
+    def _limits(self):
+        """
+        Return (lower, upper) travel limits per axis in device units.
+        """
+        pass
+
+    @abstractmethod
+    def _unit_scale(self, units):
+        """
+        Return the factor converting `units` to device units.
+        """
+        pass
+
+    @abstractmethod
+    def _move_to(self, target):
+        """
+        Move to an already validated target in device units and wait for
+        arrival, with no per-call checks or printing.
+        """
+        pass
+
     def __enter__(self):
         """
         Enter the context manager
@@ -6,9 +6,13 @@ Routine functions for Vortran devices (specifically the Stradus diode).
 import serial
 import time
 
+from src.devices.faults import CommandError, DeviceDisconnected, DeviceTimeout, recovering
+from src.functions import timeline
+from src.functions.telemetry import ActivityLock
+
 class Vortran:
     
-    def __init__(self,port,baudrate=115200,timeout=1):
+    def __init__(self,port,baudrate=115200,timeout=0.25):
         """
         Initialize connection to a Vortran laser
 
@@ -19,7 +23,9 @@ class Vortran:
         baudrate : int, optional
             Communication speed. The default is 115200.
         timeout : float, optional
-            Read timeout in seconds. The default is 1.
+            Reply deadline for each command in seconds. The laser answers
+            within milliseconds, so a missing reply is reported as a
+            DeviceTimeout after this long. The default is 0.25.
 
         Returns
         -------
@@ -31,6 +37,7 @@ class Vortran:
         self.timeout = timeout
         self.connection = None
         self.mode = None
+        self.lock = ActivityLock()
     
     def __enter__(self):
         self.connect()
@@ -47,14 +54,26 @@ class Vortran:
     def connect(self):
         try:
             self.connection = serial.Serial(self.port,self.baudrate,timeout=self.timeout)
-            print(f"Connected to Vortran device on COM{self.port}")
+            print(f"Connected to Vortran device on {self.port}")
         except serial.SerialException as e:
-            print(f"Error connecting to Vortran device: {e}")
+            raise DeviceDisconnected(f"Error connecting to Vortran device: {e}") from e
             
     def disconnect(self):
         if self.connection and self.connection.is_open:
             self.connection.close()
             print("Disconnected from Vortran device")
+
+    def _recover(self):
+        """
+        Reopen the serial port after a dropped connection and discard any
+        partial reply.
+        """
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+        self.connection = serial.Serial(self.port,self.baudrate,timeout=self.timeout)
+        self.connection.reset_input_buffer()
         
     def activate(self):
         """
@@ -88,21 +107,25 @@ class Vortran:
         
         Returns
         -------
-        None.
+        dict
+            Raw response to each condition query.
 
         """
         
         settings = {"Device ID": "?LI",
                     "Firmware version": "?FV",
-                    "Baseplate temperature": "?LH",
+                    "Baseplate temperature": "?BPT",
                     "Operating hours": "?LH",
                     "Settings": "?LS",
                     "Measured power": "?LP",
                     "Set power": "?LPS",
                     "Measured wavelength": "?LW"}
+        conditions = {}
         for key,command in settings.items():
             response = self.sendCommand(command)
+            conditions[key] = response
             print(f"{key}: {response}\r")
+        return conditions
         
     def setPower(self,power):
         """
@@ -115,13 +138,14 @@ class Vortran:
 
         Returns
         -------
-        None.
+        float
+            Measured output power [mW] after the change.
 
         """
         if not (0 <= power <= 100):
-            ValueError("Power percentage must be between 0 and 100")
+            raise ValueError("Power percentage must be between 0 and 100")
         self.sendCommand(f"LP={power}")
-        self.getPower
+        return self.getPower()
         
     def getPower(self):
         """
@@ -130,11 +154,16 @@ by the light loop.
 
         Returns
         -------
-        None.
+        float
+            Measured output power [mW].
 
         """
         response = self.sendCommand("?LP")
         print(f"Measured output power: {response}")
+        try:
+            return float(response)
+        except ValueError:
+            raise CommandError(f"Unrecognised response to power query: {response}")
         
     def setMode(self,mode):
         """
@@ -159,7 +188,7 @@ by the light loop.
             "ANALOG": "EPC=1"
         }
         if mode not in mode_map:
-            ValueError(f"Invalid mode. Supported modes are: {list(mode_map.keys())}")
+            raise ValueError(f"Invalid mode. Supported modes are: {list(mode_map.keys())}")
         self.sendCommand(mode_map[mode])
         response = self.getMode()
         print(f"Output mode: {response}")
@@ -170,7 +199,7 @@ by the light loop.
 
         Raises
         ------
-        Exception
+        CommandError
             Unrecognised response to digital modulation query (?PUL)
             Unrecognised response to external control query (?EPC)
 
@@ -190,25 +219,33 @@ by the light loop.
             elif response == "1":
                 self.mode = "DIGITAL"
             else:
-                Exception("Unrecognised response to digital modulation query")
+                raise CommandError(f"Unrecognised response to digital modulation query: {response}")
         else:
-            Exception("Unrecognised response to external control query")
+            raise CommandError(f"Unrecognised response to external control query: {response}")
         return self.mode
             
         
-    def sendCommand(self,command):
+    @recovering((serial.SerialException,))
+    def sendCommand(self,command,timeout=None):
         """
-        Send a command to the laser and return the response
+        Send a command to the laser and return the response. A dropped serial
+        connection is reopened and the command retried once.
 
         Parameters
         ----------
         command : string
             Command to send to the device. Format must align with Vortran documentation
+        timeout : float, optional
+            Reply deadline for this command [s]. The default is the
+            connection timeout.
 
         Raises
         ------
-        ConnectionError
-            The device hasn't been connected properly. Check the serial connection '
+        DeviceDisconnected
+            The device hasn't been connected properly, or the connection was
+            lost and could not be restored. Check the serial connection
+        DeviceTimeout
+            No reply arrived before the deadline
 
         Returns
         -------
@@ -217,11 +254,18 @@ by the light loop.
 
         """
         if not self.connection or not self.connection.is_open:
-            ConnectionError("Connection to the Vortran device is not open")
-            return
-        self.connection.write((command+'\r').encode())
-        response = self.connection.readline().decode().strip()
-        return response
+            raise DeviceDisconnected("Connection to the Vortran device is not open")
+        with self.lock, timeline.span("Vortran", command.split("=")[0]):
+            if timeout is not None and timeout != self.connection.timeout:
+                self.connection.timeout = timeout
+            self.connection.write((command+'\r').encode())
+            line = self.connection.readline()
+            if timeout is not None and self.connection.timeout != self.timeout:
+                self.connection.timeout = self.timeout
+        if not line.endswith(b'\n') and not line.endswith(b'\r'):
+            raise DeviceTimeout(f"No reply from Vortran to '{command}' within "
+                                f"{timeout if timeout is not None else self.timeout} s")
+        return line.decode().strip()
    
         
 """
@@ -0,0 +1,401 @@
+"""
+Record and replay of device traffic for offline performance debugging.
+
+A TransportRecorder wraps the objects the drivers talk to (the serial port
+of Vortran, the GCSDevice of Q545 and the zaber device/axes of ASR) in
+proxies that log every call, its arguments, its result or exception and how
+long the hardware took to answer. Records are appended to a compact binary
+file.
+
+A TransportPlayer installs replay objects in the same places, so the
+unmodified drivers run against the recording with no hardware attached.
+Each call returns the recorded result after sleeping for the recorded
+device latency (optionally scaled), which leaves the Python control path as
+the only live part of the run - exactly what needs profiling.
+
+Example usage
+-------------
+    # on the rig
+    with TransportRecorder("scan.rec") as recorder, Q545() as q545, Vortran(3) as laser:
+        recorder.attach(q545)
+        recorder.attach(laser)
+        run_scan(q545, laser)
+
+    # at a desk
+    player = TransportPlayer("scan.rec", speed=1.0)
+    q545, laser = player.attach(Q545()), player.attach(Vortran(3))
+    run_scan(q545, laser)
+"""
+
+import pickle
+import struct
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+CALL = 0
+RAISE = 1
+GET = 2
+
+# t_start, duration, kind, payload length
+_RECORD = struct.Struct("<dfBI")
+_MAGIC = b"SCIREC1\n"
+
+_VALUE_TYPES = (int, float, str, bool, bytes, type(None), list, tuple, dict)
+
+# Driver attributes that hold the hardware connection objects
+ATTACH_POINTS = {
+    "Vortran": ("connection",),
+    "Q545": ("pidevice",),
+    "ASR": ("zaberdevice", "axes"),
+}
+
+
+def _picklable(value):
+    """
+    Return value if it can be pickled, otherwise its repr.
+    """
+    try:
+        pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return repr(value)
+    return value
+
+
+def _same(a, b):
+    """
+    Equality for recorded call arguments, tolerating NumPy arrays.
+    """
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return np.array_equal(a, b)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_same(a[k], b[k]) for k in a)
+    try:
+        return bool(a == b)
+    except Exception:
+        return False
+
+
+class ReplayMismatch(RuntimeError):
+    """
+    Raised when the driver issues a call that does not match the recording.
+    """
+    pass
+
+
+class RecordingProxy:
+    """
+    Forwards attribute access to a real object and logs it.
+    """
+
+    def __init__(self, target, recorder, path):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_recorder", recorder)
+        object.__setattr__(self, "_path", path)
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        path = f"{self._path}.{name}"
+        if callable(value):
+            recorder = self._recorder
+
+            def call(*args, **kwargs):
+                t = time.monotonic()
+                try:
+                    result = value(*args, **kwargs)
+                except Exception as e:
+                    recorder.write(t, time.monotonic() - t, RAISE, path, args, kwargs, e)
+                    raise
+                recorder.write(t, time.monotonic() - t, CALL, path, args, kwargs, result)
+                return result
+            return call
+        if isinstance(value, _VALUE_TYPES):
+            self._recorder.write(time.monotonic(), 0.0, GET, path, (), {}, value)
+            return value
+        return RecordingProxy(value, self._recorder, path)
+
+
+class TransportRecorder:
+    """
+    Writes device traffic to a binary recording file.
+    """
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            Recording file path (overwritten).
+
+        Returns
+        -------
+        None.
+
+        """
+        self.path = path
+        self.records = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._file = open(self.path, "wb")
+        self._file.write(_MAGIC)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        print(f"Recorded {self.records} device transactions to {self.path}")
+
+    def write(self, t, duration, kind, path, args, kwargs, result):
+        try:
+            payload = pickle.dumps((path, args, kwargs, result), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # Keep what can be kept and store the rest as repr strings
+            args = tuple(_picklable(a) for a in args)
+            kwargs = {k: _picklable(v) for k, v in kwargs.items()}
+            payload = pickle.dumps((path, args, kwargs, _picklable(result)),
+                                   protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._file.write(_RECORD.pack(t, duration, kind, len(payload)))
+            self._file.write(payload)
+            self.records += 1
+
+    def wrap(self, target, path):
+        """
+        Return a recording proxy for any object.
+        """
+        return RecordingProxy(target, self, path)
+
+    def attach(self, driver):
+        """
+        Replace the connection objects of a connected driver with recording
+        proxies.
+
+        The driver's _recover() opens new connection objects after a
+        dropped connection, so it is wrapped to attach the proxies again
+        and the recording continues across reconnects.
+
+        Parameters
+        ----------
+        driver : ASR, Q545 or Vortran
+            A driver after its connection has been opened.
+
+        Returns
+        -------
+        The driver.
+
+        """
+        self._wrap_connections(driver)
+        recover = getattr(driver, "_recover", None)
+        if recover is not None:
+            def recover_and_attach():
+                try:
+                    recover()
+                finally:
+                    self._wrap_connections(driver)
+            driver._recover = recover_and_attach
+        return driver
+
+    def _owns(self, value):
+        return isinstance(value, RecordingProxy) and value._recorder is self
+
+    def _wrap_connections(self, driver):
+        """
+        Wrap every connection object of a driver that is not already one of
+        this recorder's proxies.
+        """
+        name = type(driver).__name__
+        for attr in ATTACH_POINTS[name]:
+            value = getattr(driver, attr)
+            if attr == "axes":
+                if all(self._owns(axis) for axis in value):
+                    continue
+                proxies = []
+                for axis in value:
+                    proxy = axis if self._owns(axis) else self.wrap(axis, f"{name}.{axis.name}")
+                    setattr(driver, axis.name, proxy)
+                    proxies.append(proxy)
+                driver.axes = proxies
+            elif value is not None and not self._owns(value):
+                setattr(driver, attr, self.wrap(value, f"{name}.{attr}"))
+
+
+def read_recording(path):
+    """
+    Read a recording file.
+
+    Returns
+    -------
+    list of tuple
+        (t, duration, kind, path, args, kwargs, result) per transaction.
+
+    """
+    records = []
+    with open(path, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"{path} is not a device recording")
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                break
+            t, duration, kind, size = _RECORD.unpack(header)
+            payload = f.read(size)
+            if len(payload) < size:
+                break
+            records.append((t, duration, kind) + pickle.loads(payload))
+    return records
+
+
+class _ReplayObject:
+    """
+    Stands in for a recorded device object. Calls are answered from the
+    recording in order.
+    """
+
+    def __init__(self, player, path):
+        object.__setattr__(self, "_player", player)
+        object.__setattr__(self, "_path", path)
+        object.__setattr__(self, "_local", {})
+
+    def __setattr__(self, name, value):
+        self._local[name] = value
+
+    def __getattr__(self, name):
+        if name in self._local:
+            return self._local[name]
+        path = f"{self._path}.{name}"
+        kind = self._player.peek_kind(path)
+        if kind == GET:
+            return self._player.next(path, GET)[1]
+        if kind is None and not self._player.has_prefix(path + "."):
+            raise ReplayMismatch(f"No recorded access to {path}")
+        if kind is None:
+            return _ReplayObject(self._player, path)
+
+        def call(*args, **kwargs):
+            return self._player.answer(path, args, kwargs)
+        return call
+
+
+class TransportPlayer:
+    """
+    Replays a recording into the drivers.
+    """
+
+    def __init__(self, path, speed=1.0, strict=True):
+        """
+        Parameters
+        ----------
+        path : str
+            Recording file.
+        speed : float or None, optional
+            Playback speed: 1.0 waits the recorded device latency, 10.0 waits
+            a tenth of it, None does not wait at all. The default is 1.0.
+        strict : bool, optional
+            Raise ReplayMismatch when a call differs from the next recorded
+            call on the same method path, in kind (call/attribute read) or in
+            its arguments. If False, the next recorded answer for the path is
+            returned whatever the arguments. Either way, calls are matched
+            per method path, so the interleaving of different methods is not
+            checked. The default is True.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.speed = speed
+        self.strict = strict
+        self.records = read_recording(path)
+        self._queues = defaultdict(deque)
+        for record in self.records:
+            self._queues[record[3]].append(record)
+        self._lock = threading.Lock()
+
+    def peek_kind(self, path):
+        queue = self._queues.get(path)
+        return queue[0][2] if queue else None
+
+    def has_prefix(self, prefix):
+        return any(key.startswith(prefix) and queue for key, queue in self._queues.items())
+
+    def next(self, path, kind=None, args=None, kwargs=None):
+        with self._lock:
+            queue = self._queues.get(path)
+            if not queue:
+                raise ReplayMismatch(f"Recording exhausted for {path}")
+            record = queue.popleft()
+        if self.strict:
+            if kind is not None and record[2] != kind:
+                raise ReplayMismatch(f"Expected {path} kind {kind}, recording has kind {record[2]}")
+            if args is not None and not (_same(tuple(args), tuple(record[4]))
+                                         and _same(dict(kwargs or {}), dict(record[5]))):
+                raise ReplayMismatch(f"{path} called with {args} {kwargs or ''}, "
+                                     f"recording has {record[4]} {record[5] or ''}")
+        return record[1], record[-1], record[2]
+
+    def answer(self, path, args=(), kwargs=None):
+        """
+        Return the next recorded result for a call, after the recorded
+        device latency. In strict mode the arguments must match the
+        recording.
+        """
+        duration, result, kind = self.next(path, args=args, kwargs=kwargs)
+        if self.speed:
+            time.sleep(duration / self.speed)
+        if kind == RAISE:
+            raise result if isinstance(result, BaseException) else RuntimeError(result)
+        return result
+
+    def channel(self, path):
+        return _ReplayObject(self, path)
+
+    def attach(self, driver):
+        """
+        Install replay objects in an unconnected driver, so it can be used
+        without entering its context manager.
+
+        Returns
+        -------
+        The driver.
+
+        """
+        name = type(driver).__name__
+        for attr in ATTACH_POINTS[name]:
+            if attr == "axes":
+                axis_names = sorted({key.split(".")[1] for key in self._queues
+                                     if key.startswith(f"{name}.axis")})
+                driver.axes = []
+                for axis_name in axis_names:
+                    axis = self.channel(f"{name}.{axis_name}")
+                    axis.name = axis_name
+                    setattr(driver, axis_name, axis)
+                    driver.axes.append(axis)
+            else:
+                setattr(driver, attr, self.channel(f"{name}.{attr}"))
+        return driver
+
+    def summary(self):
+        """
+        Total recorded device time per method path.
+
+        Returns
+        -------
+        dict
+            path -> (calls, total seconds), sorted by total time.
+
+        """
+        totals = defaultdict(lambda: [0, 0.0])
+        for record in self.records:
+            totals[record[3]][0] += 1
+            totals[record[3]][1] += record[1]
+        return dict(sorted(((k, tuple(v)) for k, v in totals.items()), key=lambda kv: -kv[1][1]))
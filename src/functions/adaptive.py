@@ -0,0 +1,249 @@
+"""
+Adaptive-resolution XY scanning.
+
+The scan starts from a coarse grid of regions and repeatedly subdivides the
+regions whose samples differ the most (intensity range, gradient or spectral
+variance), so points are concentrated on features instead of empty
+background. Each batch of new points is ordered with the travel-time planner
+in src.functions.scan before being measured. The scan stops when the point or
+time budget is used up or no region exceeds the refinement threshold.
+
+Example usage
+-------------
+    def measure(point):
+        asr.move_absolute(list(point), "um")
+        return spectrometer.read()
+
+    scan = AdaptiveScan(measure, bounds=(0, 0, 5000, 5000), coarse=(8, 8),
+                        threshold=50.0, min_size=10.0, max_points=4000,
+                        speed=10000.0, accel=60000.0)
+    points, values = scan.run()
+    image = scan.to_grid((500, 500))
+"""
+
+import heapq
+import time
+
+import numpy as np
+
+from src.functions.scan import order_points
+
+
+def region_score(values, metric="range"):
+    """
+    Score how much a region's samples disagree.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Sample values, shape (samples,) for scalars or (samples, channels)
+        for spectra.
+    metric : str, optional
+        "range" (max - min), "std" (standard deviation) or "spectral" (mean
+        per-channel variance, for spectra). The default is "range".
+
+    Returns
+    -------
+    float
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if metric == "range":
+        return float(np.ptp(values.reshape(len(values), -1), axis=0).max())
+    if metric == "std":
+        return float(values.reshape(len(values), -1).std(axis=0).max())
+    if metric == "spectral":
+        return float(values.reshape(len(values), -1).var(axis=0).mean())
+    raise ValueError(f"Unknown metric '{metric}'")
+
+
+class AdaptiveScan:
+    """
+    Quadtree-refined point scan over a rectangular area.
+    """
+
+    def __init__(self, measure, bounds, coarse=(8, 8), threshold=0.0, min_size=0.0,
+                 max_points=None, time_budget=None, metric="range", batch=16,
+                 speed=1.0, accel=np.inf, start=None):
+        """
+        Parameters
+        ----------
+        measure : callable
+            measure(point) moves to an (x, y) point and returns a scalar or a
+            spectrum.
+        bounds : tuple of float
+            (x0, y0, x1, y1) scan area in stage units.
+        coarse : tuple of int, optional
+            Number of initial regions in x and y. The default is (8, 8).
+        threshold : float, optional
+            Regions scoring at or below this are not refined. The default is 0.
+        min_size : float, optional
+            Regions smaller than this (in either dimension) are not split.
+        max_points : int, optional
+            Point budget. The default is None (unlimited).
+        time_budget : float, optional
+            Time budget [s]. The default is None (unlimited).
+        metric : str, optional
+            Refinement metric, see region_score(). The default is "range".
+        batch : int, optional
+            Regions refined per planning batch. The default is 16.
+        speed, accel : float, optional
+            Stage motion model used to order each batch.
+        start : array_like, optional
+            Current stage position. The default is the lower-left corner.
+
+        Returns
+        -------
+        None.
+
+        """
+        if max_points is None and time_budget is None and threshold <= 0 and min_size <= 0:
+            raise ValueError("Specify a budget, a threshold or a minimum region size")
+        self.measure = measure
+        self.bounds = tuple(float(b) for b in bounds)
+        self.coarse = coarse
+        self.threshold = threshold
+        self.min_size = min_size
+        self.max_points = max_points
+        self.time_budget = time_budget
+        self.metric = metric
+        self.batch = batch
+        self.speed = speed
+        self.accel = accel
+        self.position = np.asarray(start if start is not None else self.bounds[:2], dtype=np.float64)
+        self.samples = {}
+        self.leaves = []
+        self._queue = []
+        self._t0 = None
+
+    @staticmethod
+    def _sample_points(region):
+        x0, y0, x1, y1 = region
+        xm, ym = (x0 + x1) / 2, (y0 + y1) / 2
+        return [(x0, y0), (x1, y0), (x0, y1), (x1, y1), (xm, ym)]
+
+    @staticmethod
+    def _split(region):
+        x0, y0, x1, y1 = region
+        xm, ym = (x0 + x1) / 2, (y0 + y1) / 2
+        return [(x0, y0, xm, ym), (xm, y0, x1, ym), (x0, ym, xm, y1), (xm, ym, x1, y1)]
+
+    def _key(self, point):
+        # Round so that corners shared by neighbouring regions are measured once
+        return (round(point[0], 9), round(point[1], 9))
+
+    def _budget_left(self):
+        if self.max_points is not None and len(self.samples) >= self.max_points:
+            return False
+        if self.time_budget is not None and time.monotonic() - self._t0 >= self.time_budget:
+            return False
+        return True
+
+    def _measure_batch(self, regions):
+        """
+        Measure every unsampled point of the given regions, in planned order.
+        Returns False if the budget ran out part way.
+        """
+        new = []
+        seen = set()
+        for region in regions:
+            for point in self._sample_points(region):
+                key = self._key(point)
+                if key not in self.samples and key not in seen:
+                    seen.add(key)
+                    new.append(key)
+        if not new:
+            return True
+        points = np.array(new, dtype=np.float64)
+        for index in order_points(points, self.position, self.speed, self.accel):
+            if not self._budget_left():
+                return False
+            point = points[index]
+            self.samples[new[index]] = np.asarray(self.measure(point))
+            self.position = point
+        return True
+
+    def _push(self, region):
+        values = [self.samples.get(self._key(p)) for p in self._sample_points(region)]
+        if any(v is None for v in values):
+            self.leaves.append(region)
+            return
+        score = region_score(np.stack(values), self.metric)
+        x0, y0, x1, y1 = region
+        splittable = min(x1 - x0, y1 - y0) / 2 >= self.min_size
+        if score > self.threshold and splittable:
+            # Weight by area so that large uncertain regions go first
+            heapq.heappush(self._queue, (-score * (x1 - x0) * (y1 - y0), region))
+        else:
+            self.leaves.append(region)
+
+    def run(self):
+        """
+        Run the scan until the budget is spent or nothing is left to refine.
+
+        Returns
+        -------
+        points : numpy.ndarray
+            Measured (x, y) points, shape (n, 2), in measurement order.
+        values : numpy.ndarray
+            Measured values, shape (n,) or (n, channels).
+
+        """
+        self._t0 = time.monotonic()
+        x0, y0, x1, y1 = self.bounds
+        xs = np.linspace(x0, x1, self.coarse[0] + 1)
+        ys = np.linspace(y0, y1, self.coarse[1] + 1)
+        regions = [(xs[i], ys[j], xs[i + 1], ys[j + 1])
+                   for j in range(self.coarse[1]) for i in range(self.coarse[0])]
+        complete = self._measure_batch(regions)
+        for region in regions:
+            self._push(region)
+        while complete and self._queue and self._budget_left():
+            batch = [heapq.heappop(self._queue)[1] for _ in range(min(self.batch, len(self._queue)))]
+            children = [child for region in batch for child in self._split(region)]
+            complete = self._measure_batch(children)
+            for child in children:
+                self._push(child)
+        self.leaves.extend(region for _, region in self._queue)
+        self._queue = []
+        print(f"Adaptive scan: {len(self.samples)} points in {time.monotonic() - self._t0:.1f} s")
+        return self.points, self.values
+
+    @property
+    def points(self):
+        return np.array(list(self.samples.keys()), dtype=np.float64).reshape(-1, 2)
+
+    @property
+    def values(self):
+        return np.stack(list(self.samples.values())) if self.samples else np.empty(0)
+
+    def to_grid(self, shape):
+        """
+        Render the scan onto a regular grid, filling each quadtree leaf with
+        the mean of its measured samples.
+
+        Parameters
+        ----------
+        shape : tuple of int
+            Output (rows, columns), rows along y.
+
+        Returns
+        -------
+        numpy.ndarray
+            Image of shape `shape` (plus the channel axis for spectra).
+
+        """
+        x0, y0, x1, y1 = self.bounds
+        rows, cols = shape
+        sample = next(iter(self.samples.values()))
+        grid = np.full(tuple(shape) + np.shape(sample), np.nan)
+        for region in self.leaves:
+            values = [self.samples[k] for k in map(self._key, self._sample_points(region)) if k in self.samples]
+            if not values:
+                continue
+            c0 = int(round((region[0] - x0) / (x1 - x0) * cols))
+            c1 = int(round((region[2] - x0) / (x1 - x0) * cols))
+            r0 = int(round((region[1] - y0) / (y1 - y0) * rows))
+            r1 = int(round((region[3] - y0) / (y1 - y0) * rows))
+            grid[r0:max(r1, r0 + 1), c0:max(c1, c0 + 1)] = np.mean(values, axis=0)
+        return grid
@@ -0,0 +1,273 @@
+"""
+Calibrated coordinate transforms between the sample, stage and image frames.
+
+Frames used on the instrument:
+- "stage": ASR position in micrometres (x, y).
+- "piezo": Q545 position in millimetres (z).
+- "image": camera pixel coordinates (col, row).
+- "sample": a sample-fixed frame, e.g. defined by fiducial marks.
+
+Transforms are stored as homogeneous affine matrices, so any chain of
+frames collapses into a single matrix and whole point arrays are converted
+with one NumPy matmul. A FocusSurface models the XY-dependent Z of a tilted
+sample, giving the Q545 target for every XY point of a scan.
+
+Example usage
+-------------
+    frames = CoordinateSystem()
+    transform, rms = AffineTransform.fit(fiducials_px, fiducials_um)
+    frames.add("image", "stage", transform)
+    frames.focus = FocusSurface.fit(xy_um, best_focus_mm)
+    targets_um = frames.convert(features_px, "image", "stage")
+    targets_z = frames.focus(targets_um)
+    frames.save("calibration.json")
+"""
+
+import json
+from collections import deque
+
+import numpy as np
+
+
+class AffineTransform:
+    """
+    Affine map between two frames of equal dimension, stored as a
+    homogeneous (d + 1) x (d + 1) matrix.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        self.dim = self.matrix.shape[0] - 1
+
+    def __repr__(self):
+        return f"AffineTransform({self.matrix.tolist()})"
+
+    def __matmul__(self, other):
+        """
+        Compose transforms: (a @ b)(p) = a(b(p)).
+        """
+        return AffineTransform(self.matrix @ other.matrix)
+
+    @classmethod
+    def identity(cls, dim=2):
+        return cls(np.eye(dim + 1))
+
+    @classmethod
+    def from_params(cls, scale=1.0, rotation=0.0, translation=(0.0, 0.0), flip=(False, False)):
+        """
+        Build a 2D transform from a scale (scalar or per axis), a rotation
+        [rad], an optional flip of each axis and a translation.
+        """
+        sx, sy = np.broadcast_to(np.asarray(scale, dtype=np.float64), (2,))
+        sx = -sx if flip[0] else sx
+        sy = -sy if flip[1] else sy
+        c, s = np.cos(rotation), np.sin(rotation)
+        matrix = np.eye(3)
+        matrix[:2, :2] = np.array([[c, -s], [s, c]]) @ np.diag([sx, sy])
+        matrix[:2, 2] = translation
+        return cls(matrix)
+
+    @classmethod
+    def fit(cls, src, dst):
+        """
+        Least-squares affine transform mapping src points onto dst points.
+
+        Parameters
+        ----------
+        src, dst : array_like
+            Corresponding points, shape (n, d) with n >= d + 1.
+
+        Returns
+        -------
+        transform : AffineTransform
+        rms : float
+            RMS residual in dst units.
+
+        """
+        src = np.asarray(src, dtype=np.float64)
+        dst = np.asarray(dst, dtype=np.float64)
+        n, d = src.shape
+        if n < d + 1:
+            raise ValueError(f"At least {d + 1} point pairs are needed for a {d}D affine fit")
+        A = np.hstack((src, np.ones((n, 1))))
+        solution, *_ = np.linalg.lstsq(A, dst, rcond=None)
+        matrix = np.eye(d + 1)
+        matrix[:d, :] = solution.T
+        transform = cls(matrix)
+        residual = transform(src) - dst
+        return transform, float(np.sqrt(np.mean(np.sum(residual ** 2, axis=1))))
+
+    def __call__(self, points):
+        """
+        Transform points of shape (..., d).
+        """
+        points = np.asarray(points, dtype=np.float64)
+        return points @ self.matrix[:self.dim, :self.dim].T + self.matrix[:self.dim, self.dim]
+
+    def inverse(self):
+        return AffineTransform(np.linalg.inv(self.matrix))
+
+    def to_dict(self):
+        return {"matrix": self.matrix.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["matrix"])
+
+
+class FocusSurface:
+    """
+    Polynomial model of the in-focus Z as a function of stage XY, used to
+    correct for sample tilt and bow.
+    """
+
+    def __init__(self, coefficients, order=1):
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self.order = order
+
+    @staticmethod
+    def _design(xy, order):
+        x, y = xy[..., 0], xy[..., 1]
+        terms = [np.ones_like(x), x, y]
+        if order >= 2:
+            terms += [x * x, x * y, y * y]
+        return np.stack(terms, axis=-1)
+
+    @classmethod
+    def fit(cls, xy, z, order=1):
+        """
+        Fit the surface from measured focus positions.
+
+        Parameters
+        ----------
+        xy : array_like
+            Stage positions, shape (n, 2).
+        z : array_like
+            In-focus Z at each position, shape (n,).
+        order : int, optional
+            1 for a tilted plane, 2 for a quadratic surface. The default is 1.
+
+        Returns
+        -------
+        FocusSurface
+
+        """
+        xy = np.asarray(xy, dtype=np.float64)
+        coefficients, *_ = np.linalg.lstsq(cls._design(xy, order), np.asarray(z, dtype=np.float64), rcond=None)
+        return cls(coefficients, order)
+
+    def __call__(self, xy):
+        """
+        In-focus Z for points of shape (..., 2).
+        """
+        return self._design(np.asarray(xy, dtype=np.float64), self.order) @ self.coefficients
+
+    def tilt(self):
+        """
+        Return the plane slopes (dz/dx, dz/dy).
+        """
+        return self.coefficients[1], self.coefficients[2]
+
+    def to_dict(self):
+        return {"coefficients": self.coefficients.tolist(), "order": self.order}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["coefficients"], data["order"])
+
+
+class CoordinateSystem:
+    """
+    Graph of frames connected by affine transforms. Conversions between any
+    two connected frames are composed once and cached.
+    """
+
+    def __init__(self):
+        self.transforms = {}
+        self.focus = None
+        self._cache = {}
+
+    def add(self, src, dst, transform):
+        """
+        Register the transform from frame src to frame dst (its inverse is
+        registered automatically).
+        """
+        self.transforms[(src, dst)] = transform
+        self.transforms[(dst, src)] = transform.inverse()
+        self._cache.clear()
+
+    def frames(self):
+        return sorted({frame for pair in self.transforms for frame in pair})
+
+    def transform(self, src, dst):
+        """
+        Return the composed transform from src to dst.
+        """
+        if src == dst:
+            dim = next(iter(self.transforms.values())).dim if self.transforms else 2
+            return AffineTransform.identity(dim)
+        key = (src, dst)
+        if key in self._cache:
+            return self._cache[key]
+        # Breadth-first search for the shortest chain of frames
+        previous = {src: None}
+        queue = deque([src])
+        while queue and dst not in previous:
+            frame = queue.popleft()
+            for a, b in self.transforms:
+                if a == frame and b not in previous:
+                    previous[b] = a
+                    queue.append(b)
+        if dst not in previous:
+            raise KeyError(f"No calibration connects '{src}' to '{dst}'")
+        composed = None
+        frame = dst
+        while previous[frame] is not None:
+            step = self.transforms[(previous[frame], frame)]
+            composed = step if composed is None else composed @ step
+            frame = previous[frame]
+        self._cache[key] = composed
+        return composed
+
+    def convert(self, points, src, dst):
+        """
+        Convert an array of points, shape (..., d), from frame src to dst.
+        """
+        return self.transform(src, dst)(points)
+
+    def calibrate(self, src, dst, src_points, dst_points):
+        """
+        Fit and register the transform between two frames from fiducial
+        measurements, e.g. the pixel position of a mark in several images
+        and the stage position each image was taken at.
+
+        Returns
+        -------
+        float
+            RMS residual of the fit in dst units.
+
+        """
+        transform, rms = AffineTransform.fit(src_points, dst_points)
+        self.add(src, dst, transform)
+        print(f"Calibrated {src} -> {dst}: RMS residual {rms:.3g}")
+        return rms
+
+    def save(self, path):
+        data = {
+            "transforms": [{"src": src, "dst": dst, **t.to_dict()}
+                           for (src, dst), t in self.transforms.items() if src < dst],
+            "focus": self.focus.to_dict() if self.focus is not None else None,
+        }
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        system = cls()
+        for entry in data["transforms"]:
+            system.add(entry["src"], entry["dst"], AffineTransform.from_dict(entry))
+        if data.get("focus") is not None:
+            system.focus = FocusSurface.from_dict(data["focus"])
+        return system
@@ -0,0 +1,294 @@
+"""
+Closed-loop drift compensation for long acquisitions.
+
+A DriftTracker periodically measures how far the sample has drifted from a
+reference: laterally by phase correlation of a camera image against a
+reference image, axially from a short focus sweep. A linear drift-rate model
+is fitted to the recent measurements and its prediction is added to every
+ASR/Q545 target, so the stage follows the drift between measurements
+without a full re-registration.
+
+Measurements are cheap but not free, so they are only taken when due and
+when the caller reports an idle window long enough to fit one in. A
+measurement image must show the reference field, taken after a
+drift-corrected move back to the reference position; the tracker adds the
+correction that was in effect back onto the residual shift it sees.
+
+Example usage
+-------------
+    tracker = DriftTracker(pixel_size=0.65, interval=120.0)
+    tracker.set_reference(camera.capture())       # at reference_xy
+
+    def capture_reference():
+        tracker.move_asr(asr, reference_xy, "um")
+        return camera.capture()
+
+    for point in points:
+        tracker.move_asr(asr, point, "um")
+        acquire()
+        tracker.maybe_measure(capture_reference, idle=time_until_next_point)
+"""
+
+import time
+
+import numpy as np
+
+from src.functions.stitching import phase_correlation
+
+
+def focus_metric(image):
+    """
+    Normalised variance focus metric (higher is sharper).
+    """
+    image = np.asarray(image, dtype=np.float64)
+    mean = image.mean()
+    return float(image.var() / mean) if mean > 0 else 0.0
+
+
+def best_focus(z, metric):
+    """
+    Locate the in-focus position from a focus sweep by fitting a parabola
+    through the sharpest sample and its neighbours.
+
+    Parameters
+    ----------
+    z : array_like
+        Sweep positions.
+    metric : array_like
+        Focus metric at each position.
+
+    Returns
+    -------
+    float
+
+    """
+    z = np.asarray(z, dtype=np.float64)
+    metric = np.asarray(metric, dtype=np.float64)
+    i = int(np.argmax(metric))
+    if i == 0 or i == len(z) - 1:
+        return float(z[i])
+    a, b, _ = np.polyfit(z[i - 1:i + 2], metric[i - 1:i + 2], 2)
+    return float(-b / (2 * a)) if a < 0 else float(z[i])
+
+
+class DriftTracker:
+    """
+    Measures sample drift and predicts the correction to apply to stage
+    targets.
+    """
+
+    def __init__(self, pixel_size=1.0, transform=None, interval=60.0, window=600.0,
+                 measure_time=0.2, sign=1.0, min_peak=0.05):
+        """
+        Parameters
+        ----------
+        pixel_size : float, optional
+            Image pixel size in ASR units. The default is 1.0.
+        transform : AffineTransform, optional
+            Calibrated stage -> image (col, row) transform from
+            src.functions.coordinates. Overrides pixel_size.
+        interval : float, optional
+            Time between drift measurements [s]. The default is 60.
+        window : float, optional
+            Only measurements from the last `window` seconds are used to fit
+            the drift rate. The default is 600.
+        measure_time : float, optional
+            Expected duration of one measurement [s], used to decide whether
+            an idle window is long enough. The default is 0.2.
+        sign : float, optional
+            +1 if moving the stage by +d moves the imaged sample content by
+            +d, -1 if it moves it the other way. The default is +1.
+        min_peak : float, optional
+            Image measurements with a weaker correlation peak are discarded.
+            The default is 0.05.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.pixel_size = pixel_size
+        self.transform = transform
+        self.interval = interval
+        self.window = window
+        self.measure_time = measure_time
+        self.sign = sign
+        self.min_peak = min_peak
+        self.reference = None
+        self.reference_z = None
+        self.t = []
+        self.offsets = []
+        self.last_measurement = -np.inf
+        self.applied = np.zeros(3)
+        self._t_ref = time.monotonic()
+        self._model = np.zeros((2, 3))
+
+    def set_reference(self, image, z=None, t=None):
+        """
+        Store the reference image (and in-focus Z) that drift is measured
+        against, and reset the drift model.
+        """
+        self.reference = np.asarray(image, dtype=np.float64)
+        self.reference_z = z
+        self._t_ref = time.monotonic() if t is None else t
+        self.t = []
+        self.offsets = []
+        self._model = np.zeros((2, 3))
+        self.applied = np.zeros(3)
+        self.last_measurement = self._t_ref
+
+    def _pixels_to_stage(self, shift):
+        """
+        Convert an image content shift (row, col) to a stage displacement.
+        """
+        row, col = shift
+        if self.transform is not None:
+            linear = np.linalg.inv(self.transform.matrix[:2, :2])
+            return linear @ np.array([col, row])
+        return np.array([col, row]) * self.pixel_size
+
+    def measure(self, image=None, z=None, t=None, correction=None):
+        """
+        Add a drift measurement.
+
+        Parameters
+        ----------
+        image : array_like, optional
+            Current image of the reference field, taken at the reference
+            position.
+        z : float, optional
+            Current absolute in-focus Z (e.g. from best_focus on a short
+            sweep).
+        t : float, optional
+            Measurement time. The default is time.monotonic().
+        correction : array_like, optional
+            (dx, dy) correction that was applied to the stage when the image
+            was taken. The image only shows the drift left over after it, so
+            it is added back before fitting. The default is the correction
+            of the last move_asr().
+
+        Returns
+        -------
+        numpy.ndarray or None
+            Measured (dx, dy, dz) drift as the stage offset that brings the
+            reference field back, in stage units, or None if the image could
+            not be registered.
+
+        """
+        t = time.monotonic() if t is None else t
+        offset = np.full(3, np.nan)
+        if image is not None:
+            if self.reference is None:
+                raise RuntimeError("Call set_reference() before measuring drift")
+            shift, peak = phase_correlation(self.reference, image)
+            if peak < self.min_peak:
+                print(f"Drift measurement rejected (correlation peak {peak:.3f})")
+                self.last_measurement = t
+                return None
+            applied = self.applied[:2] if correction is None else np.asarray(correction, dtype=np.float64)[:2]
+            # Content moves by sign * stage motion, so the stage has to move
+            # against the content shift to bring the field back
+            offset[:2] = applied - self.sign * self._pixels_to_stage(shift)
+        if z is not None and self.reference_z is not None:
+            offset[2] = z - self.reference_z
+        self.t.append(t)
+        self.offsets.append(offset)
+        self.last_measurement = t
+        self._fit()
+        return offset
+
+    def _fit(self):
+        """
+        Fit drift(t) = d0 + rate * (t - t_ref) per axis to the recent
+        measurements, with the reference as an exact zero at t_ref.
+        """
+        t = np.array(self.t)
+        offsets = np.array(self.offsets)
+        recent = t >= t[-1] - self.window
+        t, offsets = t[recent], offsets[recent]
+        model = np.zeros((2, 3))
+        for axis in range(3):
+            valid = ~np.isnan(offsets[:, axis])
+            if not np.any(valid):
+                continue
+            ta = np.append(t[valid] - self._t_ref, 0.0)
+            da = np.append(offsets[valid, axis], 0.0)
+            model[:, axis] = np.polyfit(ta, da, 1)[::-1]
+        self._model = model
+
+    @property
+    def rate(self):
+        """
+        Current drift-rate estimate (dx, dy, dz) per second.
+        """
+        return self._model[1].copy()
+
+    def predict(self, t=None):
+        """
+        Predicted drift (dx, dy, dz) at time t (default now).
+        """
+        t = time.monotonic() if t is None else t
+        return self._model[0] + self._model[1] * (t - self._t_ref)
+
+    def correct(self, targets, t=None):
+        """
+        Apply the predicted drift to stage targets.
+
+        Parameters
+        ----------
+        targets : array_like
+            (x, y), (x, y, z) or arrays of them, shape (..., 2 or 3).
+
+        Returns
+        -------
+        numpy.ndarray
+            Corrected targets.
+
+        """
+        targets = np.asarray(targets, dtype=np.float64)
+        return targets + self.predict(t)[:targets.shape[-1]]
+
+    def due(self, t=None):
+        t = time.monotonic() if t is None else t
+        return t - self.last_measurement >= self.interval
+
+    def maybe_measure(self, capture, idle=np.inf, focus=None):
+        """
+        Take a measurement if one is due and fits in the idle window.
+
+        Parameters
+        ----------
+        capture : callable
+            Returns the current image of the reference field.
+        idle : float, optional
+            Time available before the next foreground action [s].
+        focus : callable, optional
+            Returns the current in-focus Z.
+
+        Returns
+        -------
+        bool
+            True if a measurement was taken.
+
+        """
+        if not self.due() or idle < self.measure_time:
+            return False
+        self.measure(capture(), focus() if focus is not None else None)
+        return True
+
+    def move_asr(self, asr, targets, units):
+        """
+        Move the ASR to drift-corrected XY targets. The tracker works in the
+        same units as `targets`.
+        """
+        correction = self.predict()[:2]
+        asr.move_absolute((np.asarray(targets[:2], dtype=np.float64) + correction).tolist(), units)
+        self.applied[:2] = correction
+
+    def move_q545(self, q545, target):
+        """
+        Move the Q545 to a drift-corrected Z target.
+        """
+        correction = self.predict()[2]
+        q545.move_absolute(float(target + correction))
+        self.applied[2] = correction
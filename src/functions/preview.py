@@ -0,0 +1,225 @@
+"""
+Decimated live preview decoupled from full-rate acquisition.
+
+The acquisition loop hands every frame or spectrum to a PreviewTap. The tap
+returns immediately unless a viewer is subscribed and a preview is due
+under the display rate cap; only then does it reduce the data (stride
+downsampling and/or pixel binning of a view of the acquisition buffer) and
+publish the small result. Each subscriber reads from its own latest-value
+channel, which only ever holds the newest preview, so a slow viewer drops
+stale previews instead of queueing them or slowing acquisition down.
+
+Example usage
+-------------
+    tap = PreviewTap(max_rate=15, downsample=2, binning=2)
+
+    # acquisition thread
+    for frame in camera.frames():
+        store(frame)
+        tap.offer(frame)
+
+    # viewer thread
+    with tap.subscribe() as preview:
+        for t, image in preview:
+            display(image)
+"""
+
+import threading
+import time
+
+import numpy as np
+
+
+class LatestValue:
+    """
+    Single-slot channel that keeps only the most recent item.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._version = 0
+        self._read = 0
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self._cond:
+            if self._version > self._read:
+                self.dropped += 1
+            self._item = item
+            self._version += 1
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Wait for an item newer than the last one read.
+
+        Returns
+        -------
+        object or None
+            The newest item, or None on timeout or once closed.
+
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._version > self._read or self.closed, timeout):
+                return None
+            if self._version <= self._read:
+                return None
+            self._read = self._version
+            return self._item
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+def reduce_preview(data, downsample=1, binning=1):
+    """
+    Downsample by striding and then bin by averaging blocks. Works on the
+    last two axes of an image or the last axis of a spectrum. Only the
+    reduced result is allocated.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Frame (..., rows, cols) or spectrum (..., pixels).
+    downsample : int, optional
+        Keep every n-th pixel. The default is 1.
+    binning : int, optional
+        Average n x n blocks (n for spectra). The default is 1.
+
+    Returns
+    -------
+    numpy.ndarray
+
+    """
+    axes = 2 if data.ndim >= 2 else 1
+    view = data[(Ellipsis,) + (slice(None, None, downsample),) * axes]
+    if binning == 1:
+        return np.array(view)
+    shape = view.shape[:-axes]
+    index = [Ellipsis]
+    for n in view.shape[-axes:]:
+        m = n // binning
+        shape += (m, binning)
+        index.append(slice(0, m * binning))
+    view = view[tuple(index)]
+    return view.reshape(shape).mean(axis=tuple(range(-1, -2 * axes, -2)), dtype=np.float32)
+
+
+class Subscription:
+    """
+    A viewer's handle on a PreviewTap. Iterating yields (t, preview) pairs.
+    """
+
+    def __init__(self, tap, timeout=1.0):
+        self.tap = tap
+        self.channel = LatestValue()
+        self.timeout = timeout
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        while not self.channel.closed:
+            item = self.channel.get(self.timeout)
+            if item is not None:
+                yield item
+
+    def get(self, timeout=None):
+        return self.channel.get(timeout)
+
+    def close(self):
+        self.tap.unsubscribe(self)
+
+
+class PreviewTap:
+    """
+    Rate-capped, reduced preview of a full-rate data stream.
+    """
+
+    def __init__(self, max_rate=20.0, decimate=1, downsample=1, binning=1):
+        """
+        Parameters
+        ----------
+        max_rate : float, optional
+            Maximum previews per second. The default is 20.
+        decimate : int, optional
+            Only consider every n-th item offered. The default is 1.
+        downsample : int, optional
+            Stride applied to each preview axis. The default is 1.
+        binning : int, optional
+            Block averaging applied after downsampling. The default is 1.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.min_period = 1.0 / max_rate if max_rate else 0.0
+        self.decimate = decimate
+        self.downsample = downsample
+        self.binning = binning
+        self.offered = 0
+        self.published = 0
+        self._subscribers = ()
+        self._lock = threading.Lock()
+        self._last = -np.inf
+
+    def subscribe(self, timeout=1.0):
+        """
+        Start receiving previews.
+
+        Returns
+        -------
+        Subscription
+
+        """
+        subscription = Subscription(self, timeout)
+        with self._lock:
+            self._subscribers = self._subscribers + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not subscription)
+        subscription.channel.close()
+
+    def offer(self, data, t=None):
+        """
+        Offer an acquired item. Called on the acquisition thread; returns
+        without touching the data unless a preview is due.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            Frame or spectrum. It is only read during this call, so the
+            acquisition buffer may be reused afterwards.
+        t : float, optional
+            Acquisition timestamp. The default is time.monotonic().
+
+        Returns
+        -------
+        bool
+            True if a preview was published.
+
+        """
+        self.offered += 1
+        subscribers = self._subscribers
+        if not subscribers or self.offered % self.decimate:
+            return False
+        now = time.monotonic()
+        if now - self._last < self.min_period:
+            return False
+        self._last = now
+        preview = reduce_preview(np.asarray(data), self.downsample, self.binning)
+        item = (now if t is None else t, preview)
+        for subscription in subscribers:
+            subscription.channel.put(item)
+        self.published += 1
+        return True
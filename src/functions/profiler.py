@@ -0,0 +1,360 @@
+"""
+Attribute the wall time of a scan to motion, settling, device I/O, detector
+readout, disk writes and unaccounted Python.
+
+ScanProfiler temporarily hooks the drivers for the duration of a with
+block:
+
+- motion: the move methods of ASR and Q545 (move_absolute, move_relative,
+  home and the batch _move_to).
+- motion/settle: the deadline waits of the drivers. Time until the polled
+  position stops changing is motion, the remainder until the controller
+  reports on target is settle.
+- io: every call on the connection objects (the serial port of Vortran, the
+  GCSDevice of Q545 and the zaber device/axes of ASR), i.e. the serial/USB
+  round trips. Polls made inside a wait count towards the wait. Connections
+  opened by a reconnect during the profile are not hooked, so their round
+  trips count as Python time.
+- readout and write: detector drivers, ScanRunner.acquire and the scan
+  journal, or any object/method hooked with hook() or timed with timed().
+
+Time is attributed exclusively (a move's own round trips are io, not
+motion), and whatever is left of the wall time is Python overhead. Only
+calls made on the thread that entered the profiler are counted, so a
+background TelemetryPoller does not distort the breakdown.
+
+Example usage
+-------------
+    runner = ScanRunner(points, move=asr.setPos, acquire=measure, journal=journal)
+    with ScanProfiler([asr, q545, laser], detectors={spectrometer: ["get_spectrum"]}) as profiler:
+        profiler.attach_runner(runner)
+        runner.run()
+    profiler.report()
+"""
+
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+from src.devices.transport import ATTACH_POINTS, RecordingProxy
+
+CATEGORIES = ("motion", "settle", "io", "readout", "write", "python")
+
+# Driver methods counted as commanded motion
+MOTION_METHODS = {
+    "ASR": ("move_absolute", "move_relative", "home", "_move_to"),
+    "Q545": ("move_absolute", "move_relative", "_move_to"),
+    "Vortran": (),
+}
+
+SUGGESTIONS = {
+    "motion": "Motion dominates: reorder points (order_points), raise maxspeed/accel, "
+              "or use move_sequence to overlap axes.",
+    "settle": "Settling dominates: loosen the on-target tolerance or servo settle window, "
+              "or acquire during the final approach.",
+    "io": "Serial/USB round trips dominate: batch commands, drop per-point read-backs "
+          "and position queries, or move polling to the telemetry idle gaps.",
+    "readout": "Detector readout dominates: shorten exposure, bin or crop on the detector, "
+               "or overlap readout with the next move.",
+    "write": "Disk writes dominate: reduce data at acquisition (ReductionPipeline), "
+             "batch writes, or raise the journal sync interval.",
+    "python": "Python overhead dominates: move per-point work out of the loop, "
+              "vectorise it, or hand it to a worker process.",
+}
+
+
+class _Frame:
+    __slots__ = ("category", "start", "children", "last_change")
+
+    def __init__(self, category, start):
+        self.category = category
+        self.start = start
+        self.children = 0.0
+        self.last_change = None
+
+
+class ScanProfiler:
+    """
+    Context manager that hooks drivers and breaks scan time into buckets.
+    """
+
+    def __init__(self, drivers=(), detectors=None, writers=None):
+        """
+        Parameters
+        ----------
+        drivers : list, optional
+            Connected ASR, Q545 and Vortran instances.
+        detectors : dict, optional
+            object -> list of method names, timed as readout.
+        writers : dict, optional
+            object -> list of method names, timed as write.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.drivers = list(drivers)
+        self.detectors = detectors or {}
+        self.writers = writers or {}
+        self.points = []
+        self.wall = 0.0
+        self._totals = defaultdict(float)
+        self._point = None
+        self._restore = []
+        self._thread = None
+        self._stack = []
+        self._start = None
+
+    def __enter__(self):
+        self._thread = threading.get_ident()
+        for driver in self.drivers:
+            self._hook_driver(driver)
+        for obj, methods in self.detectors.items():
+            self.hook(obj, methods, "readout")
+        for obj, methods in self.writers.items():
+            self.hook(obj, methods, "write")
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        self._close_point(end)
+        self.wall = end - self._start
+        for restore in reversed(self._restore):
+            restore()
+        self._restore = []
+
+    # Hooks
+
+    def _replace(self, obj, name, value):
+        """
+        Set an attribute for the duration of the profile. On exit it is
+        only put back if it still holds our value: a driver that reconnected
+        in the meantime (e.g. _recover() opening a new port) keeps its new
+        connection rather than getting the closed one back.
+        """
+        had = name in vars(obj) if hasattr(obj, "__dict__") else False
+        original = vars(obj).get(name) if had else None
+        setattr(obj, name, value)
+
+        def restore():
+            if getattr(obj, name, None) is not value:
+                return
+            if had:
+                setattr(obj, name, original)
+            else:
+                delattr(obj, name)
+        self._restore.append(restore)
+
+    def hook(self, obj, methods, category):
+        """
+        Time calls to methods of an object (or module) as a category until
+        the profiler exits.
+        """
+        for name in methods:
+            self._replace(obj, name, self.wrap(getattr(obj, name), category))
+
+    def wrap(self, function, category):
+        """
+        Return function timed as a category.
+        """
+        def timed(*args, **kwargs):
+            with self.timed(category):
+                return function(*args, **kwargs)
+        return timed
+
+    def _hook_driver(self, driver):
+        name = type(driver).__name__
+        self.hook(driver, MOTION_METHODS.get(name, ()), "motion")
+        for attr in ATTACH_POINTS.get(name, ()):
+            value = getattr(driver, attr)
+            if attr == "axes":
+                proxies = [RecordingProxy(axis, self, f"{name}.{axis.name}") for axis in value]
+                for axis, proxy in zip(value, proxies):
+                    self._replace(driver, axis.name, proxy)
+                self._replace(driver, "axes", proxies)
+            elif value is not None:
+                self._replace(driver, attr, RecordingProxy(value, self, f"{name}.{attr}"))
+        module = sys.modules.get(type(driver).__module__)
+        wait = getattr(module, "wait_until", None)
+        if wait is not None and not getattr(wait, "_profiled", False):
+            self._replace(module, "wait_until", self._wrap_wait(wait))
+
+    def _wrap_wait(self, wait):
+        def profiled_wait(done, timeout, progress=None, **kwargs):
+            if threading.get_ident() != self._thread:
+                return wait(done, timeout, progress, **kwargs)
+            frame = self._push("settle")
+            if progress is not None:
+                last = [None]
+
+                def watched():
+                    position = progress()
+                    if not np.array_equal(position, last[0]):
+                        last[0] = position
+                        frame.last_change = time.perf_counter()
+                    return position
+            else:
+                watched = None
+            try:
+                return wait(done, timeout, watched, **kwargs)
+            finally:
+                self._pop(frame)
+        profiled_wait._profiled = True
+        return profiled_wait
+
+    def attach_runner(self, runner):
+        """
+        Hook a ScanRunner: each move starts a new point, acquire is readout
+        and journal appends are writes.
+        """
+        move = runner.move
+        count = [0]
+
+        def profiled_move(point):
+            self.begin_point(count[0])
+            count[0] += 1
+            with self.timed("motion"):
+                return move(point)
+        self._replace(runner, "move", profiled_move)
+        self.hook(runner, ["acquire"], "readout")
+        self.hook(runner.journal, ["append"], "write")
+
+    # Accounting
+
+    def _push(self, category):
+        frame = _Frame(category, time.perf_counter())
+        self._stack.append(frame)
+        return frame
+
+    def _pop(self, frame):
+        end = time.perf_counter()
+        self._stack.remove(frame)
+        duration = end - frame.start
+        exclusive = duration - frame.children
+        if frame.category == "settle":
+            moving = 0.0 if frame.last_change is None else frame.last_change - frame.start
+            moving = min(max(moving, 0.0), exclusive)
+            self._add("motion", moving)
+            self._add("settle", exclusive - moving)
+        else:
+            self._add(frame.category, exclusive)
+        if self._stack:
+            self._stack[-1].children += duration
+
+    def _add(self, category, seconds):
+        self._totals[category] += seconds
+        if self._point is not None:
+            self._point[category] += seconds
+
+    @contextmanager
+    def timed(self, category):
+        """
+        Time a block as a category, e.g. `with profiler.timed("write"):`.
+        """
+        if threading.get_ident() != self._thread:
+            yield
+            return
+        frame = self._push(category)
+        try:
+            yield
+        finally:
+            self._pop(frame)
+
+    def write(self, t, duration, kind, path, args, kwargs, result):
+        """
+        Receives completed connection calls from the I/O proxies.
+        """
+        if threading.get_ident() != self._thread or duration <= 0:
+            return
+        if self._stack and self._stack[-1].category == "settle":
+            # Polls inside a wait are part of the wait
+            return
+        self._add("io", duration)
+        if self._stack:
+            self._stack[-1].children += duration
+
+    def begin_point(self, index=None):
+        """
+        Start attributing time to a new scan point. The previous point ends
+        here.
+        """
+        now = time.perf_counter()
+        self._close_point(now)
+        self._point = defaultdict(float)
+        self._point["index"] = len(self.points) if index is None else index
+        self._point["start"] = now
+
+    def _close_point(self, now):
+        if self._point is None:
+            return
+        point = self._point
+        wall = now - point["start"]
+        accounted = sum(point[c] for c in CATEGORIES if c != "python")
+        point["python"] = max(wall - accounted, 0.0)
+        point["wall"] = wall
+        self.points.append({key: point[key] for key in ("index", "wall") + CATEGORIES})
+        self._point = None
+
+    # Results
+
+    def breakdown(self):
+        """
+        Aggregate time per category.
+
+        Returns
+        -------
+        dict
+            category -> seconds, plus "wall". "python" is the wall time not
+            spent in any hooked call.
+
+        """
+        wall = time.perf_counter() - self._start if self._restore else self.wall
+        result = {c: self._totals[c] for c in CATEGORIES if c != "python"}
+        result["python"] = max(wall - sum(result.values()), 0.0)
+        result["wall"] = wall
+        return result
+
+    def per_point(self):
+        """
+        Per-point breakdown as a structured array with an index field, a
+        wall field and one field per category [s].
+        """
+        dtype = [("index", np.int64), ("wall", np.float64)] + [(c, np.float64) for c in CATEGORIES]
+        return np.array([tuple(p[name] for name, _ in dtype) for p in self.points], dtype=dtype)
+
+    def bottleneck(self):
+        """
+        Dominant category of the aggregate breakdown.
+
+        Returns
+        -------
+        tuple
+            (category, fraction of wall time, suggestion).
+
+        """
+        totals = self.breakdown()
+        wall = totals.pop("wall")
+        category = max(totals, key=totals.get)
+        return category, totals[category] / wall if wall else 0.0, SUGGESTIONS[category]
+
+    def report(self):
+        """
+        Print the aggregate and mean per-point breakdown and the bottleneck.
+        """
+        totals = self.breakdown()
+        wall = totals["wall"]
+        points = self.per_point()
+        print(f"Scan wall time {wall:.3f} s over {len(points)} points")
+        for category in CATEGORIES:
+            line = f"  {category:<8} {totals[category]:9.3f} s  {100 * totals[category] / max(wall, 1e-12):5.1f} %"
+            if len(points):
+                line += f"  {1e3 * points[category].mean():8.2f} ms/point"
+            print(line)
+        category, fraction, suggestion = self.bottleneck()
+        print(f"Bottleneck: {category} ({100 * fraction:.0f} % of wall time). {suggestion}")
@@ -0,0 +1,272 @@
+"""
+Online reduction of spectra at acquisition time.
+
+Instead of storing a full CCS200M-class spectrum (3648 pixels) for every XY
+point, a protocol configures one or more reducers that run vectorised over
+each incoming batch of spectra:
+
+- BandIntegration: integrated signal in wavelength bands / ROIs.
+- PeakExtraction: centre, height and width of a peak within a window.
+- PCAProjection: scores on a precomputed principal-component basis.
+
+The raw spectra can still be kept for a sampled subset of points (every
+n-th point) for quality control and for refitting the PCA basis.
+
+Example usage
+-------------
+    pipeline = ReductionPipeline.from_config({
+        "bands": {"raman_g": [1560, 1620], "raman_d": [1320, 1380]},
+        "peaks": {"laser": [780, 790]},
+        "pca": "pca_basis.npz",
+        "keep_raw_every": 100,
+    }, wavelengths)
+    reduced = pipeline(spectra_batch, point_indices)
+"""
+
+import numpy as np
+
+
+class BandIntegration:
+    """
+    Integrate spectra over wavelength bands with a single matrix product.
+    """
+
+    def __init__(self, bands, wavelengths):
+        """
+        Parameters
+        ----------
+        bands : dict
+            name -> (low, high) wavelength range, inclusive.
+        wavelengths : array_like
+            Wavelength of each spectrometer pixel.
+
+        Returns
+        -------
+        None.
+
+        """
+        wavelengths = np.asarray(wavelengths, dtype=np.float64)
+        self.names = list(bands)
+        # Pixel widths, so the integral is in signal x wavelength units
+        width = np.abs(np.gradient(wavelengths))
+        weights = np.zeros((len(wavelengths), len(self.names)), dtype=np.float32)
+        for column, (low, high) in enumerate(bands.values()):
+            inside = (wavelengths >= low) & (wavelengths <= high)
+            if not np.any(inside):
+                raise ValueError(f"Band {self.names[column]} ({low}-{high}) contains no pixels")
+            weights[inside, column] = width[inside]
+        self.weights = weights
+
+    def __call__(self, spectra):
+        integrals = np.asarray(spectra, dtype=np.float32) @ self.weights
+        return {name: integrals[:, i] for i, name in enumerate(self.names)}
+
+
+class PeakExtraction:
+    """
+    Locate the strongest peak inside a wavelength window for every spectrum.
+    """
+
+    def __init__(self, window, wavelengths, name="peak"):
+        """
+        Parameters
+        ----------
+        window : tuple of float
+            (low, high) wavelength range to search.
+        wavelengths : array_like
+            Wavelength of each spectrometer pixel.
+        name : str, optional
+            Prefix of the output fields. The default is "peak".
+
+        Returns
+        -------
+        None.
+
+        """
+        wavelengths = np.asarray(wavelengths, dtype=np.float64)
+        index = np.flatnonzero((wavelengths >= window[0]) & (wavelengths <= window[1]))
+        if index.size < 3:
+            raise ValueError(f"Peak window {window} contains fewer than 3 pixels")
+        self.slice = slice(index[0], index[-1] + 1)
+        self.wavelengths = wavelengths[self.slice]
+        self.step = np.gradient(self.wavelengths)
+        self.name = name
+
+    def __call__(self, spectra):
+        """
+        Returns
+        -------
+        dict
+            <name>_centre, <name>_height and <name>_fwhm arrays, one value per
+            spectrum. Peak widths are estimated from the number of pixels
+            above half height.
+
+        """
+        window = np.asarray(spectra, dtype=np.float32)[:, self.slice]
+        baseline = np.minimum(window[:, 0], window[:, -1])[:, None]
+        signal = window - baseline
+        n = signal.shape[1]
+        rows = np.arange(len(signal))
+        i = np.clip(np.argmax(signal, axis=1), 1, n - 2)
+        left, centre, right = signal[rows, i - 1], signal[rows, i], signal[rows, i + 1]
+        # Parabolic interpolation of the maximum
+        denom = left - 2 * centre + right
+        with np.errstate(invalid="ignore", divide="ignore"):
+            offset = np.where(denom < 0, 0.5 * (left - right) / denom, 0.0)
+        height = centre - 0.25 * (left - right) * offset
+        position = self.wavelengths[i] + offset * self.step[i]
+        above = signal >= 0.5 * height[:, None]
+        fwhm = np.sum(above * self.step, axis=1)
+        return {
+            f"{self.name}_centre": position.astype(np.float32),
+            f"{self.name}_height": height.astype(np.float32),
+            f"{self.name}_fwhm": fwhm.astype(np.float32),
+        }
+
+
+class PCAProjection:
+    """
+    Project spectra onto a precomputed principal-component basis.
+    """
+
+    def __init__(self, mean, basis, name="pca"):
+        """
+        Parameters
+        ----------
+        mean : array_like
+            Mean spectrum, shape (channels,).
+        basis : array_like
+            Components as columns, shape (channels, n_components).
+        name : str, optional
+            Output field name. The default is "pca".
+
+        Returns
+        -------
+        None.
+
+        """
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.basis = np.ascontiguousarray(basis, dtype=np.float32)
+        self.name = name
+
+    @classmethod
+    def fit(cls, spectra, n_components, name="pca"):
+        """
+        Fit a basis from representative spectra (e.g. a pilot scan or the
+        raw subset kept by a ReductionPipeline).
+        """
+        spectra = np.asarray(spectra, dtype=np.float64)
+        mean = spectra.mean(axis=0)
+        _, _, vt = np.linalg.svd(spectra - mean, full_matrices=False)
+        return cls(mean, vt[:n_components].T, name)
+
+    @classmethod
+    def load(cls, path, name="pca"):
+        data = np.load(path)
+        return cls(data["mean"], data["basis"], name)
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, basis=self.basis)
+
+    def __call__(self, spectra):
+        return {self.name: (np.asarray(spectra, dtype=np.float32) - self.mean) @ self.basis}
+
+    def reconstruct(self, scores):
+        """
+        Approximate the original spectra from their scores.
+        """
+        return scores @ self.basis.T + self.mean
+
+
+class ReductionPipeline:
+    """
+    Runs a protocol's reducers over each batch of spectra.
+    """
+
+    def __init__(self, reducers, keep_raw_every=None):
+        """
+        Parameters
+        ----------
+        reducers : list
+            Reducer callables, each returning a dict of per-spectrum arrays.
+        keep_raw_every : int, optional
+            Keep the raw spectrum of every n-th point. The default is None
+            (raw spectra are discarded).
+
+        Returns
+        -------
+        None.
+
+        """
+        self.reducers = list(reducers)
+        self.keep_raw_every = keep_raw_every
+
+    @classmethod
+    def from_config(cls, config, wavelengths):
+        """
+        Build a pipeline from a protocol configuration.
+
+        Parameters
+        ----------
+        config : dict
+            Optional keys: "bands" (name -> [low, high]), "peaks"
+            (name -> [low, high]), "pca" (path to a basis saved with
+            PCAProjection.save) and "keep_raw_every" (int).
+        wavelengths : array_like
+            Wavelength of each spectrometer pixel.
+
+        Returns
+        -------
+        ReductionPipeline
+
+        """
+        reducers = []
+        if config.get("bands"):
+            reducers.append(BandIntegration(config["bands"], wavelengths))
+        for name, window in config.get("peaks", {}).items():
+            reducers.append(PeakExtraction(window, wavelengths, name))
+        if config.get("pca"):
+            reducers.append(PCAProjection.load(config["pca"]))
+        return cls(reducers, config.get("keep_raw_every"))
+
+    def __call__(self, spectra, indices=None):
+        """
+        Reduce a batch.
+
+        Parameters
+        ----------
+        spectra : array_like
+            Spectra, shape (batch, channels).
+        indices : array_like, optional
+            Point index of each spectrum, used to choose the raw subset. The
+            default is 0..batch-1.
+
+        Returns
+        -------
+        dict
+            Reduced fields, plus "raw" and "raw_index" when raw spectra are
+            kept.
+
+        """
+        spectra = np.asarray(spectra)
+        if spectra.ndim == 1:
+            spectra = spectra[None, :]
+        out = {}
+        for reducer in self.reducers:
+            out.update(reducer(spectra))
+        if self.keep_raw_every:
+            indices = np.arange(len(spectra)) if indices is None else np.asarray(indices)
+            keep = indices % self.keep_raw_every == 0
+            out["raw"] = spectra[keep]
+            out["raw_index"] = indices[keep]
+        return out
+
+    def reduction_factor(self, channels):
+        """
+        Approximate ratio of raw to stored values per spectrum.
+        """
+        probe = self(np.zeros((1, channels), dtype=np.float32), [1])
+        stored = sum(np.asarray(v).size for k, v in probe.items() if k not in ("raw", "raw_index"))
+        if self.keep_raw_every:
+            stored += channels / self.keep_raw_every
+        return channels / max(stored, 1e-12)
@@ -0,0 +1,368 @@
+"""
+Checkpointed, resumable scans.
+
+A scan is a fixed array of points. Every completed point is appended to a
+journal file together with the measured stage position and any state the
+acquisition returns. If the scan is interrupted, running it again with the
+same journal skips the completed points and carries on from where it stopped.
+
+Journal records are flushed to the OS immediately and fsynced in batches
+(every `sync_every` points or `sync_interval` seconds), so a crash of the
+Python process loses nothing and a power cut loses at most one batch.
+
+Example usage
+-------------
+    points = np.stack(np.meshgrid(xs, ys), -1).reshape(-1, 2)
+    with ASR(8) as asr:
+        runner = ScanRunner(
+            points,
+            move=lambda p: asr.move_absolute(list(p), "um"),
+            acquire=lambda i, p: {"file": save_spectrum(i)},
+            journal="scan_001.journal",
+            read_position=lambda: [asr.get_position(ax, "um") for ax in asr.axes],
+            tolerance=1.0,
+        )
+        runner.run()
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from src.functions import timeline
+
+
+class ScanPositionError(RuntimeError):
+    """
+    Raised when the stage is not where the scan expects it to be.
+    """
+    pass
+
+
+def _json_default(value):
+    """
+    JSON fallback for journal records: NumPy scalars and arrays become
+    Python numbers and lists, anything else is stored as its repr.
+    """
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return repr(value)
+
+
+class ScanJournal:
+    """
+    Append-only JSON-lines record of a scan's progress.
+    """
+
+    def __init__(self, path, sync_every=50, sync_interval=2.0):
+        """
+        Parameters
+        ----------
+        path : str
+            Journal file path. Created if it does not exist.
+        sync_every : int, optional
+            Number of records between fsyncs. The default is 50.
+        sync_interval : float, optional
+            Maximum time between fsyncs [s]. The default is 2.0.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.header = None
+        self.completed = {}
+        self.last = None
+        self.complete = False
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._load()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _load(self):
+        """
+        Read an existing journal. A partially written final line (from a
+        crash mid-write) is cut off so that new records start on a fresh line.
+        """
+        if not os.path.exists(self.path):
+            return
+        good = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                good += len(line)
+                if entry["type"] == "header":
+                    self.header = entry
+                elif entry["type"] == "point":
+                    self.completed[entry["index"]] = entry
+                    self.last = entry
+                elif entry["type"] == "complete":
+                    self.complete = True
+        if good < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(good)
+
+    def open(self):
+        if self._file is None:
+            self._file = open(self.path, "a")
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def append(self, entry, force_sync=False):
+        """
+        Write one record, fsyncing if the batch is full or stale. NumPy
+        values are converted to plain numbers and lists, other values that
+        JSON cannot represent are stored as their repr.
+        """
+        self._file.write(json.dumps(entry, default=_json_default) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if (force_sync or self._unsynced >= self.sync_every
+                or time.monotonic() - self._last_sync >= self.sync_interval):
+            self.sync()
+
+    def sync(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+
+def travel_time(start, targets, speed, accel, sequential=True):
+    """
+    Estimate move durations with a trapezoidal velocity profile per axis.
+
+    Parameters
+    ----------
+    start : array_like
+        Start position, shape (axes,).
+    targets : array_like
+        Target positions, shape (n, axes).
+    speed : float or array_like
+        Maximum speed per axis, in position units per second.
+    accel : float or array_like
+        Acceleration per axis, in position units per second squared.
+    sequential : bool, optional
+        True if the axes move one after another (as ASR.move_absolute does),
+        False if they move together. The default is True.
+
+    Returns
+    -------
+    numpy.ndarray
+        Estimated time for each move [s], shape (n,).
+
+    """
+    distance = np.abs(np.atleast_2d(targets) - np.asarray(start, dtype=np.float64))
+    speed = np.asarray(speed, dtype=np.float64)
+    accel = np.asarray(accel, dtype=np.float64)
+    # Below this distance the stage never reaches full speed
+    ramp = speed ** 2 / accel
+    t = np.where(distance < ramp,
+                 2 * np.sqrt(distance / accel),
+                 distance / speed + speed / accel)
+    return t.sum(axis=1) if sequential else t.max(axis=1)
+
+
+def order_points(points, start, speed=1.0, accel=np.inf, sequential=True):
+    """
+    Order points for short total travel time, by greedily visiting the
+    nearest point (in travel time) next.
+
+    Parameters
+    ----------
+    points : array_like
+        Points to visit, shape (n, axes).
+    start : array_like
+        Current stage position, shape (axes,).
+    speed, accel, sequential
+        Motion model, see travel_time().
+
+    Returns
+    -------
+    numpy.ndarray
+        Index order in which to visit the points.
+
+    """
+    points = np.asarray(points, dtype=np.float64)
+    remaining = np.ones(len(points), dtype=bool)
+    order = np.empty(len(points), dtype=np.int64)
+    position = np.asarray(start, dtype=np.float64)
+    for i in range(len(points)):
+        candidates = np.flatnonzero(remaining)
+        t = travel_time(position, points[candidates], speed, accel, sequential)
+        nearest = candidates[np.argmin(t)]
+        order[i] = nearest
+        remaining[nearest] = False
+        position = points[nearest]
+    return order
+
+
+def points_digest(points):
+    """
+    Return a short hash identifying a scan's point array.
+    """
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    return hashlib.sha1(points.tobytes() + str(points.shape).encode()).hexdigest()[:16]
+
+
+class ScanRunner:
+    """
+    Runs a point scan, journalling each completed point so that it can be
+    resumed after a failure.
+    """
+
+    def __init__(self, points, move, acquire, journal, read_position=None,
+                 tolerance=None, is_homed=None, home=None, sync_every=50, sync_interval=2.0):
+        """
+        Parameters
+        ----------
+        points : array_like
+            Scan points, shape (n, axes).
+        move : callable
+            move(point) drives the stages to a point.
+        acquire : callable
+            acquire(index, point) takes the measurement. May return a
+            JSON-serialisable value (NumPy scalars and arrays are converted)
+            that is stored in the journal.
+        journal : str
+            Path of the journal file.
+        read_position : callable, optional
+            Returns the current stage position as a sequence. When given, the
+            position is verified after every move and stored in the journal.
+        tolerance : float, optional
+            Maximum allowed difference between target and read-back position,
+            in the units of `points`. The default is None (no check).
+        is_homed : callable, optional
+            Returns False if the stages lost their reference (e.g. after a
+            power cycle). Checked once on resume.
+        home : callable, optional
+            Re-homes the stages. Called on resume only if is_homed() is False.
+        sync_every : int, optional
+            Points per journal fsync. The default is 50.
+        sync_interval : float, optional
+            Maximum time between journal fsyncs [s]. The default is 2.0.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.points = np.asarray(points, dtype=np.float64)
+        if self.points.ndim == 1:
+            self.points = self.points[:, None]
+        self.move = move
+        self.acquire = acquire
+        self.read_position = read_position
+        self.tolerance = tolerance
+        self.is_homed = is_homed
+        self.home = home
+        self.journal = ScanJournal(journal, sync_every, sync_interval)
+        self.digest = points_digest(self.points)
+
+    @property
+    def remaining(self):
+        """
+        Indices of the points not yet completed, in scan order.
+        """
+        done = np.fromiter(self.journal.completed.keys(), dtype=np.int64, count=len(self.journal.completed))
+        return np.setdiff1d(np.arange(len(self.points)), done, assume_unique=True)
+
+    def _check_header(self):
+        header = self.journal.header
+        if header is None:
+            self.journal.append({"type": "header", "digest": self.digest,
+                                 "n_points": len(self.points), "started": time.time()},
+                                force_sync=True)
+        elif header["digest"] != self.digest:
+            raise ValueError(f"Journal {self.journal.path} belongs to a different scan")
+
+    def _resync(self):
+        """
+        Bring the hardware back to a known state before resuming. The stages
+        are only re-homed if they lost their reference; otherwise the first
+        resumed move is verified like any other point.
+        """
+        if self.is_homed is not None and not self.is_homed():
+            print("Stages not homed, re-homing before resuming")
+            self.home()
+
+    def _verify(self, index, point):
+        if self.read_position is None:
+            return None
+        position = np.asarray(self.read_position(), dtype=np.float64)
+        if self.tolerance is not None and np.any(np.abs(position - point) > self.tolerance):
+            raise ScanPositionError(f"Point {index}: stage at {position.tolist()}, expected {point.tolist()}")
+        return position.tolist()
+
+    def run(self, callback=None):
+        """
+        Run (or resume) the scan.
+
+        Parameters
+        ----------
+        callback : callable, optional
+            callback(index, point, result) called after each point is
+            journalled, e.g. for progress display.
+
+        Raises
+        ------
+        Exception
+            Any exception from move/acquire is journalled and re-raised; the
+            completed points are kept and the scan can be resumed.
+
+        Returns
+        -------
+        dict
+            Journal entries of all completed points, keyed by index.
+
+        """
+        remaining = self.remaining
+        with self.journal:
+            self._check_header()
+            if self.journal.completed:
+                print(f"Resuming scan: {len(self.journal.completed)} of {len(self.points)} points done")
+                self._resync()
+            for index in remaining.tolist():
+                point = self.points[index]
+                try:
+                    self.move(point)
+                    position = self._verify(index, point)
+                    with timeline.span("scan", "acquire", index):
+                        result = self.acquire(index, point)
+                except BaseException as e:
+                    self.journal.append({"type": "error", "index": index, "t": time.time(),
+                                         "error": f"{type(e).__name__}: {e}"}, force_sync=True)
+                    raise
+                entry = {"type": "point", "index": index, "t": time.time(),
+                         "position": position, "result": result}
+                self.journal.append(entry)
+                self.journal.completed[index] = entry
+                self.journal.last = entry
+                if callback is not None:
+                    callback(index, point, result)
+            if not self.journal.complete:
+                self.journal.append({"type": "complete", "t": time.time()}, force_sync=True)
+                self.journal.complete = True
+        return self.journal.completed
@@ -0,0 +1,351 @@
+"""
+Shared-memory ring buffer for moving frames and spectra from the acquisition
+process to processing/storage worker processes without copying.
+
+The acquisition process creates the ring and passes it to worker processes as
+a Process argument. Producers claim a free slot, write into a NumPy view of
+it and commit it; consumers take the oldest committed slot as a zero-copy
+NumPy view and release it once done. When every slot is in use the producer
+blocks (or gives up after its timeout), so slow consumers apply backpressure
+instead of memory growing without bound.
+
+Every slot records its state, the pid that owns it, a sequence number and a
+timestamp, so slots held by a crashed worker can be reclaimed.
+
+Example usage
+-------------
+    def worker(ring):
+        with ring:
+            while True:
+                with ring.read() as (seq, t, frame):
+                    np.save(f"frame{seq}.npy", frame)
+
+    ring = SharedRing(slots=16, shape=(2048, 2048), dtype=np.uint16)
+    multiprocessing.Process(target=worker, args=(ring,), daemon=True).start()
+    with ring.write() as frame:
+        frame[:] = camera_image
+"""
+
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+FREE = 0
+WRITING = 1
+READY = 2
+READING = 3
+
+_SLOT_DTYPE = np.dtype([
+    ("state", np.int32),
+    ("owner", np.int32),
+    ("seq", np.int64),
+    ("t", np.float64),
+])
+
+
+class RingTimeout(TimeoutError):
+    """
+    Raised when no slot became available before the timeout expired.
+    """
+    pass
+
+
+def _attach(name):
+    """
+    Attach to an existing block. Worker processes started through
+    multiprocessing share the creator's resource tracker, so the block is
+    only unlinked by the creator (or the tracker if the creator crashes).
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedRing:
+    """
+    Fixed-size ring of equally shaped NumPy slots in shared memory.
+    """
+
+    def __init__(self, slots, shape, dtype=np.uint16, ctx=None):
+        """
+        Create the ring. Must be called in the parent (acquisition) process.
+
+        Parameters
+        ----------
+        slots : int
+            Number of slots. Bounds the number of items in flight.
+        shape : tuple of int
+            Shape of one item, e.g. (height, width) for a frame or
+            (batch, pixels) for a block of spectra.
+        dtype : numpy dtype, optional
+            Item data type. The default is np.uint16.
+        ctx : multiprocessing context, optional
+            Context used to create the synchronisation primitives. Must match
+            the one used to start the worker processes.
+
+        Returns
+        -------
+        None.
+
+        """
+        ctx = ctx or multiprocessing.get_context()
+        self.slots = int(slots)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.item_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        header_bytes = self.slots * _SLOT_DTYPE.itemsize
+        # Align the first slot to a cache line
+        self._offset = -(-header_bytes // 64) * 64
+        self._shm = shared_memory.SharedMemory(create=True, size=self._offset + self.slots * self.item_bytes)
+        # Creator pid rather than a flag: forked children inherit the object
+        # as is, without going through __getstate__
+        self._owner = os.getpid()
+        self._lock = ctx.Lock()
+        self._free = ctx.Semaphore(self.slots)
+        self._ready = ctx.Semaphore(0)
+        self._seq = ctx.Value("q", 0, lock=False)
+        self._map()
+        self._meta[:] = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shm"] = self._shm.name
+        for key in ("_meta", "_data"):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = _attach(state["_shm"])
+        self._map()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _map(self):
+        # frombuffer keeps the buffer exported while any view is alive, so
+        # the mapping cannot be closed from under a view still in use
+        buf = self._shm.buf
+        self._meta = np.frombuffer(buf, dtype=_SLOT_DTYPE, count=self.slots)
+        self._data = np.frombuffer(buf, dtype=self.dtype, count=self.slots * int(np.prod(self.shape)),
+                                   offset=self._offset).reshape((self.slots,) + self.shape)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def close(self):
+        """
+        Detach from the shared block. The creating process also unlinks it.
+
+        Drop the views obtained from claim(), acquire() or the write()/read()
+        contexts before closing. While one is still referenced the mapping
+        cannot be closed: the block is still unlinked, but the ring stays
+        attached until close() is called again once the views are gone.
+        """
+        if self._shm is None:
+            return
+        self._meta = None
+        self._data = None
+        if self._owner == os.getpid():
+            self._shm.unlink()
+            self._owner = None
+        try:
+            self._shm.close()
+        except BufferError:
+            print(f"Shared ring {self._shm.name} still has views in use; "
+                  f"drop them and call close() again")
+            return
+        self._shm = None
+
+    def claim(self, timeout=None):
+        """
+        Reserve a free slot for writing.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum time to wait for a free slot [s]. The default is None
+            (block until a consumer releases one).
+
+        Raises
+        ------
+        RingTimeout
+            No slot became free in time.
+
+        Returns
+        -------
+        slot : int
+            Slot index, to be passed to commit().
+        view : numpy.ndarray
+            Writable view of the slot.
+
+        """
+        if not self._free.acquire(timeout=timeout):
+            raise RingTimeout("No free slot in shared ring")
+        with self._lock:
+            free = np.flatnonzero(self._meta["state"] == FREE)
+            slot = int(free[0])
+            self._meta["state"][slot] = WRITING
+            self._meta["owner"][slot] = os.getpid()
+        return slot, self._data[slot]
+
+    def commit(self, slot, t=None):
+        """
+        Publish a written slot to the consumers.
+
+        Parameters
+        ----------
+        slot : int
+            Slot index returned by claim().
+        t : float, optional
+            Timestamp to store with the item. The default is time.monotonic().
+
+        Returns
+        -------
+        int
+            Sequence number assigned to the item.
+
+        """
+        with self._lock:
+            seq = self._seq.value
+            self._seq.value = seq + 1
+            meta = self._meta[slot]
+            meta["seq"] = seq
+            meta["t"] = time.monotonic() if t is None else t
+            meta["owner"] = 0
+            meta["state"] = READY
+        self._ready.release()
+        return seq
+
+    def acquire(self, timeout=None):
+        """
+        Take ownership of the oldest committed slot.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum time to wait for an item [s]. The default is None.
+
+        Raises
+        ------
+        RingTimeout
+            No item was committed in time.
+
+        Returns
+        -------
+        slot : int
+            Slot index, to be passed to release().
+        seq : int
+            Sequence number of the item.
+        t : float
+            Item timestamp.
+        view : numpy.ndarray
+            Zero-copy view of the item. Only valid until release().
+
+        """
+        if not self._ready.acquire(timeout=timeout):
+            raise RingTimeout("No item available in shared ring")
+        with self._lock:
+            ready = np.flatnonzero(self._meta["state"] == READY)
+            slot = int(ready[np.argmin(self._meta["seq"][ready])])
+            self._meta["state"][slot] = READING
+            self._meta["owner"][slot] = os.getpid()
+            seq = int(self._meta["seq"][slot])
+            t = float(self._meta["t"][slot])
+        return slot, seq, t, self._data[slot]
+
+    def release(self, slot):
+        """
+        Return a slot to the free pool once its contents are no longer needed.
+        """
+        with self._lock:
+            self._meta["state"][slot] = FREE
+            self._meta["owner"][slot] = 0
+        self._free.release()
+
+    @contextmanager
+    def write(self, timeout=None, t=None):
+        """
+        Context manager around claim()/commit(). If the body raises, the slot
+        is returned to the free pool instead of being published.
+        """
+        slot, view = self.claim(timeout)
+        try:
+            yield view
+        except BaseException:
+            self.release(slot)
+            raise
+        self.commit(slot, t)
+
+    @contextmanager
+    def read(self, timeout=None):
+        """
+        Context manager around acquire()/release(), yielding (seq, t, view).
+        """
+        slot, seq, t, view = self.acquire(timeout)
+        try:
+            yield seq, t, view
+        finally:
+            self.release(slot)
+
+    def put(self, item, timeout=None, t=None):
+        """
+        Copy an array into the next free slot and commit it.
+        """
+        with self.write(timeout, t) as view:
+            view[...] = item
+
+    def status(self):
+        """
+        Return a snapshot of slot ownership.
+
+        Returns
+        -------
+        dict
+            Counts of free, writing, ready and reading slots, plus the pids
+            currently holding slots.
+
+        """
+        with self._lock:
+            state = self._meta["state"].copy()
+            owner = self._meta["owner"].copy()
+        return {
+            "free": int(np.sum(state == FREE)),
+            "writing": int(np.sum(state == WRITING)),
+            "ready": int(np.sum(state == READY)),
+            "reading": int(np.sum(state == READING)),
+            "owners": sorted(set(owner[owner != 0].tolist())),
+        }
+
+    def reclaim(self, pid):
+        """
+        Free every slot held by a process that has died.
+
+        Parameters
+        ----------
+        pid : int
+            Process id of the dead producer or consumer.
+
+        Returns
+        -------
+        int
+            Number of slots reclaimed.
+
+        """
+        with self._lock:
+            held = np.flatnonzero((self._meta["owner"] == pid)
+                                  & np.isin(self._meta["state"], (WRITING, READING)))
+            self._meta["state"][held] = FREE
+            self._meta["owner"][held] = 0
+        for _ in held:
+            self._free.release()
+        return len(held)
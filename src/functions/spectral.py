@@ -0,0 +1,242 @@
+"""
+Spectral library search for material identification.
+
+Library spectra are normalised once (and optionally reduced to their
+principal directions), then
+query spectra are matched in chunks with a single matrix multiplication per
+chunk, so whole hyperspectral maps are classified at BLAS speed instead of
+one spectrum at a time. For very large libraries an inverted-file index
+(spherical k-means clusters) restricts each query to the most similar
+clusters.
+
+Example usage
+-------------
+    library = SpectralLibrary(reference_spectra, metric="correlation", n_components=64)
+    library.build_index(n_lists=256)
+    indices, scores = library.classify_cube(cube, min_score=0.9, n_probe=8)
+    material = np.where(indices >= 0, np.asarray(names)[indices], "unknown")
+"""
+
+import numpy as np
+
+
+def _top_k(scores, k):
+    """
+    Return the indices and values of the k largest scores in each row,
+    sorted in descending order.
+    """
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        index = np.argpartition(scores, -k, axis=1)[:, -k:]
+    else:
+        index = np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    values = np.take_along_axis(scores, index, axis=1)
+    order = np.argsort(-values, axis=1)
+    return np.take_along_axis(index, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+class SpectralLibrary:
+    """
+    Normalised reference spectra with batched cosine/correlation search.
+    """
+
+    def __init__(self, spectra, metric="cosine", n_components=None, dtype=np.float32):
+        """
+        Parameters
+        ----------
+        spectra : array_like
+            Reference spectra, shape (n_references, n_channels).
+        metric : str, optional
+            "cosine" or "correlation" (Pearson, i.e. cosine after removing
+            each spectrum's mean). The default is "cosine".
+        n_components : int, optional
+            If given, project onto the first n_components right singular
+            vectors of the normalised library before matching. The basis is
+            not mean-centred, so projection is linear and scaling a query
+            does not change its scores. The default is None (full spectra).
+        dtype : numpy dtype, optional
+            Working precision. The default is np.float32.
+
+        Returns
+        -------
+        None.
+
+        """
+        if metric not in ("cosine", "correlation"):
+            raise ValueError("metric must be 'cosine' or 'correlation'")
+        spectra = np.asarray(spectra, dtype=dtype)
+        self.metric = metric
+        self.dtype = dtype
+        self.basis = None
+        normalised = self._normalise(self._centre(spectra))
+        if n_components is not None:
+            _, _, vt = np.linalg.svd(normalised, full_matrices=False)
+            self.basis = np.ascontiguousarray(vt[:n_components].T)
+        self.vectors = self._normalise(self._project(normalised))
+        self.centroids = None
+        self.lists = None
+
+    def _centre(self, spectra):
+        if self.metric == "correlation":
+            return spectra - spectra.mean(axis=1, keepdims=True)
+        return spectra
+
+    def _project(self, spectra):
+        if self.basis is None:
+            return spectra
+        return spectra @ self.basis
+
+    @staticmethod
+    def _normalise(vectors):
+        norm = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norm, 1e-12)
+
+    def transform(self, spectra):
+        """
+        Apply the library preprocessing (centring, projection,
+        normalisation) to query spectra.
+        """
+        spectra = np.asarray(spectra, dtype=self.dtype)
+        return self._normalise(self._project(self._centre(spectra)))
+
+    def build_index(self, n_lists=256, iterations=10, seed=0):
+        """
+        Build an approximate inverted-file index by spherical k-means.
+
+        Parameters
+        ----------
+        n_lists : int, optional
+            Number of clusters. The default is 256.
+        iterations : int, optional
+            k-means iterations. The default is 10.
+        seed : int, optional
+            Random seed for the initial centroids. The default is 0.
+
+        Returns
+        -------
+        None.
+
+        """
+        rng = np.random.default_rng(seed)
+        n_lists = min(n_lists, len(self.vectors))
+        centroids = self.vectors[rng.choice(len(self.vectors), n_lists, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(self.vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, self.vectors)
+            empty = ~np.any(sums, axis=1)
+            sums[empty] = centroids[empty]
+            centroids = self._normalise(sums)
+        assign = np.argmax(self.vectors @ centroids.T, axis=1)
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assign == c) for c in range(n_lists)]
+
+    def search(self, queries, k=1, chunk=8192, n_probe=None):
+        """
+        Find the k most similar library spectra for each query.
+
+        Parameters
+        ----------
+        queries : array_like
+            Query spectra, shape (n_queries, n_channels).
+        k : int, optional
+            Number of matches per query. The default is 1.
+        chunk : int, optional
+            Queries per matrix multiplication. The default is 8192.
+        n_probe : int, optional
+            Use the approximate index and search this many clusters per
+            query. The default is None (exact search).
+
+        Returns
+        -------
+        indices : numpy.ndarray
+            Library indices, shape (n_queries, k), best first.
+        scores : numpy.ndarray
+            Similarities in [-1, 1], shape (n_queries, k).
+
+        """
+        queries = np.asarray(queries)
+        n = len(queries)
+        k = min(k, len(self.vectors))
+        indices = np.empty((n, k), dtype=np.int64)
+        scores = np.empty((n, k), dtype=self.dtype)
+        for start in range(0, n, chunk):
+            q = self.transform(queries[start:start + chunk])
+            if n_probe is None:
+                i, s = _top_k(q @ self.vectors.T, k)
+            else:
+                i, s = self._search_index(q, k, n_probe)
+            indices[start:start + chunk] = i
+            scores[start:start + chunk] = s
+        return indices, scores
+
+    def _search_index(self, q, k, n_probe):
+        """
+        Approximate search of one chunk. Queries are grouped by the clusters
+        they probe so each cluster is still searched with one matmul.
+        """
+        if self.centroids is None:
+            raise RuntimeError("Call build_index() before searching with n_probe")
+        probes, _ = _top_k(q @ self.centroids.T, n_probe)
+        best_i = np.full((len(q), k), -1, dtype=np.int64)
+        best_s = np.full((len(q), k), -np.inf, dtype=self.dtype)
+        for c in np.unique(probes):
+            members = self.lists[c]
+            if len(members) == 0:
+                continue
+            rows = np.flatnonzero(np.any(probes == c, axis=1))
+            s = q[rows] @ self.vectors[members].T
+            i = np.broadcast_to(members, s.shape)
+            merged_s = np.concatenate((best_s[rows], s), axis=1)
+            merged_i = np.concatenate((best_i[rows], i), axis=1)
+            top, values = _top_k(merged_s, k)
+            best_s[rows] = values
+            best_i[rows] = np.take_along_axis(merged_i, top, axis=1)
+        return best_i, best_s
+
+    def classify(self, queries, min_score=None, chunk=8192, n_probe=None):
+        """
+        Label each query with its best matching reference.
+
+        Parameters
+        ----------
+        queries : array_like
+            Query spectra, shape (n_queries, n_channels).
+        min_score : float, optional
+            Queries whose best score is below this get index -1.
+
+        Returns
+        -------
+        indices : numpy.ndarray
+            Best library index per query (-1 if unmatched).
+        scores : numpy.ndarray
+            Best score per query.
+
+        """
+        indices, scores = self.search(queries, 1, chunk, n_probe)
+        indices, scores = indices[:, 0], scores[:, 0]
+        if min_score is not None:
+            indices = np.where(scores >= min_score, indices, -1)
+        return indices, scores
+
+    def classify_cube(self, cube, min_score=None, chunk=8192, n_probe=None):
+        """
+        Classify every pixel of a hyperspectral cube.
+
+        Parameters
+        ----------
+        cube : array_like
+            Spectra with the channel axis last, e.g. (rows, cols, channels).
+
+        Returns
+        -------
+        indices : numpy.ndarray
+            Library index map with the cube's spatial shape (-1 if unmatched).
+        scores : numpy.ndarray
+            Score map with the cube's spatial shape.
+
+        """
+        cube = np.asarray(cube)
+        shape = cube.shape[:-1]
+        indices, scores = self.classify(cube.reshape(-1, cube.shape[-1]), min_score, chunk, n_probe)
+        return indices.reshape(shape), scores.reshape(shape)
@@ -0,0 +1,247 @@
+"""
+Closed-loop laser power stabilization.
+
+The Vortran light loop holds the diode current, but the delivered power
+still drifts with baseplate temperature. PowerStabilizer runs on a
+background thread: it samples the power at a fixed rate (the laser's own
+?LP reading, or an external photodiode through a DAQ input), predicts the
+power one correction latency ahead from the recent trend, and runs a PI
+controller on that prediction. A new power setting is only sent when it
+differs from the current one by more than a deadband, and steps are rate
+limited, so the serial link sees a handful of commands per minute rather
+than one per scan point.
+
+Every sample and correction is kept in a trace and on the shared timeline,
+so the power during any acquisition can be looked up afterwards instead of
+being checked point by point in the scan loop.
+
+Example usage
+-------------
+    with Vortran(3) as laser, PowerStabilizer(laser, setpoint=40.0, tolerance=0.2) as stabilizer:
+        stabilizer.wait_settled(timeout=30)
+        t0 = time.monotonic()
+        runner.run()
+        ok = stabilizer.in_tolerance(t0, time.monotonic())
+"""
+
+import math
+import threading
+import time
+
+import numpy as np
+
+from src.functions import timeline
+from src.functions.telemetry import TimeSeriesRing
+
+
+class PowerStabilizer:
+    """
+    Background PI power controller for a Vortran laser.
+    """
+
+    def __init__(self, laser, setpoint, read=None, rate=20.0, kp=0.3, ki=0.2,
+                 deadband=0.05, max_step=1.0, min_interval=0.5, tolerance=None,
+                 window=1.0, min_power=0.0, max_power=100.0, capacity=100000):
+        """
+        Parameters
+        ----------
+        laser : Vortran
+            Connected laser.
+        setpoint : float
+            Target power [mW], in the units of read().
+        read : callable, optional
+            Returns the measured power, e.g. a photodiode reading scaled to
+            mW. The default queries ?LP on the laser.
+        rate : float, optional
+            Samples per second. The default is 20.
+        kp, ki : float, optional
+            Proportional gain and integral gain [1/s] on the power error.
+        deadband : float, optional
+            Minimum change of the power setting worth sending [mW]. The
+            default is 0.05.
+        max_step : float, optional
+            Largest change of the power setting per correction [mW]. The
+            default is 1.0.
+        min_interval : float, optional
+            Minimum time between corrections, long enough for the light
+            loop to respond [s]. The default is 0.5.
+        tolerance : float, optional
+            Allowed deviation from the setpoint [mW] for in_tolerance() and
+            wait_settled(). The default is twice the deadband.
+        window : float, optional
+            Length of recent history used for smoothing and trend
+            prediction [s]. The default is 1.0.
+        min_power, max_power : float, optional
+            Limits of the power setting. The default is 0 to 100.
+        capacity : int, optional
+            Samples kept in the power trace. The default is 100000.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.laser = laser
+        self.setpoint = setpoint
+        self.read = read if read is not None else (lambda: float(laser.sendCommand("?LP")))
+        self.period = 1.0 / rate
+        self.kp = kp
+        self.ki = ki
+        self.deadband = deadband
+        self.max_step = max_step
+        self.min_interval = min_interval
+        self.tolerance = tolerance if tolerance is not None else 2 * deadband
+        self.window = window
+        self.min_power = min_power
+        self.max_power = max_power
+        self.power = TimeSeriesRing(capacity)
+        self.commands = TimeSeriesRing(max(capacity // 100, 1000))
+        self.command = setpoint
+        self.corrections = 0
+        self.latency = self.period
+        self._integral = 0.0
+        self._last_update = None
+        self._last_correction = -math.inf
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """
+        Apply the setpoint and start the control thread.
+        """
+        self._send(self.setpoint, time.monotonic())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="power stabilizer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def set_setpoint(self, setpoint):
+        """
+        Change the target power. The integral term is kept, since it models
+        the drift rather than the setpoint.
+        """
+        self.setpoint = setpoint
+
+    def _send(self, command, t):
+        start = time.monotonic()
+        self.laser.sendCommand(f"LP={command:.2f}")
+        self.latency = max(self.period, time.monotonic() - start)
+        self.command = command
+        self._last_correction = t
+        self.commands.append(t, command)
+        timeline.record("Vortran", "power setting", command, timeline.COUNTER, t)
+
+    def _predict(self, t):
+        """
+        Smoothed power extrapolated one correction latency ahead.
+        """
+        times, values = self.power.latest(max(int(self.window / self.period), 1))
+        recent = times >= t - self.window
+        times, values = times[recent], values[recent]
+        if len(times) < 3 or times[-1] == times[0]:
+            return float(values[-1])
+        slope, intercept = np.polyfit(times - t, values, 1)
+        return float(intercept + slope * self.latency)
+
+    def step(self, t=None):
+        """
+        Take one sample and, if needed, send one correction. Called by the
+        control thread; can also be driven manually.
+
+        Returns
+        -------
+        float
+            The measured power.
+
+        """
+        value = float(self.read())
+        t = time.monotonic() if t is None else t
+        self.power.append(t, value)
+        timeline.record("Vortran", "power", value, timeline.COUNTER, t)
+        dt = 0.0 if self._last_update is None else t - self._last_update
+        self._last_update = t
+        error = self.setpoint - self._predict(t)
+        # Anti-windup: the integral alone may not push the setting past its limits
+        self._integral = min(max(self._integral + self.ki * error * dt,
+                                 self.min_power - self.setpoint), self.max_power - self.setpoint)
+        target = min(max(self.setpoint + self.kp * error + self._integral,
+                         self.min_power), self.max_power)
+        change = target - self.command
+        if abs(change) >= self.deadband and t - self._last_correction >= self.min_interval:
+            change = math.copysign(min(abs(change), self.max_step), change)
+            self._send(self.command + change, t)
+            self.corrections += 1
+        return value
+
+    def _run(self):
+        next_sample = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                print(f"Power stabilizer read failed: {e}")
+            next_sample += self.period
+            delay = next_sample - time.monotonic()
+            if delay < 0:
+                # Fell behind (e.g. the laser was busy): resume from now
+                next_sample = time.monotonic()
+                delay = 0
+            self._stop.wait(delay)
+
+    def trace(self, t0=None, t1=None):
+        """
+        Power samples between two monotonic times.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            (t, power).
+
+        """
+        t, value = self.power.arrays()
+        keep = np.ones(len(t), dtype=bool)
+        if t0 is not None:
+            keep &= t >= t0
+        if t1 is not None:
+            keep &= t <= t1
+        return t[keep], value[keep]
+
+    def in_tolerance(self, t0=None, t1=None):
+        """
+        True if every sample between t0 and t1 was within tolerance of the
+        setpoint.
+        """
+        _, value = self.trace(t0, t1)
+        return bool(np.all(np.abs(value - self.setpoint) <= self.tolerance))
+
+    def wait_settled(self, timeout=30.0, hold=1.0):
+        """
+        Block until the power has stayed within tolerance for `hold` seconds.
+
+        Raises
+        ------
+        TimeoutError
+            The power did not settle within timeout.
+
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            now = time.monotonic()
+            t, _ = self.trace(now - hold)
+            if len(t) and t[0] - (now - hold) <= 2 * self.period and self.in_tolerance(now - hold):
+                return
+            time.sleep(self.period)
+        raise TimeoutError(f"Laser power did not settle within {self.tolerance} mW of "
+                           f"{self.setpoint} mW in {timeout} s")
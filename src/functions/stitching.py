@@ -0,0 +1,373 @@
+"""
+Mosaic stitching for ASR tile scans.
+
+Tiles arrive with the nominal stage position they were captured at (from
+ASR.get_position). Each new tile is registered against the neighbours that
+are already in the mosaic by FFT phase correlation of the overlap strips
+only; the registrations run in a process pool while acquisition continues.
+Tiles are blended into a chunked, feathered mosaic as soon as they are
+placed. Once the last tile is in, finalize() solves a global least-squares
+fit of all pairwise offsets and re-blends only the tiles whose position
+changed.
+
+Example usage
+-------------
+    with MosaicStitcher(pixel_size=0.65, tile_shape=(2048, 2048)) as stitcher:
+        for x, y in grid:
+            asr.move_absolute([x, y], "um")
+            stitcher.add_tile(camera.capture(), (x, y))
+        mosaic = stitcher.finalize()
+    image = mosaic.to_array()
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def phase_correlation(a, b):
+    """
+    Measure the translation between two equally sized images.
+
+    Parameters
+    ----------
+    a, b : numpy.ndarray
+        2D images.
+
+    Returns
+    -------
+    shift : numpy.ndarray
+        (row, col) sub-pixel translation of the content of b relative to a,
+        i.e. b(u) ~ a(u - shift).
+    peak : float
+        Height of the normalised correlation peak (0 to 1), a measure of
+        confidence.
+
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    window = np.outer(np.hanning(a.shape[0]), np.hanning(a.shape[1]))
+    fa = np.fft.rfft2((a - a.mean()) * window)
+    fb = np.fft.rfft2((b - b.mean()) * window)
+    cross = fb * np.conj(fa)
+    cross /= np.abs(cross) + 1e-12
+    corr = np.fft.irfft2(cross, s=a.shape)
+    peak_index = np.unravel_index(np.argmax(corr), corr.shape)
+    shift = np.zeros(2)
+    for axis, (i, n) in enumerate(zip(peak_index, corr.shape)):
+        # Parabolic interpolation of the peak along each axis
+        index = list(peak_index)
+        index[axis] = (i - 1) % n
+        left = corr[tuple(index)]
+        index[axis] = (i + 1) % n
+        right = corr[tuple(index)]
+        centre = corr[peak_index]
+        denom = left - 2 * centre + right
+        offset = 0.5 * (left - right) / denom if denom != 0 else 0.0
+        shift[axis] = i + offset
+        if shift[axis] > n / 2:
+            shift[axis] -= n
+    return shift, float(corr[peak_index])
+
+
+def _register_pair(i, j, strip_i, strip_j):
+    """
+    Process pool task: return the correction to the nominal offset of tile j
+    relative to tile i, measured from their overlap strips.
+    """
+    shift, peak = phase_correlation(strip_i, strip_j)
+    return i, j, -shift, peak
+
+
+def feather(shape):
+    """
+    Separable blending weight that falls linearly to zero at the tile edges.
+    """
+    rows = np.minimum(np.arange(1, shape[0] + 1), np.arange(shape[0], 0, -1))
+    cols = np.minimum(np.arange(1, shape[1] + 1), np.arange(shape[1], 0, -1))
+    return np.outer(rows, cols).astype(np.float32)
+
+
+class ChunkedMosaic:
+    """
+    Weighted-accumulation mosaic stored as a sparse grid of fixed-size chunks,
+    so memory only grows with the imaged area.
+    """
+
+    def __init__(self, chunk=1024):
+        self.chunk = chunk
+        self.chunks = {}
+
+    def _chunk(self, key):
+        if key not in self.chunks:
+            self.chunks[key] = (np.zeros((self.chunk, self.chunk), np.float32),
+                                np.zeros((self.chunk, self.chunk), np.float32))
+        return self.chunks[key]
+
+    def add(self, image, weight, origin, sign=1):
+        """
+        Accumulate (or with sign=-1, remove) a weighted tile at an integer
+        (row, col) origin in mosaic pixels.
+        """
+        r0, c0 = (int(v) for v in origin)
+        h, w = image.shape
+        c = self.chunk
+        for cr in range(r0 // c, (r0 + h - 1) // c + 1):
+            for cc in range(c0 // c, (c0 + w - 1) // c + 1):
+                # Overlap of the tile with this chunk, in mosaic coordinates
+                top, bottom = max(r0, cr * c), min(r0 + h, (cr + 1) * c)
+                left, right = max(c0, cc * c), min(c0 + w, (cc + 1) * c)
+                acc, wsum = self._chunk((cr, cc))
+                src = (slice(top - r0, bottom - r0), slice(left - c0, right - c0))
+                dst = (slice(top - cr * c, bottom - cr * c), slice(left - cc * c, right - cc * c))
+                acc[dst] += sign * image[src] * weight[src]
+                wsum[dst] += sign * weight[src]
+
+    def bounds(self):
+        """
+        Return (row0, col0, row1, col1) of the populated chunks in pixels.
+        """
+        keys = np.array(list(self.chunks.keys()))
+        lo = keys.min(axis=0) * self.chunk
+        hi = (keys.max(axis=0) + 1) * self.chunk
+        return lo[0], lo[1], hi[0], hi[1]
+
+    def read_chunk(self, key):
+        """
+        Return the blended image of one chunk (NaN where nothing was imaged).
+        """
+        acc, wsum = self.chunks[key]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(wsum > 1e-6, acc / wsum, np.nan)
+
+    def to_array(self, out=None):
+        """
+        Assemble the full mosaic.
+
+        Parameters
+        ----------
+        out : numpy.ndarray, optional
+            Preallocated output (e.g. a np.memmap for mosaics larger than
+            memory) with the shape of bounds(). The default allocates one.
+
+        Returns
+        -------
+        numpy.ndarray
+
+        """
+        r0, c0, r1, c1 = self.bounds()
+        if out is None:
+            out = np.full((r1 - r0, c1 - c0), np.nan, dtype=np.float32)
+        for key in self.chunks:
+            r = key[0] * self.chunk - r0
+            c = key[1] * self.chunk - c0
+            out[r:r + self.chunk, c:c + self.chunk] = self.read_chunk(key)
+        return out
+
+
+class MosaicStitcher:
+    """
+    Incremental tile registration and blending.
+    """
+
+    def __init__(self, pixel_size, tile_shape, flip=(False, False), min_overlap=16,
+                 min_peak=0.05, chunk=1024, workers=None, transform=None):
+        """
+        Parameters
+        ----------
+        pixel_size : float
+            Size of one image pixel in stage units (e.g. um per pixel).
+        tile_shape : tuple of int
+            (rows, cols) of every tile.
+        flip : tuple of bool, optional
+            Whether the image row/column axes run opposite to stage y/x. The
+            default is (False, False).
+        min_overlap : int, optional
+            Minimum overlap width [px] for a pair to be registered. The
+            default is 16.
+        min_peak : float, optional
+            Pairs with a weaker correlation peak are ignored in the global
+            fit. The default is 0.05.
+        chunk : int, optional
+            Mosaic chunk size [px]. The default is 1024.
+        workers : int, optional
+            Process pool size. The default is the number of CPUs.
+        transform : AffineTransform, optional
+            Calibrated stage -> image (col, row) transform from
+            src.functions.coordinates. Overrides pixel_size and flip.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.pixel_size = pixel_size
+        self.tile_shape = tuple(tile_shape)
+        self.flip = flip
+        self.transform = transform
+        self.min_overlap = min_overlap
+        self.min_peak = min_peak
+        self.mosaic = ChunkedMosaic(chunk)
+        self.weight = feather(self.tile_shape)
+        self.tiles = []
+        self.nominal = []
+        self.placed = []
+        self.pairs = {}
+        self._futures = []
+        self._workers = workers
+        self._pool = None
+
+    def __enter__(self):
+        self._pool = ProcessPoolExecutor(self._workers)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=exc_type is not None)
+            self._pool = None
+
+    def stage_to_pixels(self, position):
+        """
+        Convert an (x, y) stage position to a (row, col) mosaic pixel position.
+        """
+        if self.transform is not None:
+            col, row = self.transform(np.asarray(position[:2]))
+            return np.array([row, col])
+        x, y = position[0], position[1]
+        row = (-y if self.flip[0] else y) / self.pixel_size
+        col = (-x if self.flip[1] else x) / self.pixel_size
+        return np.array([row, col])
+
+    def _overlap(self, i, j):
+        """
+        Return the overlap strips of tiles i and j at their nominal offset, or
+        None if they do not overlap enough.
+        """
+        offset = np.round(self.nominal[j] - self.nominal[i]).astype(int)
+        h, w = self.tile_shape
+        rows = (max(0, offset[0]), min(h, h + offset[0]))
+        cols = (max(0, offset[1]), min(w, w + offset[1]))
+        if rows[1] - rows[0] < self.min_overlap or cols[1] - cols[0] < self.min_overlap:
+            return None
+        strip_i = self.tiles[i][rows[0]:rows[1], cols[0]:cols[1]]
+        strip_j = self.tiles[j][rows[0] - offset[0]:rows[1] - offset[0],
+                                cols[0] - offset[1]:cols[1] - offset[1]]
+        return strip_i, strip_j
+
+    def _collect(self, wait=False):
+        """
+        Gather finished registrations.
+        """
+        pending = []
+        for future in self._futures:
+            if wait or future.done():
+                i, j, correction, peak = future.result()
+                self.pairs[(i, j)] = (self.nominal[j] - self.nominal[i] + correction, peak)
+            else:
+                pending.append(future)
+        self._futures = pending
+
+    def add_tile(self, image, position):
+        """
+        Add a captured tile.
+
+        Parameters
+        ----------
+        image : numpy.ndarray
+            Tile image with shape tile_shape.
+        position : array_like
+            Nominal (x, y) stage position of the tile, in the same units as
+            pixel_size.
+
+        Returns
+        -------
+        int
+            Tile index.
+
+        """
+        image = np.asarray(image, dtype=np.float32)
+        if image.shape != self.tile_shape:
+            raise ValueError(f"Tile shape {image.shape} does not match {self.tile_shape}")
+        j = len(self.tiles)
+        self.tiles.append(image)
+        self.nominal.append(self.stage_to_pixels(position))
+        for i in range(j):
+            strips = self._overlap(i, j)
+            if strips is None:
+                continue
+            if self._pool is not None:
+                self._futures.append(self._pool.submit(_register_pair, i, j, *strips))
+            else:
+                i_, j_, correction, peak = _register_pair(i, j, *strips)
+                self.pairs[(i, j)] = (self.nominal[j] - self.nominal[i] + correction, peak)
+        self._collect()
+        origin = self._estimate(j)
+        self.placed.append(origin)
+        self.mosaic.add(image, self.weight, origin)
+        return j
+
+    def _estimate(self, j):
+        """
+        Best immediate position for tile j: chained from the strongest
+        registered neighbour, or nominal if none has finished yet.
+        """
+        best = None
+        for (i, k), (offset, peak) in self.pairs.items():
+            if k == j and peak >= self.min_peak and (best is None or peak > best[1]):
+                best = (self.placed[i] + offset, peak)
+        position = best[0] if best is not None else self.nominal[j]
+        return np.round(position).astype(int)
+
+    def solve(self):
+        """
+        Global least-squares tile positions from all pairwise offsets, with a
+        weak pull towards the nominal positions so that unconnected tiles
+        stay where the stage put them.
+
+        Returns
+        -------
+        numpy.ndarray
+            Tile positions (row, col), shape (n, 2).
+
+        """
+        self._collect(wait=True)
+        n = len(self.tiles)
+        nominal = np.array(self.nominal)
+        pairs = [(i, j, offset, peak) for (i, j), (offset, peak) in self.pairs.items() if peak >= self.min_peak]
+        A = np.zeros((len(pairs) + n, n))
+        b = np.zeros((len(pairs) + n, 2))
+        for row, (i, j, offset, peak) in enumerate(pairs):
+            A[row, i], A[row, j] = -peak, peak
+            b[row] = peak * offset
+        prior = 1e-3
+        A[len(pairs):] = prior * np.eye(n)
+        b[len(pairs):] = prior * nominal
+        positions, *_ = np.linalg.lstsq(A, b, rcond=None)
+        # Keep tile 0 at its nominal position
+        return positions - positions[0] + nominal[0]
+
+    def finalize(self, tolerance=0.5):
+        """
+        Solve the global fit and re-blend the tiles that moved.
+
+        Parameters
+        ----------
+        tolerance : float, optional
+            Tiles whose position changed by less than this [px] are left in
+            place. The default is 0.5.
+
+        Returns
+        -------
+        ChunkedMosaic
+
+        """
+        positions = np.round(self.solve()).astype(int)
+        moved = 0
+        for j, position in enumerate(positions):
+            if np.any(np.abs(position - self.placed[j]) > tolerance):
+                self.mosaic.add(self.tiles[j], self.weight, self.placed[j], sign=-1)
+                self.mosaic.add(self.tiles[j], self.weight, position)
+                self.placed[j] = position
+                moved += 1
+        print(f"Mosaic finalised: {len(self.tiles)} tiles, {len(self.pairs)} pairs, {moved} re-blended")
+        return self.mosaic
@@ -0,0 +1,325 @@
+"""
+Background telemetry for laser and stage health.
+
+Health values (laser baseplate temperature and power, stage driver
+temperature) are read on a background thread. Each read only happens when
+the device's ActivityLock has been free for a short idle gap, so a
+telemetry query never sits in front of a move or capture on the serial
+line. The polling interval of each channel adapts: it shortens when the
+value is trending towards a limit and lengthens while the value is stable.
+Samples are kept in a fixed-size ring per channel and threshold callbacks
+fire when a limit is crossed.
+
+Example usage
+-------------
+    poller = TelemetryPoller()
+    for name, read in vortran_channels(laser).items():
+        poller.add_channel(name, read, lock=laser.lock, high=35.0 if "temp" in name else None)
+    for name, read in asr_channels(asr).items():
+        poller.add_channel(name, read, lock=asr.lock, high=60.0)
+    poller.on_limit(lambda name, t, value, limit: print(f"{name} at {value}"))
+    with poller:
+        run_scan()
+"""
+
+import math
+import threading
+import time
+
+import numpy as np
+
+from src.functions import timeline
+
+
+class ActivityLock:
+    """
+    Re-entrant device lock that remembers when foreground work last finished,
+    so background work can wait for an idle gap.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._background = False
+        self.last_release = time.monotonic()
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self._background:
+            self.last_release = time.monotonic()
+        self._lock.release()
+
+    def acquire_background(self, min_idle=0.0):
+        """
+        Take the lock for background work only if it is free and no
+        foreground work finished within the last `min_idle` seconds.
+
+        Returns
+        -------
+        bool
+            True if the lock was taken; release it with release_background().
+
+        """
+        if time.monotonic() - self.last_release < min_idle:
+            return False
+        if not self._lock.acquire(blocking=False):
+            return False
+        self._background = True
+        return True
+
+    def release_background(self):
+        self._background = False
+        self._lock.release()
+
+    def idle_for(self):
+        """
+        Time since foreground work last released the lock [s].
+        """
+        return time.monotonic() - self.last_release
+
+
+class TimeSeriesRing:
+    """
+    Fixed-size ring of (t, value) samples.
+    """
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.t = np.zeros(capacity)
+        self.value = np.zeros(capacity)
+        self.count = 0
+
+    def append(self, t, value):
+        i = self.count % self.capacity
+        self.t[i] = t
+        self.value[i] = value
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def arrays(self):
+        """
+        Return (t, value) copies in chronological order.
+        """
+        if self.count <= self.capacity:
+            return self.t[:self.count].copy(), self.value[:self.count].copy()
+        i = self.count % self.capacity
+        return np.roll(self.t, -i), np.roll(self.value, -i)
+
+    def latest(self, n=1):
+        """
+        Return the last n samples as (t, value) arrays.
+        """
+        n = min(n, len(self))
+        index = (np.arange(self.count - n, self.count)) % self.capacity
+        return self.t[index], self.value[index]
+
+
+class TelemetryChannel:
+    """
+    One polled quantity with its limits, adaptive interval and history.
+    """
+
+    def __init__(self, name, read, lock=None, low=None, high=None,
+                 min_interval=0.5, max_interval=30.0, capacity=10000):
+        self.name = name
+        self.read = read
+        self.lock = lock
+        self.low = low
+        self.high = high
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.history = TimeSeriesRing(capacity)
+        self.next_due = time.monotonic()
+        self.in_limit = None
+
+    def adapt(self):
+        """
+        Choose the next polling interval from the recent trend: poll often
+        enough to take several samples before the projected limit crossing,
+        and back off geometrically while the value is flat.
+        """
+        t, v = self.history.latest(5)
+        if len(t) < 3 or t[-1] == t[0]:
+            return
+        slope = np.polyfit(t - t[-1], v, 1)[0]
+        time_to_limit = math.inf
+        if self.high is not None and slope > 0:
+            time_to_limit = (self.high - v[-1]) / slope
+        elif self.low is not None and slope < 0:
+            time_to_limit = (self.low - v[-1]) / slope
+        if math.isfinite(time_to_limit):
+            interval = max(time_to_limit, 0.0) / 4
+        else:
+            interval = self.interval * 1.5
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+
+    def limit_state(self, value):
+        if self.high is not None and value >= self.high:
+            return "high"
+        if self.low is not None and value <= self.low:
+            return "low"
+        return None
+
+
+class TelemetryPoller:
+    """
+    Background thread that polls telemetry channels in device idle gaps.
+    """
+
+    def __init__(self, idle_gap=0.05, retry=0.01):
+        """
+        Parameters
+        ----------
+        idle_gap : float, optional
+            A device must have been idle this long before it is polled [s].
+            The default is 0.05.
+        retry : float, optional
+            Delay before retrying a busy device [s]. The default is 0.01.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.idle_gap = idle_gap
+        self.retry = retry
+        self.channels = {}
+        self.callbacks = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def add_channel(self, name, read, lock=None, low=None, high=None,
+                    min_interval=0.5, max_interval=30.0, capacity=10000):
+        """
+        Register a quantity to poll.
+
+        Parameters
+        ----------
+        name : str
+            Channel name, e.g. "laser.temperature".
+        read : callable
+            Returns the current value as a float. Should be a single short
+            query, not a multi-command routine.
+        lock : ActivityLock, optional
+            The device's lock. Without one the channel is polled regardless
+            of foreground activity.
+        low, high : float, optional
+            Limits that trigger callbacks and faster polling.
+        min_interval, max_interval : float, optional
+            Bounds of the adaptive polling interval [s].
+        capacity : int, optional
+            Number of samples kept. The default is 10000.
+
+        Returns
+        -------
+        TelemetryChannel
+
+        """
+        channel = TelemetryChannel(name, read, lock, low, high, min_interval, max_interval, capacity)
+        self.channels[name] = channel
+        self._wake.set()
+        return channel
+
+    def on_limit(self, callback):
+        """
+        Register callback(name, t, value, limit) called when a channel enters
+        ("high"/"low") or leaves (None) its limits.
+        """
+        self.callbacks.append(callback)
+
+    def history(self, name):
+        return self.channels[name].history.arrays()
+
+    def latest(self, name):
+        t, v = self.channels[name].history.latest()
+        return (float(t[0]), float(v[0])) if len(t) else (None, None)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def poll(self, channel):
+        """
+        Try to read one channel. Returns False if its device was busy.
+        """
+        lock = channel.lock
+        if lock is not None and not lock.acquire_background(self.idle_gap):
+            return False
+        try:
+            value = float(channel.read())
+        except Exception as e:
+            print(f"Telemetry read failed for {channel.name}: {e}")
+            value = math.nan
+        finally:
+            if lock is not None:
+                lock.release_background()
+        t = time.monotonic()
+        channel.history.append(t, value)
+        timeline.record("telemetry", channel.name, value, timeline.COUNTER, t)
+        if not math.isnan(value):
+            state = channel.limit_state(value)
+            if state != channel.in_limit:
+                channel.in_limit = state
+                for callback in self.callbacks:
+                    try:
+                        callback(channel.name, t, value, state)
+                    except Exception as e:
+                        print(f"Telemetry limit callback failed for {channel.name}: {e}")
+            channel.adapt()
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.channels:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            channel = min(self.channels.values(), key=lambda c: c.next_due)
+            delay = channel.next_due - time.monotonic()
+            if delay > 0:
+                self._wake.wait(delay)
+                self._wake.clear()
+                continue
+            if self.poll(channel):
+                channel.next_due = time.monotonic() + channel.interval
+            else:
+                channel.next_due = time.monotonic() + self.retry
+
+
+def vortran_channels(laser):
+    """
+    Telemetry read functions for a connected Vortran laser.
+    """
+    return {
+        "laser.temperature": lambda: float(laser.sendCommand("?BPT")),
+        "laser.power": lambda: float(laser.sendCommand("?LP")),
+    }
+
+
+def asr_channels(asr):
+    """
+    Telemetry read functions for the driver temperature of each ASR axis.
+    """
+    return {f"asr.{axis.name}.temperature": (lambda axis=axis: axis.settings.get("driver.temperature"))
+            for axis in asr.axes}
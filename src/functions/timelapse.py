@@ -0,0 +1,228 @@
+"""
+Deadline-scheduled time-lapse over a fixed set of stage positions.
+
+Timepoints are scheduled on a grid of monotonic deadlines (t0 + k *
+interval), so timing errors do not accumulate the way a sleep-per-loop
+does. Each wait sleeps until shortly before the deadline and spins for the
+last couple of milliseconds, and the lateness of every timepoint start is
+recorded for jitter statistics.
+
+Within a timepoint the positions are visited in the order of shortest
+travel time from wherever the stage ended up. The wait before the next
+timepoint is offered to idle tasks (drift measurements, autofocus,
+telemetry), each told how much time is left so it can decline if it would
+not fit.
+
+A timepoint that runs past the next deadline is handled by the overrun
+policy:
+
+- "skip": drop the missed timepoints and continue on the original grid.
+- "compress": start the next timepoint immediately and keep the original
+  grid, so the schedule catches up over the following timepoints.
+- "shift": start the next timepoint immediately and move the whole grid
+  back, so later timepoints keep the full interval.
+
+Example usage
+-------------
+    lapse = TimeLapse(points, interval=60.0, timepoints=120,
+                      move=lambda p: asr.move_absolute(p.tolist(), "um"),
+                      acquire=lambda k, i, p: camera.capture(),
+                      speed=asr_speed, accel=asr_accel, overrun="skip")
+    lapse.add_idle_task(lambda idle: tracker.maybe_measure(capture_reference, idle))
+    lapse.run()
+    print(lapse.jitter())
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from src.functions import timeline
+from src.functions.scan import order_points
+
+RECORD_DTYPE = np.dtype([
+    ("timepoint", np.int64),
+    ("scheduled", np.float64),
+    ("start", np.float64),
+    ("end", np.float64),
+    ("lateness", np.float64),
+    ("skipped", np.bool_),
+])
+
+
+class TimeLapse:
+    """
+    Repeats a multi-position acquisition on a fixed interval.
+    """
+
+    def __init__(self, points, interval, move, acquire, timepoints=None, start=None,
+                 speed=1.0, accel=np.inf, sequential=True, overrun="skip", spin=0.002):
+        """
+        Parameters
+        ----------
+        points : array_like
+            Stage positions visited every timepoint, shape (n, axes).
+        interval : float
+            Time between timepoint starts [s].
+        move : callable
+            move(point) moves the stage and returns once it is in position.
+        acquire : callable
+            acquire(timepoint, index, point) acquires at a position. index
+            is the row of the point in `points`. Results are collected in
+            self.results keyed by (timepoint, index).
+        timepoints : int, optional
+            Number of timepoints. The default is None (run until stop()).
+        start : array_like, optional
+            Stage position before the first timepoint, used to order the
+            first visit. The default is the first point.
+        speed, accel, sequential
+            Motion model used for ordering, see travel_time().
+        overrun : str, optional
+            "skip", "compress" or "shift". The default is "skip".
+        spin : float, optional
+            Busy-wait this long before each deadline instead of sleeping
+            [s]. The default is 0.002.
+
+        Returns
+        -------
+        None.
+
+        """
+        if overrun not in ("skip", "compress", "shift"):
+            raise ValueError(f"Unknown overrun policy: {overrun}")
+        self.points = np.asarray(points, dtype=np.float64)
+        self.interval = interval
+        self.move = move
+        self.acquire = acquire
+        self.timepoints = timepoints
+        self.position = self.points[0] if start is None else np.asarray(start, dtype=np.float64)
+        self.speed = speed
+        self.accel = accel
+        self.sequential = sequential
+        self.overrun = overrun
+        self.spin = spin
+        self.idle_tasks = []
+        self.results = {}
+        self.records = []
+        self._stop = threading.Event()
+
+    def add_idle_task(self, task):
+        """
+        Register task(idle) to run in the gap before a timepoint. idle is
+        the time left before the deadline [s]; the task should do nothing
+        if its work would not fit, and return True if it did any work.
+        """
+        self.idle_tasks.append(task)
+
+    def stop(self):
+        """
+        Stop after the current timepoint (may be called from another thread).
+        """
+        self._stop.set()
+
+    def _idle(self, deadline):
+        """
+        Offer the time before the deadline to the idle tasks, round robin,
+        until none of them has anything to do.
+        """
+        busy = True
+        while busy and self.idle_tasks and not self._stop.is_set():
+            busy = False
+            for task in self.idle_tasks:
+                idle = deadline - time.monotonic() - self.spin
+                if idle <= 0:
+                    return
+                try:
+                    busy |= bool(task(idle))
+                except Exception as e:
+                    print(f"Time-lapse idle task failed: {e}")
+
+    def _wait(self, deadline):
+        """
+        Sleep until just before the deadline, then spin to it.
+        """
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= self.spin:
+                break
+            if self._stop.wait(remaining - self.spin):
+                return
+        while time.monotonic() < deadline:
+            pass
+
+    def _acquire_timepoint(self, k):
+        order = order_points(self.points, self.position, self.speed, self.accel, self.sequential)
+        with timeline.span("timelapse", "timepoint", k):
+            for index in order.tolist():
+                point = self.points[index]
+                self.move(point)
+                self.position = point
+                self.results[(k, index)] = self.acquire(k, index, point)
+
+    def run(self):
+        """
+        Run the time-lapse.
+
+        Returns
+        -------
+        numpy.ndarray
+            One record per timepoint (see RECORD_DTYPE), including skipped
+            ones.
+
+        """
+        self._stop.clear()
+        t0 = time.monotonic()
+        k = 0
+        while not self._stop.is_set() and (self.timepoints is None or k < self.timepoints):
+            scheduled = t0 + k * self.interval
+            self._idle(scheduled)
+            self._wait(scheduled)
+            if self._stop.is_set():
+                break
+            start = time.monotonic()
+            self._acquire_timepoint(k)
+            end = time.monotonic()
+            self.records.append((k, scheduled, start, end, start - scheduled, False))
+            k += 1
+            next_deadline = t0 + k * self.interval
+            if end <= next_deadline:
+                continue
+            late = end - next_deadline
+            print(f"Time-lapse timepoint {k - 1} overran by {late:.3f} s ({self.overrun})")
+            if self.overrun == "skip":
+                missed = int(late // self.interval) + 1
+                if self.timepoints is not None:
+                    missed = min(missed, self.timepoints - k)
+                for j in range(k, k + missed):
+                    self.records.append((j, t0 + j * self.interval, np.nan, np.nan, np.nan, True))
+                k += missed
+            elif self.overrun == "shift":
+                t0 += late
+        return self.record_array()
+
+    def record_array(self):
+        return np.array(self.records, dtype=RECORD_DTYPE)
+
+    def jitter(self):
+        """
+        Start-time statistics of the acquired timepoints.
+
+        Returns
+        -------
+        dict
+            mean, std and max lateness [s], plus counts of acquired and
+            skipped timepoints. "compress" timepoints that started late on
+            purpose are included.
+
+        """
+        records = self.record_array()
+        acquired = records[~records["skipped"]] if len(records) else records
+        lateness = acquired["lateness"]
+        return {
+            "acquired": len(acquired),
+            "skipped": int(records["skipped"].sum()) if len(records) else 0,
+            "mean": float(lateness.mean()) if len(lateness) else np.nan,
+            "std": float(lateness.std()) if len(lateness) else np.nan,
+            "max": float(lateness.max()) if len(lateness) else np.nan,
+        }
@@ -0,0 +1,336 @@
+"""
+Monotonic event timeline shared by all device drivers.
+
+Drivers report commands, completed moves and samples into a preallocated
+structured NumPy ring of (t, device, event, kind, value) records. Recording
+is a couple of array stores under a lock, so it can stay on during scans.
+Hardware timestamps from the DAQ or camera are mapped onto the host
+monotonic clock with a fitted offset and drift per clock domain.
+
+The timeline can be exported in Chrome trace format and opened in
+chrome://tracing or https://ui.perfetto.dev to inspect a scan and its idle
+gaps.
+
+Example usage
+-------------
+    from src.functions import timeline
+
+    with timeline.span("ASR", "move_absolute"):
+        asr.move_absolute([0, 0], "um")
+    timeline.record("camera", "frame", value=frame_id, t=hw_t, domain="camera")
+    timeline.get_recorder().export_chrome_trace("scan_trace.json")
+"""
+
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+INSTANT = 0
+BEGIN = 1
+END = 2
+COUNTER = 3
+
+EVENT_DTYPE = np.dtype([
+    ("t", np.float64),
+    ("device", np.uint16),
+    ("event", np.uint16),
+    ("kind", np.uint8),
+    ("value", np.float64),
+])
+
+
+class ClockDomain:
+    """
+    Linear mapping from a hardware clock onto time.monotonic().
+    """
+
+    def __init__(self, name, offset=0.0, rate=1.0):
+        self.name = name
+        self.offset = offset
+        self.rate = rate
+
+    def fit(self, hw_times, host_times):
+        """
+        Fit host = offset + rate * hw from paired timestamps, e.g. the
+        hardware timestamp of a frame and the monotonic time its software
+        trigger was issued.
+
+        Parameters
+        ----------
+        hw_times : array_like
+            Timestamps in the hardware clock [s].
+        host_times : array_like
+            Corresponding time.monotonic() values [s].
+
+        Returns
+        -------
+        float
+            RMS residual of the fit [s].
+
+        """
+        hw = np.asarray(hw_times, dtype=np.float64)
+        host = np.asarray(host_times, dtype=np.float64)
+        if hw.size == 1:
+            self.rate = 1.0
+            self.offset = float(host[0] - hw[0])
+            return 0.0
+        A = np.column_stack((np.ones_like(hw), hw))
+        (self.offset, self.rate), *_ = np.linalg.lstsq(A, host, rcond=None)
+        residual = host - (self.offset + self.rate * hw)
+        return float(np.sqrt(np.mean(residual ** 2)))
+
+    def to_monotonic(self, hw_times):
+        """
+        Convert hardware timestamps (scalar or array) to the monotonic clock.
+        """
+        return self.offset + self.rate * np.asarray(hw_times, dtype=np.float64)
+
+
+class EventRecorder:
+    """
+    Fixed-capacity ring of timeline events. Once full, the oldest events are
+    overwritten.
+    """
+
+    def __init__(self, capacity=1_000_000):
+        """
+        Parameters
+        ----------
+        capacity : int, optional
+            Number of events kept. The default is 1,000,000 (about 27 MB).
+
+        Returns
+        -------
+        None.
+
+        """
+        self.capacity = int(capacity)
+        self.events = np.zeros(self.capacity, dtype=EVENT_DTYPE)
+        self.count = 0
+        self.enabled = True
+        self.domains = {}
+        self._names = {}
+        self._name_list = []
+        self._lock = threading.Lock()
+        self.t0 = time.monotonic()
+
+    def _intern(self, name):
+        index = self._names.get(name)
+        if index is None:
+            index = len(self._name_list)
+            self._names[name] = index
+            self._name_list.append(name)
+        return index
+
+    def domain(self, name):
+        """
+        Return the named clock domain, creating it if needed.
+        """
+        if name not in self.domains:
+            self.domains[name] = ClockDomain(name)
+        return self.domains[name]
+
+    def record(self, device, event, value=math.nan, kind=INSTANT, t=None, domain=None):
+        """
+        Append an event.
+
+        Parameters
+        ----------
+        device : str
+            Reporting device, e.g. "ASR".
+        event : str
+            Event name, e.g. "move_absolute".
+        value : float, optional
+            Associated value (target, sample index, power...). The default
+            is NaN.
+        kind : int, optional
+            INSTANT, BEGIN, END or COUNTER. The default is INSTANT.
+        t : float, optional
+            Timestamp. The default is time.monotonic().
+        domain : str, optional
+            Clock domain of t if it is a hardware timestamp.
+
+        Returns
+        -------
+        None.
+
+        """
+        if not self.enabled:
+            return
+        if t is None:
+            t = time.monotonic()
+        elif domain is not None:
+            t = float(self.domain(domain).to_monotonic(t))
+        with self._lock:
+            i = self.count % self.capacity
+            self.events[i] = (t, self._intern(device), self._intern(event), kind, value)
+            self.count += 1
+
+    @contextmanager
+    def span(self, device, event, value=math.nan):
+        """
+        Record BEGIN/END events around the body of a with-block.
+        """
+        self.record(device, event, value, BEGIN)
+        try:
+            yield
+        finally:
+            self.record(device, event, value, END)
+
+    def clear(self):
+        with self._lock:
+            self.count = 0
+            self.t0 = time.monotonic()
+
+    def snapshot(self):
+        """
+        Return the recorded events in chronological order.
+
+        Returns
+        -------
+        numpy.ndarray
+            Copy of the events, dtype EVENT_DTYPE.
+
+        """
+        with self._lock:
+            if self.count <= self.capacity:
+                events = self.events[:self.count].copy()
+            else:
+                i = self.count % self.capacity
+                events = np.concatenate((self.events[i:], self.events[:i]))
+        return events[np.argsort(events["t"], kind="stable")]
+
+    def name(self, index):
+        return self._name_list[index]
+
+    def select(self, device=None, event=None):
+        """
+        Return the events matching a device and/or event name.
+        """
+        events = self.snapshot()
+        mask = np.ones(len(events), dtype=bool)
+        if device is not None:
+            mask &= events["device"] == self._names.get(device, -1)
+        if event is not None:
+            mask &= events["event"] == self._names.get(event, -1)
+        return events[mask]
+
+    def busy_intervals(self, device=None):
+        """
+        Pair BEGIN/END events into (start, stop) intervals.
+
+        Parameters
+        ----------
+        device : str, optional
+            Restrict to one device. The default is all devices.
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of shape (n, 2), sorted by start time.
+
+        """
+        events = self.select(device)
+        open_spans = {}
+        intervals = []
+        for t, dev, ev, kind, _ in events:
+            key = (dev, ev)
+            if kind == BEGIN:
+                open_spans.setdefault(key, []).append(t)
+            elif kind == END and open_spans.get(key):
+                intervals.append((open_spans[key].pop(), t))
+        intervals.sort()
+        return np.array(intervals, dtype=np.float64).reshape(-1, 2)
+
+    def idle_gaps(self, min_gap=0.0, device=None):
+        """
+        Return the gaps during which no span was active.
+
+        Parameters
+        ----------
+        min_gap : float, optional
+            Ignore gaps shorter than this [s]. The default is 0.
+        device : str, optional
+            Restrict to one device. The default is all devices.
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of shape (n, 2) of (start, stop) gaps.
+
+        """
+        intervals = self.busy_intervals(device)
+        if len(intervals) < 2:
+            return np.empty((0, 2))
+        # Merge overlapping spans, then take the space between them
+        ends = np.maximum.accumulate(intervals[:, 1])
+        starts = intervals[1:, 0]
+        gaps = np.column_stack((ends[:-1], starts))
+        return gaps[gaps[:, 1] - gaps[:, 0] > min_gap]
+
+    def export_chrome_trace(self, path):
+        """
+        Write the timeline as a Chrome trace JSON file. Each device is shown
+        as a separate track; counters show recorded values over time.
+
+        Parameters
+        ----------
+        path : str
+            Output file path.
+
+        Returns
+        -------
+        None.
+
+        """
+        events = self.snapshot()
+        phase = {INSTANT: "i", BEGIN: "B", END: "E", COUNTER: "C"}
+        trace = []
+        for index in np.unique(events["device"]).tolist():
+            trace.append({"ph": "M", "name": "thread_name", "pid": 1, "tid": index,
+                          "args": {"name": self._name_list[index]}})
+        for t, dev, ev, kind, value in events.tolist():
+            item = {
+                "name": self._name_list[ev],
+                "ph": phase[kind],
+                "ts": (t - self.t0) * 1e6,
+                "pid": 1,
+                "tid": dev,
+            }
+            if kind == INSTANT:
+                item["s"] = "t"
+            if not math.isnan(value):
+                item["args"] = {"value": value}
+            trace.append(item)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+_recorder = EventRecorder()
+
+
+def get_recorder():
+    """
+    Return the process-wide recorder that the drivers report into.
+    """
+    return _recorder
+
+
+def set_recorder(recorder):
+    """
+    Replace the process-wide recorder, e.g. with a larger one for a long scan.
+    """
+    global _recorder
+    _recorder = recorder
+
+
+def record(device, event, value=math.nan, kind=INSTANT, t=None, domain=None):
+    _recorder.record(device, event, value, kind, t, domain)
+
+
+def span(device, event, value=math.nan):
+    return _recorder.span(device, event, value)
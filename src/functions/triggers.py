@@ -0,0 +1,247 @@
+"""
+Position-triggered synchronization between stages and detectors.
+
+Instead of waiting in Python for each move to finish and then triggering
+the detector, the stage controllers raise a hardware line themselves (the
+E-873 trigger outputs of the Q545, the digital outputs of the ASR
+controller), wired to the detector or DAQ trigger input. A TriggerSpec
+describes when the line fires independently of the hardware; Q545 and ASR
+translate it with configure_trigger().
+
+The same spec drives a software model, so a trigger plan can be checked
+against a simulated move sequence before it is loaded, and attribute_frames()
+matches recorded trigger times to detector frame timestamps to report which
+trigger produced which frame and which triggers were missed.
+
+Example usage
+-------------
+    spec = TriggerSpec("position", axis=1, output=1, start=-6.4, stop=-5.1, step=0.05)
+    t, position, on_target = simulate_motion(-6.5, [-5.0], speed=1.0, accel=50.0)
+    expected = fire_times(spec, t, position, on_target)
+    q545.configure_trigger(spec)
+    ...
+    frame_trigger, missed = attribute_frames(expected, frame_times, max_delay=2e-3)
+"""
+
+import numpy as np
+
+CONDITIONS = ("position", "on_target", "motion_complete")
+
+
+class TriggerSpec:
+    """
+    Hardware-independent description of a stage trigger output.
+    """
+
+    def __init__(self, condition, axis=1, output=1, position=None, start=None, stop=None,
+                 step=None, pulse_width=1e-3, polarity=1, count=0, delay=0.0):
+        """
+        Parameters
+        ----------
+        condition : str
+            "position": fire when the axis crosses `position`, or every
+            `step` between `start` and `stop`.
+            "on_target": fire when the controller reports the axis on
+            target (after settling).
+            "motion_complete": fire when the axis reaches `position` at the
+            end of a move, before settling. The controllers implement this
+            as a position trigger at `position`, so a move that passes
+            through it also fires.
+        axis : int, optional
+            Controller axis number. The default is 1.
+        output : int, optional
+            Trigger output line (E-873) or digital output channel (Zaber).
+            The default is 1.
+        position : float, optional
+            Trigger position, in the stage's native units (mm for Q545,
+            um for ASR).
+        start, stop, step : float, optional
+            Range and spacing of a train of position triggers.
+        pulse_width : float, optional
+            Output pulse length [s]. The default is 1e-3.
+        polarity : int, optional
+            1 for active high, 0 for active low. The default is 1.
+        count : int, optional
+            Number of pulses before the trigger disarms, 0 for unlimited.
+        delay : float, optional
+            Latency from the condition to the output edge [s], used by the
+            software model. The default is 0.
+
+        Returns
+        -------
+        None.
+
+        """
+        if condition not in CONDITIONS:
+            raise ValueError(f"Unknown trigger condition: {condition}. Supported: {CONDITIONS}")
+        if condition == "position" and position is None and None in (start, stop, step):
+            raise ValueError("Position triggers need a position, or start, stop and step")
+        if condition == "motion_complete" and position is None:
+            raise ValueError("Motion-complete triggers need the move target as position")
+        self.condition = condition
+        self.axis = axis
+        self.output = output
+        self.position = position
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.pulse_width = pulse_width
+        self.polarity = polarity
+        self.count = count
+        self.delay = delay
+
+    def thresholds(self):
+        """
+        Positions at which a position trigger fires.
+        """
+        if self.step is None:
+            return np.array([self.position], dtype=np.float64)
+        low, high = sorted((self.start, self.stop))
+        return np.arange(low, high + 0.5 * abs(self.step), abs(self.step))
+
+
+def simulate_motion(start, targets, speed, accel, settle=0.0, dwell=0.0, dt=1e-4):
+    """
+    Sample a single-axis move sequence with a trapezoidal velocity profile.
+
+    Parameters
+    ----------
+    start : float
+        Initial position.
+    targets : array_like
+        Targets visited in order.
+    speed, accel : float
+        Maximum speed and acceleration, in position units per second (squared).
+    settle : float, optional
+        Time after arrival before the controller reports on target [s].
+    dwell : float, optional
+        Time spent on target (e.g. exposure) before the next move [s].
+    dt : float, optional
+        Sample period [s]. The default is 1e-4.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        (t, position, on_target) samples.
+
+    """
+    times, positions, flags = [], [], []
+    t0 = 0.0
+    position = float(start)
+    for target in np.asarray(targets, dtype=np.float64).ravel():
+        distance = abs(target - position)
+        direction = np.sign(target - position)
+        if distance < speed ** 2 / accel:
+            # Triangular profile: never reaches full speed
+            ramp = np.sqrt(distance / accel)
+            peak = accel * ramp
+            duration = 2 * ramp
+        else:
+            ramp = speed / accel
+            peak = speed
+            duration = distance / speed + ramp
+        # Always end on a sample at the end of the dwell, so the on-target
+        # flag is raised even when settle and dwell are shorter than dt
+        end = duration + settle + dwell
+        t = np.append(np.arange(0.0, end, dt), end)
+        moving = np.clip(t, 0.0, duration)
+        accelerating = np.minimum(moving, ramp)
+        decelerating = np.clip(moving - (duration - ramp), 0.0, ramp)
+        travelled = (0.5 * accel * accelerating ** 2
+                     + peak * np.clip(moving - ramp, 0.0, duration - 2 * ramp)
+                     + peak * decelerating - 0.5 * accel * decelerating ** 2)
+        times.append(t0 + t)
+        positions.append(position + direction * np.minimum(travelled, distance))
+        flags.append(t >= duration + settle)
+        t0 += t[-1] + dt if len(t) else 0.0
+        position = float(target)
+    return np.concatenate(times), np.concatenate(positions), np.concatenate(flags)
+
+
+def _rising(flags):
+    flags = np.asarray(flags, dtype=bool)
+    return np.flatnonzero(flags[1:] & ~flags[:-1]) + 1
+
+
+def fire_times(spec, t, position, on_target):
+    """
+    Times at which a trigger would fire on a sampled trajectory.
+
+    Parameters
+    ----------
+    spec : TriggerSpec
+    t, position, on_target : numpy.ndarray
+        Samples, e.g. from simulate_motion().
+
+    Returns
+    -------
+    numpy.ndarray
+        Firing times [s], sorted.
+
+    """
+    t = np.asarray(t, dtype=np.float64)
+    position = np.asarray(position, dtype=np.float64)
+    if spec.condition == "on_target":
+        index = _rising(on_target)
+    elif spec.condition == "motion_complete":
+        index = _rising(np.isclose(position, spec.position))
+    else:
+        side = position[:, None] >= spec.thresholds()[None, :]
+        # A threshold fires on every sample where the position crosses it
+        crossed = side[1:] != side[:-1]
+        index = np.flatnonzero(crossed.any(axis=1)) + 1
+        index = np.repeat(index, crossed[index - 1].sum(axis=1))
+    times = np.sort(t[index]) + spec.delay
+    return times[:spec.count] if spec.count else times
+
+
+def attribute_frames(trigger_times, frame_times, max_delay, min_delay=0.0):
+    """
+    Match detector frames to the triggers that started them.
+
+    Each frame is attributed to the latest trigger at least min_delay and
+    at most max_delay before it. A trigger claimed by an earlier frame is
+    not reused, so a frame without a trigger of its own (a free-running or
+    spurious frame) is reported as unmatched.
+
+    Parameters
+    ----------
+    trigger_times : array_like
+        Trigger edge times, e.g. from a DAQ input or fire_times(), in any
+        order.
+    frame_times : array_like
+        Frame start timestamps on the same clock (see
+        timeline.ClockDomain to map hardware timestamps), in acquisition
+        order.
+    max_delay : float
+        Longest trigger-to-frame latency accepted [s].
+    min_delay : float, optional
+        Shortest trigger-to-frame latency [s]. The default is 0.
+
+    Returns
+    -------
+    frame_trigger : numpy.ndarray
+        Index into trigger_times of each frame's trigger, -1 if unmatched.
+    missed : numpy.ndarray
+        Indices into trigger_times of triggers that produced no frame.
+
+    """
+    trigger_times = np.asarray(trigger_times, dtype=np.float64)
+    frame_times = np.asarray(frame_times, dtype=np.float64)
+    # searchsorted needs the triggers in time order; indices are mapped
+    # back to the caller's order at the end
+    order = np.argsort(trigger_times, kind="stable")
+    trigger_times = trigger_times[order]
+    candidate = np.searchsorted(trigger_times, frame_times - min_delay, side="right") - 1
+    valid = candidate >= 0
+    valid[valid] = frame_times[valid] - trigger_times[candidate[valid]] <= max_delay
+    frame_trigger = np.where(valid, candidate, -1)
+    # Keep only the first frame claiming each trigger
+    claimed = frame_trigger >= 0
+    duplicate = np.zeros(len(frame_trigger), dtype=bool)
+    duplicate[1:] = claimed[1:] & (frame_trigger[1:] == frame_trigger[:-1])
+    frame_trigger[duplicate] = -1
+    used = np.zeros(len(trigger_times), dtype=bool)
+    used[frame_trigger[frame_trigger >= 0]] = True
+    frame_trigger[frame_trigger >= 0] = order[frame_trigger[frame_trigger >= 0]]
+    return frame_trigger, np.sort(order[~used])
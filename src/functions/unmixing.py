@@ -0,0 +1,316 @@
+"""
+Out-of-core PCA and NMF spectral unmixing of hyperspectral cubes.
+
+Cubes are read chunk by chunk from any array that supports slicing along
+its pixel axis (a NumPy memmap from np.load(..., mmap_mode="r"), an h5py or
+zarr dataset), so cubes larger than memory are decomposed in a streaming
+pass. Chunk size is derived from a memory cap and chunks are processed on a
+thread pool (the heavy lifting is BLAS, which releases the GIL). Score and
+abundance maps are written chunk by chunk into an output array, by default
+a .npy memmap.
+
+Example usage
+-------------
+    cube = np.load("scan_cube.npy", mmap_mode="r")      # (rows, cols, channels)
+    pca = ChunkedPCA(n_components=10, memory_limit=2e9).fit(cube)
+    scores = pca.transform(cube, out="scores.npy")
+    nmf = ChunkedNMF(n_components=4, memory_limit=2e9)
+    abundances = nmf.fit_transform(cube, out="abundances.npy")
+    endmembers = nmf.components
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import numpy as np
+
+
+def _flat(cube):
+    """
+    Return (pixels, channels, spatial shape) of a cube whose last axis is
+    the spectral axis.
+    """
+    shape = cube.shape
+    pixels = int(np.prod(shape[:-1]))
+    return pixels, shape[-1], shape[:-1]
+
+
+def _read(cube, start, stop, spatial):
+    """
+    Read pixels [start, stop) of a cube as a float32 (n, channels) array.
+    C-contiguous arrays and memmaps are sliced through a flat view; other
+    arrays are read in the largest rectangular blocks that lie inside the
+    range, so no read is larger than the chunk.
+    """
+    channels = cube.shape[-1]
+    if isinstance(cube, np.ndarray) and cube.flags.c_contiguous:
+        return np.asarray(cube.reshape(-1, channels)[start:stop], dtype=np.float32)
+    if len(spatial) == 1:
+        return np.asarray(cube[start:stop], dtype=np.float32)
+    x = np.empty((stop - start, channels), dtype=np.float32)
+    position = start
+    while position < stop:
+        remaining = stop - position
+        index = [int(i) for i in np.unravel_index(position, spatial)]
+        # Extend the block over whole trailing axes while it stays aligned
+        # and inside the range
+        axis, inner = len(spatial) - 1, 1
+        while axis > 0 and index[axis] == 0 and inner * spatial[axis] <= remaining:
+            inner *= spatial[axis]
+            axis -= 1
+        count = min(spatial[axis] - index[axis], remaining // inner)
+        block = cube[tuple(index[:axis]) + (slice(index[axis], index[axis] + count),)]
+        n = count * inner
+        x[position - start:position - start + n] = np.asarray(block, dtype=np.float32).reshape(n, channels)
+        position += n
+    return x
+
+
+def _output(out, pixels, k, spatial):
+    """
+    Create the output array: (pixels, k) in memory, or a .npy memmap with
+    the cube's spatial shape plus a component axis when given a path.
+    """
+    if out is None:
+        return np.empty((pixels, k), dtype=np.float32)
+    if isinstance(out, (str, os.PathLike)):
+        return np.lib.format.open_memmap(out, mode="w+", dtype=np.float32, shape=tuple(spatial) + (k,))
+    return out
+
+
+def _write(out, start, stop, values):
+    """
+    Write rows [start, stop) of the flattened output. Outputs other than
+    NumPy arrays (e.g. zarr) must be 2D (pixels, components).
+    """
+    if out.ndim > 2:
+        out = out.reshape(-1, out.shape[-1])
+    out[start:stop] = values
+
+
+class _Chunked:
+    """
+    Shared chunking and thread-pool logic.
+    """
+
+    def __init__(self, n_components, memory_limit=1e9, workers=None):
+        self.n_components = n_components
+        self.memory_limit = memory_limit
+        self.workers = workers or os.cpu_count() or 1
+
+    def _plan(self, pixels, channels, fixed=0):
+        """
+        Split the pixels into chunks that fit the memory cap.
+
+        Each worker holds its chunk plus a few same-sized temporaries, and
+        `fixed` bytes that do not depend on the chunk size (e.g. a partial
+        Gram matrix). Fewer workers are used if the fixed costs would
+        otherwise take more than half of each worker's share.
+
+        Returns
+        -------
+        tuple
+            (list of (start, stop) ranges, number of workers).
+
+        """
+        per_pixel = channels * 4 * 4
+        workers = self.workers
+        if fixed:
+            workers = max(1, min(workers, int(self.memory_limit // (2 * fixed))))
+        budget = self.memory_limit / workers - fixed
+        step = max(1, int(budget // per_pixel))
+        return [(start, min(start + step, pixels)) for start in range(0, pixels, step)], workers
+
+    def _map(self, function, ranges, workers):
+        """
+        Run function(start, stop) over the ranges, at most `workers` in
+        flight, yielding results in order.
+        """
+        with ThreadPoolExecutor(workers) as pool:
+            for i in range(0, len(ranges), workers):
+                batch = [pool.submit(function, *r) for r in ranges[i:i + workers]]
+                for future in batch:
+                    yield future.result()
+
+
+class ChunkedPCA(_Chunked):
+    """
+    PCA from streamed sums: one pass accumulates the mean and covariance,
+    a second optional pass writes the score maps.
+    """
+
+    def fit(self, cube):
+        """
+        Fit the principal components of a cube.
+
+        Parameters
+        ----------
+        cube : array_like
+            Hyperspectral cube with the spectral axis last.
+
+        Returns
+        -------
+        ChunkedPCA
+
+        """
+        pixels, channels, spatial = _flat(cube)
+
+        def partial(start, stop):
+            x = _read(cube, start, stop, spatial).astype(np.float64)
+            return len(x), x.sum(axis=0), x.T @ x
+
+        n = 0
+        total = np.zeros(channels)
+        gram = np.zeros((channels, channels))
+        # Every worker returns a float64 channels x channels partial Gram
+        ranges, workers = self._plan(pixels, channels, fixed=8 * channels ** 2)
+        for count, s, g in self._map(partial, ranges, workers):
+            n += count
+            total += s
+            gram += g
+        self.mean = total / n
+        covariance = (gram - n * np.outer(self.mean, self.mean)) / max(n - 1, 1)
+        values, vectors = np.linalg.eigh(covariance)
+        order = np.argsort(values)[::-1][:self.n_components]
+        self.explained_variance = values[order]
+        self.explained_variance_ratio = values[order] / values.sum()
+        self.components = vectors[:, order].T.astype(np.float32)
+        return self
+
+    def transform(self, cube, out=None):
+        """
+        Write the PCA scores of every pixel.
+
+        Parameters
+        ----------
+        cube : array_like
+            Hyperspectral cube with the spectral axis last.
+        out : str or array_like, optional
+            .npy path (opened as a memmap) or a preallocated array. The
+            default allocates in memory.
+
+        Returns
+        -------
+        numpy.ndarray
+            Scores with the cube's spatial shape plus a component axis.
+
+        """
+        pixels, channels, spatial = _flat(cube)
+        result = _output(out, pixels, self.n_components, spatial)
+        mean = self.mean.astype(np.float32)
+
+        def project(start, stop):
+            return start, stop, (_read(cube, start, stop, spatial) - mean) @ self.components.T
+
+        for start, stop, scores in self._map(project, *self._plan(pixels, channels)):
+            _write(result, start, stop, scores)
+        return result.reshape(tuple(spatial) + (self.n_components,)) if result.ndim == 2 else result
+
+
+class ChunkedNMF(_Chunked):
+    """
+    Online NMF (sufficient-statistics form): each chunk's abundances are
+    solved against the current endmembers, then the endmembers are updated
+    from running sums, so one pass over the cube both fits the model and
+    writes the abundance maps.
+    """
+
+    def __init__(self, n_components, memory_limit=1e9, workers=None, inner_iterations=30,
+                 passes=1, seed=0):
+        """
+        Parameters
+        ----------
+        n_components : int
+            Number of endmembers.
+        memory_limit : float, optional
+            Approximate working memory cap [bytes]. The default is 1e9.
+        workers : int, optional
+            Threads processing chunks in parallel. The default is the CPU
+            count.
+        inner_iterations : int, optional
+            Multiplicative-update iterations per chunk. The default is 30.
+        passes : int, optional
+            Passes over the cube. Abundances are written on the last pass,
+            so passes=2 gives abundances consistent with the final
+            endmembers. The default is 1.
+        seed : int, optional
+            Seed for the initial endmembers. The default is 0.
+
+        Returns
+        -------
+        None.
+
+        """
+        super().__init__(n_components, memory_limit, workers)
+        self.inner_iterations = inner_iterations
+        self.passes = passes
+        self.seed = seed
+        self.components = None
+
+    def _abundances(self, x, W):
+        """
+        Solve x ~ H @ W for H >= 0 with multiplicative updates.
+        """
+        H = np.full((len(x), self.n_components), max(x.mean(), 1e-6) / self.n_components, dtype=np.float32)
+        WWt = W @ W.T
+        XWt = x @ W.T
+        for _ in range(self.inner_iterations):
+            H *= XWt / np.maximum(H @ WWt, 1e-12)
+        return H
+
+    def fit_transform(self, cube, out=None):
+        """
+        Fit endmembers and write the abundance maps.
+
+        Parameters
+        ----------
+        cube : array_like
+            Hyperspectral cube with the spectral axis last. Negative values
+            (e.g. from dark subtraction) are clipped to zero.
+        out : str or array_like, optional
+            .npy path (opened as a memmap) or a preallocated array. The
+            default allocates in memory.
+
+        Returns
+        -------
+        numpy.ndarray
+            Abundances with the cube's spatial shape plus a component axis.
+            The endmember spectra are in self.components.
+
+        """
+        pixels, channels, spatial = _flat(cube)
+        ranges, workers = self._plan(pixels, channels)
+        rng = np.random.default_rng(self.seed)
+        if self.components is None:
+            # Initialise from randomly chosen pixels of the first chunk
+            first = np.maximum(_read(cube, *ranges[0], spatial), 0)
+            pick = rng.choice(len(first), self.n_components, replace=len(first) < self.n_components)
+            W = first[pick] + 1e-3 * first.mean()
+        else:
+            W = self.components.copy()
+        A = np.zeros((self.n_components, self.n_components), dtype=np.float64)
+        B = np.zeros((self.n_components, channels), dtype=np.float64)
+        result = _output(out, pixels, self.n_components, spatial)
+
+        def solve(start, stop, W):
+            x = np.maximum(_read(cube, start, stop, spatial), 0)
+            return start, stop, x, self._abundances(x, W)
+
+        with ThreadPoolExecutor(workers) as pool:
+            for p in range(self.passes):
+                last = p == self.passes - 1
+                for i in range(0, len(ranges), workers):
+                    futures = [pool.submit(solve, start, stop, W) for start, stop in ranges[i:i + workers]]
+                    for future in futures:
+                        start, stop, x, H = future.result()
+                        A += H.T.astype(np.float64) @ H
+                        B += H.T.astype(np.float64) @ x
+                        if last:
+                            _write(result, start, stop, H)
+                    # Endmember update from the running sufficient statistics
+                    W64 = W.astype(np.float64)
+                    for _ in range(5):
+                        W64 *= B / np.maximum(A @ W64, 1e-12)
+                    W = W64.astype(np.float32)
+        self.components = W
+        return result.reshape(tuple(spatial) + (self.n_components,)) if result.ndim == 2 else result
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from src.functions.adaptive import AdaptiveScan, region_score
+
+
+def disc(point):
+    # Bright disc of radius 20 centred at (50, 50) on a dark background
+    return 100.0 if np.hypot(point[0] - 50, point[1] - 50) < 20 else 0.0
+
+
+def test_region_score_metrics():
+    values = np.array([[0.0, 1.0], [2.0, 1.0], [4.0, 1.0]])
+    assert region_score(values, "range") == 4.0
+    assert region_score(values, "std") == pytest.approx(np.std([0, 2, 4]))
+    assert region_score(values, "spectral") == pytest.approx(np.var([0, 2, 4]) / 2)
+    with pytest.raises(ValueError):
+        region_score(values, "entropy")
+
+
+def test_refinement_concentrates_on_edges():
+    scan = AdaptiveScan(disc, bounds=(0, 0, 100, 100), coarse=(4, 4), threshold=1.0, min_size=2.0)
+    points, values = scan.run()
+    assert len(points) == len(values)
+    assert len({tuple(p) for p in points.tolist()}) == len(points)
+    radius = np.hypot(points[:, 0] - 50, points[:, 1] - 50)
+    near_edge = np.abs(radius - 20) < 5
+    # Refined points cluster on the disc edge, flat areas stay coarse
+    assert near_edge.mean() > 0.5
+    assert len(points) < 51 * 51
+
+
+def test_point_budget_is_respected():
+    scan = AdaptiveScan(disc, bounds=(0, 0, 100, 100), coarse=(4, 4), max_points=60)
+    points, _ = scan.run()
+    assert len(points) == 60
+
+
+def test_flat_sample_is_not_refined():
+    scan = AdaptiveScan(lambda p: 1.0, bounds=(0, 0, 10, 10), coarse=(2, 2), threshold=0.5)
+    points, _ = scan.run()
+    # 3 x 3 corners plus 4 centres
+    assert len(points) == 13
+    grid = scan.to_grid((10, 10))
+    assert np.all(grid == 1.0)
+
+
+def test_needs_a_stopping_rule():
+    with pytest.raises(ValueError):
+        AdaptiveScan(disc, bounds=(0, 0, 1, 1))
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from src.functions.coordinates import AffineTransform, CoordinateSystem, FocusSurface
+
+
+def test_fit_recovers_transform_from_fiducials():
+    truth = AffineTransform.from_params(scale=0.65, rotation=0.01, translation=(1200.0, -300.0),
+                                        flip=(False, True))
+    pixels = np.array([[0, 0], [2048, 0], [0, 2048], [2048, 2048], [1024, 512]], dtype=float)
+    transform, rms = AffineTransform.fit(pixels, truth(pixels))
+    assert rms < 1e-9
+    assert np.allclose(transform.matrix, truth.matrix)
+    with pytest.raises(ValueError):
+        AffineTransform.fit(pixels[:2], truth(pixels[:2]))
+
+
+def test_inverse_and_composition():
+    a = AffineTransform.from_params(scale=2.0, translation=(1.0, 2.0))
+    b = AffineTransform.from_params(rotation=np.pi / 2)
+    points = np.random.default_rng(0).random((10, 2))
+    assert np.allclose(a.inverse()(a(points)), points)
+    assert np.allclose((a @ b)(points), a(b(points)))
+    # Works on any leading shape
+    assert a(points.reshape(2, 5, 2)).shape == (2, 5, 2)
+
+
+def test_chained_frames_are_composed():
+    frames = CoordinateSystem()
+    image_to_stage = AffineTransform.from_params(scale=0.5, translation=(100.0, 200.0))
+    stage_to_sample = AffineTransform.from_params(rotation=0.1, translation=(-5.0, 3.0))
+    frames.add("image", "stage", image_to_stage)
+    frames.add("stage", "sample", stage_to_sample)
+    points = np.array([[10.0, 20.0], [30.0, 40.0]])
+    assert np.allclose(frames.convert(points, "image", "sample"), stage_to_sample(image_to_stage(points)))
+    assert np.allclose(frames.convert(frames.convert(points, "image", "sample"), "sample", "image"), points)
+    assert np.allclose(frames.convert(points, "stage", "stage"), points)
+    with pytest.raises(KeyError):
+        frames.convert(points, "image", "piezo")
+
+
+def test_focus_surface_fits_tilted_plane():
+    rng = np.random.default_rng(1)
+    xy = rng.random((20, 2)) * 1000
+    z = 4.0 + 1e-4 * xy[:, 0] - 2e-4 * xy[:, 1]
+    surface = FocusSurface.fit(xy, z)
+    assert np.allclose(surface.tilt(), (1e-4, -2e-4))
+    assert surface([[500.0, 500.0]])[0] == pytest.approx(4.0 - 0.05)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    frames = CoordinateSystem()
+    frames.add("image", "stage", AffineTransform.from_params(scale=0.65, translation=(1.0, 2.0)))
+    frames.focus = FocusSurface([1.0, 0.1, 0.2, 0.01, 0.0, 0.02], order=2)
+    frames.save(tmp_path / "calibration.json")
+    loaded = CoordinateSystem.load(tmp_path / "calibration.json")
+    points = np.array([[3.0, 4.0]])
+    assert np.allclose(loaded.convert(points, "image", "stage"), frames.convert(points, "image", "stage"))
+    assert np.allclose(loaded.focus(points), frames.focus(points))
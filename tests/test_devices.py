@@ -0,0 +1,150 @@
+import time
+
+import numpy as np
+import pytest
+
+from src.devices.faults import (DeviceDisconnected, DeviceTimeout, MoveTimeout, StuckMoveError,
+                                recovering, wait_until)
+from src.devices.stage import Stage
+
+
+class FlakyDevice:
+    """
+    Raises the queued errors in turn, then succeeds.
+    """
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+        self.recoveries = 0
+
+    def _recover(self):
+        self.recoveries += 1
+
+    @recovering((OSError,))
+    def command(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_recovering_retries_transient_error_once():
+    device = FlakyDevice([OSError("port dropped")])
+    assert device.command() == "ok"
+    assert device.calls == 2
+    assert device.recoveries == 1
+
+
+def test_recovering_gives_up_after_attempts():
+    device = FlakyDevice([OSError("port dropped"), OSError("still dropped")])
+    with pytest.raises(DeviceDisconnected):
+        device.command()
+    assert device.recoveries == 1
+
+
+@pytest.mark.parametrize("error", [DeviceTimeout("no reply"), StuckMoveError("stalled"),
+                                   DeviceDisconnected("closed")])
+def test_recovering_does_not_retry_device_errors(error):
+    # These are OSError subclasses, but they are not connection drops
+    device = FlakyDevice([error])
+    with pytest.raises(type(error)):
+        device.command()
+    assert device.calls == 1
+    assert device.recoveries == 0
+
+
+def test_recovering_respects_is_transient():
+    class Coded(Exception):
+        def __init__(self, val):
+            self.val = val
+
+    class Device(FlakyDevice):
+        @recovering((Coded,), is_transient=lambda e: e.val < 0)
+        def command(self):
+            return FlakyDevice.command.__wrapped__(self)
+
+    device = Device([Coded(-1)])
+    assert device.command() == "ok"
+    device = Device([Coded(5)])
+    with pytest.raises(Coded):
+        device.command()
+    assert device.recoveries == 0
+
+
+def test_wait_until_returns_when_done():
+    start = time.monotonic()
+    waited = wait_until(lambda: time.monotonic() - start > 0.02, 1.0)
+    assert 0.02 <= waited < 0.5
+
+
+def test_wait_until_times_out():
+    with pytest.raises(MoveTimeout) as info:
+        wait_until(lambda: False, 0.05)
+    assert not isinstance(info.value, StuckMoveError)
+
+
+def test_wait_until_detects_stall_before_deadline():
+    start = time.monotonic()
+    with pytest.raises(StuckMoveError):
+        wait_until(lambda: False, 5.0, progress=lambda: 1.0, stall_time=0.05)
+    assert time.monotonic() - start < 1.0
+
+
+def test_wait_until_moving_axis_is_not_stuck():
+    start = time.monotonic()
+    waited = wait_until(lambda: time.monotonic() - start > 0.1, 1.0,
+                        progress=lambda: time.monotonic(), stall_time=0.05)
+    assert waited >= 0.1
+
+
+class FakeStage(Stage):
+    """
+    Two-axis stage in nm with 0-100 um travel.
+    """
+
+    def __init__(self):
+        self.moves = []
+
+    def setPos(self, target):
+        self._move_to(np.asarray(target, dtype=np.float64))
+
+    def getPos(self):
+        return self.moves[-1] if self.moves else None
+
+    def _limits(self):
+        return [0.0, 0.0], [100e3, 100e3]
+
+    def _unit_scale(self, units):
+        return {"nm": 1.0, "um": 1e3, "mm": 1e6}[units]
+
+    def _move_to(self, target):
+        self.moves.append(target.tolist())
+
+
+def test_move_sequence_converts_units_and_reports_arrivals():
+    stage = FakeStage()
+    results = stage.move_sequence([[1, 2], [3, 4]], "um", on_arrival=lambda i, p: (i, p.tolist()))
+    assert stage.moves == [[1e3, 2e3], [3e3, 4e3]]
+    assert results == [(0, [1.0, 2.0]), (1, [3.0, 4.0])]
+
+
+def test_move_sequence_checks_whole_path_before_moving():
+    stage = FakeStage()
+    with pytest.raises(ValueError, match="#2"):
+        stage.move_sequence([[1, 2], [3, 4], [200, 0]], "um")
+    assert stage.moves == []
+    with pytest.raises(ValueError):
+        stage.move_sequence([1.0, 2.0], "um")
+
+
+def test_stage_hooks_are_abstract():
+    class Incomplete(Stage):
+        def setPos(self, target):
+            pass
+
+        def getPos(self):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src.functions import drift
+from src.functions.drift import DriftTracker, best_focus
+
+
+def texture(shape=(64, 64), seed=0):
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(size=shape)
+    # Low-pass so sub-pixel shifts stay well defined
+    ky = np.fft.fftfreq(shape[0])[:, None]
+    kx = np.fft.fftfreq(shape[1])[None, :]
+    return np.real(np.fft.ifft2(np.fft.fft2(noise) * np.exp(-(kx ** 2 + ky ** 2) / 0.05))) + 10.0
+
+
+def shifted(image, shift):
+    """
+    Content of image moved by (row, col) pixels.
+    """
+    ky = np.fft.fftfreq(image.shape[0])[:, None]
+    kx = np.fft.fftfreq(image.shape[1])[None, :]
+    phase = np.exp(-2j * np.pi * (ky * shift[0] + kx * shift[1]))
+    return np.real(np.fft.ifft2(np.fft.fft2(image) * phase))
+
+
+class FakeASR:
+    def __init__(self):
+        self.position = np.zeros(2)
+
+    def move_absolute(self, target, units):
+        self.position = np.asarray(target, dtype=np.float64)
+
+
+@pytest.mark.parametrize("sign", [1.0, -1.0])
+def test_closed_loop_drift_correction_converges(monkeypatch, sign):
+    clock = [0.0]
+    monkeypatch.setattr(drift, "time", SimpleNamespace(monotonic=lambda: clock[0]))
+    base = texture()
+    reference_xy = np.array([0.0, 0.0])
+    pixel_size = 0.5
+    # Sample content drifts by (+0.4, +0.2) px/s in (col, row)
+    rate = np.array([0.4, 0.2])
+
+    def capture(asr, t):
+        # Content moves by sign * stage motion, plus the drift
+        col, row = sign * (asr.position - reference_xy) / pixel_size + rate * t
+        return shifted(base, (row, col))
+
+    asr = FakeASR()
+    tracker = DriftTracker(pixel_size=pixel_size, sign=sign, interval=0.0)
+    tracker.set_reference(capture(asr, 0.0))
+    errors = []
+    for step in range(1, 7):
+        clock[0] = 10.0 * step
+        tracker.move_asr(asr, reference_xy, "um")
+        residual = sign * (asr.position - reference_xy) / pixel_size + rate * clock[0]
+        errors.append(np.linalg.norm(residual))
+        tracker.measure(capture(asr, clock[0]))
+    # Nothing is known before the first measurement; after two the linear
+    # model cancels the drift
+    assert errors[0] == pytest.approx(np.hypot(4, 2))
+    assert all(e < 0.2 for e in errors[2:])
+    assert np.allclose(tracker.rate[:2], -sign * rate * pixel_size, atol=1e-3)
+
+
+def test_measure_returns_stage_offset_that_cancels_drift():
+    base = texture()
+    tracker = DriftTracker(pixel_size=2.0, sign=1.0)
+    tracker.set_reference(base, t=0.0)
+    offset = tracker.measure(shifted(base, (3.0, -1.0)), t=1.0, correction=(0.0, 0.0))
+    # Content moved +3 rows, -1 col: move the stage by (+2, -6) um in (x, y)
+    assert np.allclose(offset[:2], [2.0, -6.0], atol=0.05)
+    assert np.isnan(offset[2])
+
+
+def test_best_focus_interpolates_peak():
+    z = np.linspace(-2, 2, 9)
+    assert best_focus(z, -(z - 0.3) ** 2) == pytest.approx(0.3)
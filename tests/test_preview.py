@@ -0,0 +1,82 @@
+import threading
+import time
+
+import numpy as np
+
+from src.functions.preview import LatestValue, PreviewTap, reduce_preview
+
+
+def test_reduce_preview_downsamples_and_bins():
+    frame = np.arange(64, dtype=np.uint16).reshape(8, 8)
+    assert reduce_preview(frame, downsample=2).tolist() == frame[::2, ::2].tolist()
+    binned = reduce_preview(frame, binning=2)
+    assert binned.shape == (4, 4)
+    assert binned[0, 0] == np.mean([0, 1, 8, 9])
+    # Spectra bin along their only axis; leftover pixels are dropped
+    assert reduce_preview(np.arange(7.0), binning=3).tolist() == [1.0, 4.0]
+
+
+def test_latest_value_keeps_only_the_newest_item():
+    channel = LatestValue()
+    for i in range(3):
+        channel.put(i)
+    assert channel.get(0.1) == 2
+    assert channel.dropped == 2
+    assert channel.get(0.01) is None
+    channel.close()
+    assert channel.get() is None
+
+
+def test_tap_does_nothing_without_subscribers():
+    tap = PreviewTap(max_rate=None)
+    assert not tap.offer(np.zeros((4, 4)))
+    assert tap.published == 0
+
+
+def test_tap_caps_rate_and_decimates():
+    tap = PreviewTap(max_rate=1.0, decimate=2)
+    with tap.subscribe() as preview:
+        assert not tap.offer(np.zeros(4))  # decimated
+        assert tap.offer(np.ones(4), t=1.0)
+        assert not tap.offer(np.zeros(4))
+        assert not tap.offer(np.zeros(4))  # rate capped
+        t, image = preview.get(0.1)
+        assert t == 1.0
+        assert image.tolist() == [1.0] * 4
+    assert tap.published == 1
+    assert tap._subscribers == ()
+
+
+def test_preview_is_a_copy_of_the_acquisition_buffer():
+    tap = PreviewTap(max_rate=None)
+    buffer = np.ones((4, 4))
+    with tap.subscribe() as preview:
+        tap.offer(buffer)
+        buffer[:] = 0
+        _, image = preview.get(0.1)
+    assert np.all(image == 1)
+
+
+def test_slow_viewer_does_not_block_acquisition():
+    tap = PreviewTap(max_rate=None)
+    received = []
+    subscription = tap.subscribe(timeout=0.05)
+
+    def viewer():
+        for t, image in subscription:
+            received.append(t)
+
+    thread = threading.Thread(target=viewer)
+    thread.start()
+    for i in range(1000):
+        tap.offer(np.zeros(16), t=float(i))
+    deadline = time.monotonic() + 1.0
+    while 999.0 not in received and time.monotonic() < deadline:
+        time.sleep(0.001)
+    subscription.close()
+    thread.join(1.0)
+    assert not thread.is_alive()
+    assert tap.published == 1000
+    # The viewer saw an increasing subset ending with the newest preview
+    assert received == sorted(received)
+    assert received[-1] == 999.0
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from src.devices.transport import RecordingProxy
+from src.functions.profiler import CATEGORIES, ScanProfiler
+from src.functions.scan import ScanRunner
+
+
+class SlowSerial:
+    def __init__(self, delay=0.01):
+        self.delay = delay
+
+    def write(self, data):
+        time.sleep(self.delay)
+        return len(data)
+
+
+class Vortran:
+    def __init__(self):
+        self.connection = SlowSerial()
+
+    def _recover(self):
+        self.connection = SlowSerial()
+
+    def sendCommand(self, command):
+        return self.connection.write(command.encode())
+
+
+def test_connection_calls_count_as_io():
+    laser = Vortran()
+    connection = laser.connection
+    with ScanProfiler([laser]) as profiler:
+        assert isinstance(laser.connection, RecordingProxy)
+        for _ in range(5):
+            laser.sendCommand("?LP")
+        time.sleep(0.02)
+    assert laser.connection is connection
+    totals = profiler.breakdown()
+    assert totals["io"] == pytest.approx(0.05, abs=0.03)
+    assert totals["python"] >= 0.015
+    assert totals["wall"] == pytest.approx(sum(totals[c] for c in CATEGORIES), rel=1e-6)
+
+
+def test_exit_keeps_connection_opened_by_reconnect():
+    laser = Vortran()
+    with ScanProfiler([laser]):
+        laser._recover()
+        reconnected = laser.connection
+    assert laser.connection is reconnected
+    assert not isinstance(laser.connection, RecordingProxy)
+
+
+def test_exit_removes_hooks():
+    class Detector:
+        def read(self):
+            time.sleep(0.01)
+            return 1
+
+    detector = Detector()
+    with ScanProfiler(detectors={detector: ["read"]}) as profiler:
+        assert detector.read() == 1
+    assert "read" not in vars(detector)
+    assert profiler.breakdown()["readout"] >= 0.01
+
+
+def test_runner_points_are_broken_down(tmp_path):
+    runner = ScanRunner([[0.0], [1.0], [2.0]], move=lambda point: time.sleep(0.005),
+                        acquire=lambda index, point: time.sleep(0.01) or {"index": index},
+                        journal=str(tmp_path / "scan.jsonl"))
+    with ScanProfiler() as profiler:
+        profiler.attach_runner(runner)
+        runner.run()
+    points = profiler.per_point()
+    assert points["index"].tolist() == [0, 1, 2]
+    assert all(points["motion"] >= 0.005)
+    assert all(points["readout"] >= 0.01)
+    assert profiler.bottleneck()[0] in CATEGORIES
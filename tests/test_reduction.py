@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from src.functions.reduction import BandIntegration, PCAProjection, PeakExtraction, ReductionPipeline
+
+WAVELENGTHS = np.linspace(700.0, 900.0, 401)
+
+
+def gaussian(centre, height=10.0, sigma=2.0):
+    return height * np.exp(-0.5 * ((WAVELENGTHS - centre) / sigma) ** 2)
+
+
+def test_band_integration_matches_trapezoid():
+    spectra = np.vstack([np.ones_like(WAVELENGTHS), 2 * np.ones_like(WAVELENGTHS)])
+    bands = BandIntegration({"a": [750, 760], "b": [800, 850]}, WAVELENGTHS)
+    out = bands(spectra)
+    # 21 pixels of width 0.5 nm inside [750, 760]
+    assert out["a"].tolist() == pytest.approx([10.5, 21.0])
+    assert out["b"].tolist() == pytest.approx([50.5, 101.0])
+    with pytest.raises(ValueError):
+        BandIntegration({"empty": [100, 200]}, WAVELENGTHS)
+
+
+def test_peak_extraction_finds_subpixel_centre_and_width():
+    spectra = np.vstack([gaussian(781.13), gaussian(786.4, height=4.0, sigma=1.0)])
+    out = PeakExtraction((775, 795), WAVELENGTHS, name="laser")(spectra)
+    assert out["laser_centre"] == pytest.approx([781.13, 786.4], abs=0.05)
+    assert out["laser_height"] == pytest.approx([10.0, 4.0], rel=0.02)
+    # FWHM of a gaussian is 2.355 sigma, counted to pixel resolution
+    assert out["laser_fwhm"] == pytest.approx([4.71, 2.355], abs=0.5)
+    with pytest.raises(ValueError):
+        PeakExtraction((700.1, 700.4), WAVELENGTHS)
+
+
+def test_pca_fit_reconstructs_low_rank_spectra(tmp_path):
+    rng = np.random.default_rng(0)
+    components = np.vstack([gaussian(760), gaussian(820), gaussian(860)])
+    spectra = rng.random((50, 3)) @ components + 1.0
+    pca = PCAProjection.fit(spectra, 3)
+    scores = pca(spectra)["pca"]
+    assert scores.shape == (50, 3)
+    assert np.allclose(pca.reconstruct(scores), spectra, atol=1e-3)
+    pca.save(tmp_path / "basis.npz")
+    loaded = PCAProjection.load(tmp_path / "basis.npz")
+    assert np.allclose(loaded(spectra)["pca"], scores)
+
+
+def test_pipeline_from_config_keeps_raw_subset(tmp_path):
+    PCAProjection.fit(np.vstack([gaussian(760), gaussian(820), gaussian(860)]), 2).save(tmp_path / "basis.npz")
+    pipeline = ReductionPipeline.from_config({
+        "bands": {"g": [750, 770]},
+        "peaks": {"laser": [775, 795]},
+        "pca": str(tmp_path / "basis.npz"),
+        "keep_raw_every": 4,
+    }, WAVELENGTHS)
+    spectra = np.tile(gaussian(781.0), (10, 1))
+    out = pipeline(spectra, np.arange(10, 20))
+    assert set(out) == {"g", "laser_centre", "laser_height", "laser_fwhm", "pca", "raw", "raw_index"}
+    assert out["raw_index"].tolist() == [12, 16]
+    assert out["raw"].shape == (2, len(WAVELENGTHS))
+    # A single spectrum is treated as a batch of one
+    assert pipeline(spectra[0])["g"].shape == (1,)
+
+
+def test_reduction_factor():
+    pipeline = ReductionPipeline([BandIntegration({"a": [750, 760], "b": [800, 850]}, WAVELENGTHS)])
+    assert pipeline.reduction_factor(len(WAVELENGTHS)) == pytest.approx(len(WAVELENGTHS) / 2)
+    pipeline.keep_raw_every = 100
+    assert pipeline.reduction_factor(len(WAVELENGTHS)) == pytest.approx(401 / (2 + 4.01))
@@ -0,0 +1,85 @@
+import json
+
+import numpy as np
+import pytest
+
+from src.functions.scan import ScanPositionError, ScanRunner, order_points, travel_time
+
+
+def journal_entries(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+class Stage:
+    def __init__(self, fail_at=None):
+        self.position = np.zeros(2)
+        self.fail_at = fail_at
+        self.visited = []
+
+    def move(self, point):
+        if self.fail_at is not None and len(self.visited) == self.fail_at:
+            self.fail_at = None
+            raise OSError("stage dropped")
+        self.position = np.array(point)
+        self.visited.append(tuple(point))
+
+
+def test_interrupted_scan_resumes_where_it_stopped(tmp_path):
+    points = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=float)
+    journal = str(tmp_path / "scan.journal")
+    stage = Stage(fail_at=2)
+    runner = ScanRunner(points, stage.move, lambda i, p: {"i": i}, journal)
+    with pytest.raises(OSError):
+        runner.run()
+    assert runner.remaining.tolist() == [2, 3]
+
+    runner = ScanRunner(points, stage.move, lambda i, p: {"i": i}, journal)
+    done = runner.run()
+    assert sorted(done) == [0, 1, 2, 3]
+    assert stage.visited == [(0, 0), (1, 0), (1, 1), (0, 1)]
+    types = [e["type"] for e in journal_entries(journal)]
+    assert types == ["header", "point", "point", "error", "point", "point", "complete"]
+
+
+def test_numpy_results_are_journalled(tmp_path):
+    journal = str(tmp_path / "scan.journal")
+    runner = ScanRunner([[0.0], [1.0]], lambda p: None,
+                        lambda i, p: {"mean": np.float32(1.5), "counts": np.arange(3)}, journal)
+    runner.run()
+    points = [e for e in journal_entries(journal) if e["type"] == "point"]
+    assert [p["result"] for p in points] == [{"mean": 1.5, "counts": [0, 1, 2]}] * 2
+
+
+def test_rerun_of_completed_scan_adds_no_records(tmp_path):
+    journal = str(tmp_path / "scan.journal")
+    ScanRunner([[0.0], [1.0]], lambda p: None, lambda i, p: None, journal).run()
+    before = journal_entries(journal)
+    ScanRunner([[0.0], [1.0]], lambda p: None, lambda i, p: None, journal).run()
+    assert journal_entries(journal) == before
+    assert [e["type"] for e in before].count("complete") == 1
+
+
+def test_journal_of_another_scan_is_rejected(tmp_path):
+    journal = str(tmp_path / "scan.journal")
+    ScanRunner([[0.0], [1.0]], lambda p: None, lambda i, p: None, journal).run()
+    with pytest.raises(ValueError):
+        ScanRunner([[0.0], [2.0]], lambda p: None, lambda i, p: None, journal).run()
+
+
+def test_position_check(tmp_path):
+    runner = ScanRunner([[0.0], [1.0]], lambda p: None, lambda i, p: None,
+                        str(tmp_path / "scan.journal"), read_position=lambda: [0.0], tolerance=0.1)
+    with pytest.raises(ScanPositionError):
+        runner.run()
+    assert runner.remaining.tolist() == [1]
+
+
+def test_order_points_visits_nearest_first():
+    points = np.array([[10.0], [1.0], [5.0], [2.0]])
+    assert order_points(points, [0.0]).tolist() == [1, 3, 2, 0]
+    # Sequential axes add up, simultaneous axes take the longest
+    t = travel_time([0, 0], [[3, 4]], speed=1.0, accel=np.inf)
+    assert t[0] == pytest.approx(7.0)
+    t = travel_time([0, 0], [[3, 4]], speed=1.0, accel=np.inf, sequential=False)
+    assert t[0] == pytest.approx(4.0)
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from src.devices.server import DeviceClient, DeviceServer, RemoteError
+
+
+class FakeDevice:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.polls = 0
+        self.position = 0.0
+
+    def move_absolute(self, target):
+        self.position = target
+        return self.position
+
+    def ping(self, value):
+        return value
+
+    def poll(self):
+        self.polls += 1
+        time.sleep(self.delay)
+        return self.polls
+
+    def unpicklable(self):
+        return threading.Lock()
+
+    def fail(self):
+        raise ValueError("out of range")
+
+
+@pytest.fixture
+def address(tmp_path):
+    return str(tmp_path / "devices.sock")
+
+
+def test_calls_are_pipelined_and_replied_in_order(address):
+    device = FakeDevice()
+    with DeviceServer({"stage": device}, address), DeviceClient(address, timeout=2) as client:
+        futures = [client.submit("stage", "move_absolute", i) for i in range(20)]
+        assert [f.result(2) for f in futures] == list(range(20))
+        assert client.proxy("stage").ping("hello") == "hello"
+        assert device.position == 19
+
+
+def test_device_errors_and_unpicklable_replies_reach_the_client(address):
+    with DeviceServer({"stage": FakeDevice()}, address), DeviceClient(address, timeout=2) as client:
+        with pytest.raises(ValueError):
+            client.call("stage", "fail")
+        with pytest.raises(RemoteError):
+            client.call("stage", "unpicklable")
+        with pytest.raises(AttributeError):
+            client.call("stage", "_private")
+        # The worker is still alive
+        assert client.call("stage", "ping", 1) == 1
+
+
+def test_failing_subscriber_does_not_stop_the_client(address):
+    received = []
+
+    def broken(t, value):
+        raise RuntimeError("subscriber bug")
+
+    with DeviceServer({"stage": FakeDevice()}, address) as server, \
+            DeviceClient(address, timeout=2) as client:
+        client.subscribe("status", broken)
+        client.subscribe("status", lambda t, value: received.append(value))
+        client.call("stage", "ping", 0)  # subscription is registered
+        server.publish("status", 1)
+        server.publish("status", 2)
+        assert client.call("stage", "ping", 1) == 1
+        assert received == [1, 2]
+
+
+def test_telemetry_skips_ticks_while_a_poll_is_running(address):
+    device = FakeDevice(delay=0.2)
+    received = []
+    server = DeviceServer({"stage": device}, address)
+    server.add_telemetry("polls", "stage", "poll", interval=0.01)
+    with server, DeviceClient(address, timeout=2) as client:
+        client.subscribe("polls", lambda t, value: received.append(value))
+        time.sleep(0.7)
+        # A command is not queued behind a backlog of polls
+        start = time.monotonic()
+        client.call("stage", "ping", 0)
+        assert time.monotonic() - start < 0.5
+    assert device.polls <= 5
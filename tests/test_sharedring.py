@@ -0,0 +1,88 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from src.functions.sharedring import RingTimeout, SharedRing
+
+
+def consume(ring, count, results):
+    with ring:
+        for _ in range(count):
+            with ring.read(timeout=5) as (seq, t, frame):
+                results.put((seq, t, int(frame.sum())))
+
+
+def test_items_come_out_in_commit_order():
+    with SharedRing(slots=3, shape=(2, 2), dtype=np.int32) as ring:
+        for i in range(3):
+            ring.put(np.full((2, 2), i), t=float(i))
+        for i in range(3):
+            with ring.read(timeout=1) as (seq, t, frame):
+                assert (seq, t) == (i, float(i))
+                assert frame.tolist() == [[i, i], [i, i]]
+        assert ring.status()["free"] == 3
+        del frame
+
+
+def test_full_ring_applies_backpressure():
+    with SharedRing(slots=2, shape=(4,)) as ring:
+        ring.put(np.ones(4))
+        ring.put(np.ones(4))
+        with pytest.raises(RingTimeout):
+            ring.put(np.ones(4), timeout=0.05)
+        with ring.read():
+            pass
+        ring.put(np.ones(4), timeout=0.05)
+
+
+def test_failed_write_returns_slot():
+    with SharedRing(slots=1, shape=(4,)) as ring:
+        with pytest.raises(ValueError):
+            with ring.write():
+                raise ValueError("camera error")
+        assert ring.status()["free"] == 1
+        with pytest.raises(RingTimeout):
+            ring.acquire(timeout=0.05)
+
+
+def test_reclaim_frees_slots_of_dead_process():
+    with SharedRing(slots=2, shape=(4,)) as ring:
+        slot, view = ring.claim()
+        del view
+        pid = ring.status()["owners"][0]
+        assert ring.reclaim(pid) == 1
+        assert ring.status()["free"] == 2
+
+
+def test_worker_process_reads_frames_and_creator_unlinks():
+    ring = SharedRing(slots=2, shape=(64, 64), dtype=np.uint16)
+    results = multiprocessing.Queue()
+    worker = multiprocessing.Process(target=consume, args=(ring, 5, results), daemon=True)
+    worker.start()
+    for i in range(5):
+        ring.put(np.full((64, 64), i, dtype=np.uint16), timeout=5)
+    received = [results.get(timeout=5) for _ in range(5)]
+    worker.join(5)
+    assert worker.exitcode == 0
+    assert [r[0] for r in received] == list(range(5))
+    assert [r[2] for r in received] == [64 * 64 * i for i in range(5)]
+    name = ring.name
+    # The worker closing its copy must not have removed the block
+    shared_memory.SharedMemory(name=name).close()
+    ring.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+
+
+def test_close_with_live_view_keeps_mapping():
+    ring = SharedRing(slots=2, shape=(4,), dtype=np.int32)
+    slot, view = ring.claim()
+    view[:] = 7
+    ring.close()
+    # The view is still backed by the mapping
+    assert view.tolist() == [7, 7, 7, 7]
+    del view
+    ring.close()
+    assert ring._shm is None
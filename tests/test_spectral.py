@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from src.functions.spectral import SpectralLibrary
+
+
+def library_spectra(n=20, channels=64, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, channels)
+    centres = rng.random(n)
+    widths = 0.02 + 0.1 * rng.random(n)
+    return np.exp(-0.5 * ((x[None, :] - centres[:, None]) / widths[:, None]) ** 2) + 0.1
+
+
+@pytest.mark.parametrize("metric", ["cosine", "correlation"])
+@pytest.mark.parametrize("n_components", [None, 19, 8])
+def test_scaled_library_spectra_match_themselves(metric, n_components):
+    spectra = library_spectra()
+    library = SpectralLibrary(spectra, metric=metric, n_components=n_components)
+    indices, scores = library.classify(3 * spectra)
+    assert np.array_equal(indices, np.arange(len(spectra)))
+    assert np.allclose(scores, 1.0, atol=1e-4)
+
+
+@pytest.mark.parametrize("metric", ["cosine", "correlation"])
+def test_reduced_search_agrees_with_full_search(metric):
+    spectra = library_spectra()
+    rng = np.random.default_rng(1)
+    queries = 3 * spectra[rng.integers(0, 20, 200)] + rng.normal(0, 0.01, (200, 64))
+    full = SpectralLibrary(spectra, metric=metric)
+    reduced = SpectralLibrary(spectra, metric=metric, n_components=20)
+    full_i, full_s = full.classify(queries)
+    reduced_i, reduced_s = reduced.classify(queries)
+    assert np.array_equal(full_i, reduced_i)
+    # The library spans 20 directions, so the reduced scores can only be
+    # higher (the residual outside them is dropped)
+    assert np.all(reduced_s >= full_s - 1e-4)
+
+
+def test_min_score_marks_unmatched():
+    spectra = library_spectra()
+    library = SpectralLibrary(spectra)
+    indices, _ = library.classify(np.vstack([spectra[4], -spectra[4]]), min_score=0.9)
+    assert indices.tolist() == [4, -1]
+
+
+def test_index_search_finds_exact_matches():
+    spectra = library_spectra(n=200, seed=2)
+    library = SpectralLibrary(spectra, n_components=32)
+    library.build_index(n_lists=8)
+    indices, _ = library.classify_cube(spectra.reshape(10, 20, -1), n_probe=2)
+    assert indices.shape == (10, 20)
+    assert np.mean(indices.ravel() == np.arange(200)) > 0.95
@@ -0,0 +1,91 @@
+import time
+
+import numpy as np
+import pytest
+
+from src.functions.stabilization import PowerStabilizer
+
+
+class FakeLaser:
+    """
+    Delivers `gain` x the power setting, plus an offset.
+    """
+
+    def __init__(self, gain=1.0, offset=0.0):
+        self.gain = gain
+        self.offset = offset
+        self.setting = 0.0
+        self.sent = []
+
+    def sendCommand(self, command):
+        if command == "?LP":
+            return f"{self.gain * self.setting + self.offset:.3f}"
+        self.setting = float(command.split("=")[1])
+        self.sent.append(self.setting)
+        return ""
+
+
+def drive(stabilizer, duration, t0=0.0):
+    for t in np.arange(t0, t0 + duration, stabilizer.period):
+        stabilizer.step(float(t))
+
+
+def test_no_correction_inside_deadband():
+    laser = FakeLaser(offset=0.01)
+    stabilizer = PowerStabilizer(laser, setpoint=40.0, deadband=0.05)
+    stabilizer._send(40.0, 0.0)
+    drive(stabilizer, 5.0)
+    assert stabilizer.corrections == 0
+    assert laser.sent == [40.0]
+
+
+def test_loop_compensates_drift_with_limited_steps():
+    laser = FakeLaser(gain=0.9)
+    stabilizer = PowerStabilizer(laser, setpoint=40.0, max_step=1.0, min_interval=0.5)
+    stabilizer._send(40.0, 0.0)
+    drive(stabilizer, 60.0)
+    assert laser.gain * laser.setting == pytest.approx(40.0, abs=stabilizer.tolerance)
+    assert stabilizer.in_tolerance(50.0, 60.0)
+    assert not stabilizer.in_tolerance(0.0, 60.0)
+    t, commands = stabilizer.commands.arrays()
+    assert np.all(np.abs(np.diff(commands)) <= 1.0 + 1e-9)
+    assert np.all(np.diff(t) >= 0.5 - 1e-9)
+    # A few corrections per second at most, not one per sample
+    assert stabilizer.corrections < 60.0 / 0.5
+    times, power = stabilizer.trace(10.0, 11.0)
+    assert times[0] >= 10.0 and times[-1] <= 11.0
+    assert len(times) == len(power) == 21
+
+
+def test_integral_does_not_wind_up_past_limits():
+    laser = FakeLaser(gain=0.0)
+    stabilizer = PowerStabilizer(laser, setpoint=40.0, max_power=50.0)
+    stabilizer._send(40.0, 0.0)
+    drive(stabilizer, 100.0)
+    assert laser.setting == 50.0
+    assert stabilizer._integral == pytest.approx(10.0)
+    # Once the light comes back the setting recovers without a long overshoot
+    laser.gain = 1.0
+    drive(stabilizer, 5.0, t0=100.0)
+    assert laser.setting < 45.0
+    drive(stabilizer, 40.0, t0=105.0)
+    assert laser.setting == pytest.approx(40.0, abs=stabilizer.tolerance)
+
+
+def test_thread_keeps_running_after_read_errors():
+    laser = FakeLaser()
+    failures = [RuntimeError("timeout")] * 3
+
+    def read():
+        if failures:
+            raise failures.pop()
+        return float(laser.sendCommand("?LP"))
+
+    with PowerStabilizer(laser, setpoint=10.0, read=read, rate=200.0) as stabilizer:
+        deadline = time.monotonic() + 2.0
+        while len(stabilizer.power) < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert not failures
+    assert len(stabilizer.power) >= 5
+    assert stabilizer._thread is None
+    assert laser.sent[0] == 10.0
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from src.functions.stitching import ChunkedMosaic, MosaicStitcher, feather, phase_correlation
+
+
+def scene(shape=(200, 200), seed=0):
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(size=shape)
+    ky = np.fft.fftfreq(shape[0])[:, None]
+    kx = np.fft.fftfreq(shape[1])[None, :]
+    return np.real(np.fft.ifft2(np.fft.fft2(noise) * np.exp(-(kx ** 2 + ky ** 2) / 0.02))) + 5.0
+
+
+def tile_grid(image, tile=64, step=48, error=3, seed=1):
+    """
+    Tiles cut from image, with their true (row, col) origins and stage
+    positions that are off by up to `error` pixels.
+    """
+    rng = np.random.default_rng(seed)
+    tiles, true, stage = [], [], []
+    for r in range(0, image.shape[0] - tile + 1, step):
+        for c in range(0, image.shape[1] - tile + 1, step):
+            tiles.append(image[r:r + tile, c:c + tile])
+            true.append((r, c))
+            dr, dc = rng.integers(-error, error + 1, 2)
+            stage.append(((c + dc) * 0.5, (r + dr) * 0.5))
+    return tiles, np.array(true), stage
+
+
+def test_phase_correlation_measures_integer_shift():
+    image = scene()
+    shift, peak = phase_correlation(image[20:84, 20:84], image[15:79, 27:91])
+    assert np.allclose(shift, [5, -7], atol=0.1)
+    assert peak > 0.5
+
+
+def test_feather_is_zero_free_and_peaks_in_the_middle():
+    weight = feather((5, 4))
+    assert weight.min() > 0
+    assert weight[2, 1] == weight.max()
+
+
+def test_chunked_mosaic_add_and_remove():
+    mosaic = ChunkedMosaic(chunk=16)
+    image = np.full((20, 20), 3.0, dtype=np.float32)
+    weight = np.ones((20, 20), dtype=np.float32)
+    mosaic.add(image, weight, (-5, 10))
+    assert mosaic.bounds() == (-16, 0, 16, 32)
+    out = mosaic.to_array()
+    assert np.nanmax(out) == pytest.approx(3.0)
+    assert np.sum(~np.isnan(out)) == 400
+    mosaic.add(image, weight, (-5, 10), sign=-1)
+    assert np.all(np.isnan(mosaic.to_array()))
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_stitcher_recovers_true_tile_positions(parallel):
+    image = scene()
+    tiles, true, stage = tile_grid(image)
+    stitcher = MosaicStitcher(pixel_size=0.5, tile_shape=(64, 64), chunk=64, workers=2)
+    if parallel:
+        with stitcher:
+            for tile, position in zip(tiles, stage):
+                stitcher.add_tile(tile, position)
+            mosaic = stitcher.finalize()
+    else:
+        for tile, position in zip(tiles, stage):
+            stitcher.add_tile(tile, position)
+        mosaic = stitcher.finalize()
+    placed = np.array(stitcher.placed)
+    # Positions are only defined up to the position of tile 0
+    assert np.array_equal(placed - placed[0], true - true[0])
+    origin = np.min(placed, axis=0)
+    out = mosaic.to_array()
+    r0, c0 = origin - np.array(mosaic.bounds()[:2])
+    assembled = out[r0:r0 + 160, c0:c0 + 160]
+    assert np.allclose(assembled, image[:160, :160], atol=1e-4)
+
+
+def test_wrong_tile_shape_is_rejected():
+    stitcher = MosaicStitcher(pixel_size=1.0, tile_shape=(8, 8))
+    with pytest.raises(ValueError):
+        stitcher.add_tile(np.zeros((8, 9)), (0, 0))
@@ -0,0 +1,77 @@
+import threading
+
+import numpy as np
+
+from src.functions.telemetry import ActivityLock, TelemetryPoller, TimeSeriesRing
+
+
+def test_ring_keeps_latest_samples_in_order():
+    ring = TimeSeriesRing(4)
+    for i in range(6):
+        ring.append(i, 10 * i)
+    t, value = ring.arrays()
+    assert t.tolist() == [2, 3, 4, 5]
+    assert value.tolist() == [20, 30, 40, 50]
+    assert ring.latest(2)[0].tolist() == [4, 5]
+
+
+def test_background_waits_for_idle_gap():
+    lock = ActivityLock()
+    with lock:
+        pass
+    assert not lock.acquire_background(min_idle=10.0)
+    assert lock.acquire_background(min_idle=0.0)
+    lock.release_background()
+
+    # Busy in another thread: background acquisition does not block
+    held = threading.Event()
+    release = threading.Event()
+
+    def foreground():
+        with lock:
+            held.set()
+            release.wait()
+
+    thread = threading.Thread(target=foreground)
+    thread.start()
+    held.wait()
+    assert not lock.acquire_background()
+    release.set()
+    thread.join()
+
+
+def test_limit_callbacks_fire_on_entry_and_exit():
+    values = iter([30.0, 36.0, 37.0, 34.0])
+    poller = TelemetryPoller()
+    channel = poller.add_channel("laser.temperature", lambda: next(values), high=35.0)
+    events = []
+    poller.on_limit(lambda name, t, value, limit: events.append((name, value, limit)))
+    for _ in range(4):
+        assert poller.poll(channel)
+    assert events == [("laser.temperature", 36.0, "high"), ("laser.temperature", 34.0, None)]
+    assert len(poller.history("laser.temperature")[0]) == 4
+
+
+def test_failing_limit_callback_does_not_stop_polling():
+    poller = TelemetryPoller()
+    channel = poller.add_channel("stage.temperature", lambda: 70.0, high=60.0)
+    seen = []
+
+    def broken(name, t, value, limit):
+        raise RuntimeError("callback bug")
+
+    poller.on_limit(broken)
+    poller.on_limit(lambda name, t, value, limit: seen.append(limit))
+    assert poller.poll(channel)
+    assert seen == ["high"]
+    assert poller.latest("stage.temperature")[1] == 70.0
+
+
+def test_failed_read_is_recorded_as_nan():
+    def read():
+        raise OSError("no reply")
+
+    poller = TelemetryPoller()
+    channel = poller.add_channel("laser.power", read)
+    assert poller.poll(channel)
+    assert np.isnan(poller.latest("laser.power")[1])
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from src.functions.timelapse import TimeLapse
+
+POINTS = np.array([[0.0, 0.0], [100.0, 0.0], [10.0, 0.0]])
+
+
+def lapse(acquire=None, **kwargs):
+    moves = []
+    kwargs.setdefault("interval", 0.05)
+    kwargs.setdefault("timepoints", 4)
+    lapse = TimeLapse(POINTS, move=lambda p: moves.append(p.tolist()),
+                      acquire=acquire or (lambda k, i, p: (k, i)), **kwargs)
+    return lapse, moves
+
+
+def test_timepoints_follow_the_deadline_grid():
+    timelapse, moves = lapse()
+    records = timelapse.run()
+    assert records["timepoint"].tolist() == [0, 1, 2, 3]
+    assert not records["skipped"].any()
+    assert np.allclose(np.diff(records["scheduled"]), 0.05)
+    # Deadlines are hit to within scheduler resolution and never early
+    assert np.all(records["lateness"] >= 0)
+    assert timelapse.jitter()["max"] < 0.02
+    # Nearest-first within a timepoint, continuing from where the stage ended
+    assert moves[:3] == [[0.0, 0.0], [10.0, 0.0], [100.0, 0.0]]
+    assert moves[3:6] == [[100.0, 0.0], [10.0, 0.0], [0.0, 0.0]]
+    assert timelapse.results[(2, 1)] == (2, 1)
+    assert len(timelapse.results) == 12
+
+
+def slow_first(k, i, p):
+    if k == 0 and i == 0:
+        time.sleep(0.12)
+
+
+def test_skip_drops_missed_timepoints():
+    timelapse, _ = lapse(slow_first, overrun="skip", timepoints=5)
+    records = timelapse.run()
+    assert records["timepoint"].tolist() == [0, 1, 2, 3, 4]
+    assert records["skipped"].tolist() == [False, True, True, False, False]
+    # The grid is kept
+    assert np.allclose(records["scheduled"] - records["scheduled"][0], np.arange(5) * 0.05)
+    stats = timelapse.jitter()
+    assert stats["acquired"] == 3 and stats["skipped"] == 2
+
+
+def test_compress_catches_up_on_the_original_grid():
+    timelapse, _ = lapse(slow_first, overrun="compress", timepoints=5)
+    records = timelapse.run()
+    assert not records["skipped"].any()
+    assert np.allclose(records["scheduled"] - records["scheduled"][0], np.arange(5) * 0.05)
+    # Timepoints 1 and 2 start late, back to back, then the schedule has caught up
+    assert records["lateness"][1] > 0.05
+    assert records["start"][2] == pytest.approx(records["end"][1], abs=0.01)
+    assert records["lateness"][4] < 0.02
+
+
+def test_shift_moves_the_grid_back():
+    timelapse, _ = lapse(slow_first, overrun="shift", timepoints=3)
+    records = timelapse.run()
+    assert not records["skipped"].any()
+    assert records["scheduled"][1] == pytest.approx(records["end"][0], abs=1e-6)
+    assert records["scheduled"][2] - records["scheduled"][1] == pytest.approx(0.05)
+    assert np.all(records["lateness"][1:] < 0.02)
+
+
+def test_idle_tasks_get_the_remaining_time_and_failures_are_caught():
+    offered = []
+
+    def measure(idle):
+        offered.append(idle)
+        return False
+
+    def broken(idle):
+        raise RuntimeError("autofocus failed")
+
+    timelapse, _ = lapse(interval=0.1, timepoints=3)
+    timelapse.add_idle_task(broken)
+    timelapse.add_idle_task(measure)
+    records = timelapse.run()
+    assert len(records) == 3
+    # Nothing to offer before timepoint 0, then most of each interval
+    assert len(offered) == 2
+    assert all(0.05 < idle < 0.1 for idle in offered)
+
+
+def test_stop_from_another_thread():
+    timelapse, _ = lapse(interval=0.05, timepoints=None)
+    threading.Timer(0.12, timelapse.stop).start()
+    records = timelapse.run()
+    assert 2 <= len(records) <= 4
+    with pytest.raises(ValueError):
+        TimeLapse(POINTS, 1.0, None, None, overrun="drop")
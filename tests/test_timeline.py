@@ -0,0 +1,80 @@
+import json
+
+import numpy as np
+import pytest
+
+from src.functions import timeline
+from src.functions.timeline import BEGIN, COUNTER, END, ClockDomain, EventRecorder
+
+
+def test_clock_domain_fit_maps_hardware_time():
+    hw = np.array([0.0, 1.0, 2.0, 3.0])
+    host = 100.0 + 1.001 * hw
+    domain = ClockDomain("camera")
+    assert domain.fit(hw, host) == pytest.approx(0.0, abs=1e-9)
+    assert domain.to_monotonic(10.0) == pytest.approx(110.01)
+
+
+def test_ring_overwrites_oldest_and_returns_chronological_order():
+    recorder = EventRecorder(capacity=3)
+    for t in [5.0, 1.0, 2.0, 3.0, 4.0]:
+        recorder.record("ASR", "poll", value=t, t=t)
+    events = recorder.snapshot()
+    assert events["t"].tolist() == [2.0, 3.0, 4.0]
+
+
+def test_hardware_timestamps_are_mapped_on_record():
+    recorder = EventRecorder()
+    recorder.domain("daq").fit([0.0, 1.0], [50.0, 51.0])
+    recorder.record("daq", "edge", t=0.5, domain="daq")
+    assert recorder.select("daq", "edge")["t"].tolist() == [50.5]
+
+
+def test_spans_give_busy_intervals_and_idle_gaps():
+    recorder = EventRecorder()
+    recorder.record("ASR", "move", kind=BEGIN, t=0.0)
+    recorder.record("ASR", "move", kind=END, t=1.0)
+    recorder.record("Q545", "move", kind=BEGIN, t=0.5)
+    recorder.record("Q545", "move", kind=END, t=1.5)
+    recorder.record("ASR", "move", kind=BEGIN, t=3.0)
+    recorder.record("ASR", "move", kind=END, t=4.0)
+    assert recorder.busy_intervals("ASR").tolist() == [[0.0, 1.0], [3.0, 4.0]]
+    assert recorder.idle_gaps().tolist() == [[1.5, 3.0]]
+    assert recorder.idle_gaps(min_gap=2.0).shape == (0, 2)
+
+
+def test_span_records_end_when_body_raises():
+    recorder = EventRecorder()
+    with pytest.raises(ValueError):
+        with recorder.span("Vortran", "sendCommand"):
+            raise ValueError("bad reply")
+    assert recorder.snapshot()["kind"].tolist() == [BEGIN, END]
+
+
+def test_module_functions_use_replaceable_recorder():
+    previous = timeline.get_recorder()
+    recorder = EventRecorder(capacity=10)
+    timeline.set_recorder(recorder)
+    try:
+        timeline.record("laser", "power", 40.0, COUNTER)
+        with timeline.span("ASR", "home"):
+            pass
+    finally:
+        timeline.set_recorder(previous)
+    assert len(recorder.snapshot()) == 3
+    recorder.enabled = False
+    recorder.record("laser", "power", 41.0)
+    assert len(recorder.snapshot()) == 3
+
+
+def test_chrome_trace_export(tmp_path):
+    recorder = EventRecorder()
+    with recorder.span("ASR", "move_absolute", 1000.0):
+        pass
+    recorder.record("laser", "power", 40.0, COUNTER)
+    recorder.export_chrome_trace(tmp_path / "trace.json")
+    with open(tmp_path / "trace.json") as f:
+        trace = json.load(f)["traceEvents"]
+    assert [e["ph"] for e in trace] == ["M", "M", "B", "E", "C"]
+    assert trace[2]["args"] == {"value": 1000.0}
+    assert trace[2]["ts"] <= trace[3]["ts"]
@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+
+from src.devices.faults import recovering
+from src.devices.transport import (CALL, RAISE, ReplayMismatch, TransportPlayer, TransportRecorder,
+                                   read_recording)
+
+
+class FakeSerial:
+    """
+    Echoes commands back, like a laser acknowledging them.
+    """
+
+    def __init__(self, drops=0):
+        self.drops = drops
+        self.last = b""
+        self.closed = False
+
+    def write(self, data):
+        if self.drops:
+            self.drops -= 1
+            raise OSError("port dropped")
+        self.last = data
+        return len(data)
+
+    def readline(self):
+        return self.last
+
+    def close(self):
+        self.closed = True
+
+    def set_option(self, name, value):
+        setattr(self, name, value)
+
+
+class Vortran:
+    """
+    Minimal stand-in with the driver's connection attribute and recovery.
+    """
+
+    def __init__(self, connection=None):
+        self.connection = connection
+        self.reconnects = 0
+
+    def _recover(self):
+        self.reconnects += 1
+        self.connection = FakeSerial()
+
+    @recovering((OSError,))
+    def sendCommand(self, command):
+        self.connection.write(f"{command}\r".encode())
+        return self.connection.readline().decode().strip()
+
+
+def test_record_and_replay_round_trip(tmp_path):
+    path = tmp_path / "scan.rec"
+    with TransportRecorder(path) as recorder:
+        laser = recorder.attach(Vortran(FakeSerial()))
+        assert laser.sendCommand("?LP") == "?LP"
+        assert laser.sendCommand("LP=40.00") == "LP=40.00"
+    records = read_recording(path)
+    assert [r[3] for r in records] == ["Vortran.connection.write", "Vortran.connection.readline"] * 2
+    assert all(r[2] == CALL for r in records)
+
+    laser = TransportPlayer(path, speed=None).attach(Vortran())
+    assert laser.sendCommand("?LP") == "?LP"
+    with pytest.raises(ReplayMismatch):
+        # Different arguments than recorded
+        laser.sendCommand("LP=50.00")
+
+
+def test_recording_continues_after_reconnect(tmp_path):
+    path = tmp_path / "scan.rec"
+    with TransportRecorder(path) as recorder:
+        laser = recorder.attach(Vortran(FakeSerial(drops=1)))
+        assert laser.sendCommand("?LE") == "?LE"
+        assert laser.reconnects == 1
+        laser.sendCommand("?LP")
+    records = read_recording(path)
+    kinds = [(r[2], r[3]) for r in records]
+    assert kinds[0] == (RAISE, "Vortran.connection.write")
+    # Traffic on the new connection is still recorded
+    assert kinds.count((CALL, "Vortran.connection.write")) == 2
+    assert records[-1][-1] == b"?LP\r"
+
+
+def test_unpicklable_arguments_are_recorded_as_repr(tmp_path):
+    path = tmp_path / "scan.rec"
+    lock = threading.Lock()
+    with TransportRecorder(path) as recorder:
+        connection = recorder.wrap(FakeSerial(), "Vortran.connection")
+        connection.set_option("lock", lock)
+    (record,) = read_recording(path)
+    assert record[3] == "Vortran.connection.set_option"
+    assert record[4] == ("lock", repr(lock))
+    assert record[-1] is None
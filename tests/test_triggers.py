@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from src.functions.triggers import TriggerSpec, attribute_frames, fire_times, simulate_motion
+
+
+def test_on_target_fires_once_per_move():
+    targets = [1, 2, 3]
+    t, position, on_target = simulate_motion(0, targets, 1, 10, settle=0.01)
+    assert len(fire_times(TriggerSpec("on_target"), t, position, on_target)) == len(targets)
+    # Also when settle and dwell are both zero
+    t, position, on_target = simulate_motion(0, targets, 1, 10)
+    assert len(fire_times(TriggerSpec("on_target"), t, position, on_target)) == len(targets)
+
+
+def test_simulate_motion_reaches_targets():
+    t, position, on_target = simulate_motion(-1.0, [2.0, 0.5], speed=2.0, accel=20.0, dwell=0.05)
+    assert np.all(np.diff(t) > 0)
+    assert position[-1] == pytest.approx(0.5)
+    assert np.max(position) == pytest.approx(2.0)
+    assert on_target[-1]
+
+
+def test_position_train_fires_at_each_threshold():
+    t, position, on_target = simulate_motion(0.0, [1.0], speed=1.0, accel=50.0)
+    spec = TriggerSpec("position", start=0.1, stop=0.9, step=0.2)
+    times = fire_times(spec, t, position, on_target)
+    assert len(times) == len(spec.thresholds()) == 5
+    assert np.all(np.diff(times) > 0)
+
+
+def test_motion_complete_fires_on_arrival_before_settling():
+    t, position, on_target = simulate_motion(0.0, [1.0, 2.0], speed=1.0, accel=50.0, settle=0.1)
+    complete = fire_times(TriggerSpec("motion_complete", position=1.0), t, position, on_target)
+    settled = fire_times(TriggerSpec("on_target"), t, position, on_target)
+    assert len(complete) == 1
+    assert settled[0] - complete[0] == pytest.approx(0.1, abs=1e-3)
+
+
+def test_attribute_frames_reports_missed_and_spurious():
+    triggers = [0.0, 1.0, 2.0, 3.0]
+    frames = [0.001, 1.001, 1.002, 3.001, 5.0]
+    frame_trigger, missed = attribute_frames(triggers, frames, max_delay=0.01)
+    assert frame_trigger.tolist() == [0, 1, -1, 3, -1]
+    assert missed.tolist() == [2]
+
+
+def test_attribute_frames_accepts_unsorted_triggers():
+    triggers = [2.0, 0.0, 3.0, 1.0]
+    frames = [0.001, 1.001, 3.001]
+    frame_trigger, missed = attribute_frames(triggers, frames, max_delay=0.01)
+    assert frame_trigger.tolist() == [1, 3, 2]
+    assert missed.tolist() == [0]
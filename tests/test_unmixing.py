@@ -0,0 +1,70 @@
+import numpy as np
+
+from src.functions.unmixing import ChunkedNMF, ChunkedPCA, _read
+
+
+class CountingCube:
+    """
+    Array-like cube (like an h5py dataset) that records the size of every
+    read.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.shape = data.shape
+        self.ndim = data.ndim
+        self.dtype = data.dtype
+        self.reads = []
+
+    def __getitem__(self, index):
+        block = self.data[index]
+        self.reads.append(block.size)
+        return block
+
+
+def test_read_matches_flat_view_for_any_range():
+    data = np.arange(3 * 5 * 7 * 2, dtype=np.float32).reshape(3, 5, 7, 2)
+    cube = CountingCube(data)
+    flat = data.reshape(-1, 2)
+    for start, stop in [(0, 105), (3, 4), (6, 50), (34, 36), (35, 70), (12, 99)]:
+        assert np.array_equal(_read(cube, start, stop, data.shape[:-1]), flat[start:stop])
+        assert np.array_equal(_read(data, start, stop, data.shape[:-1]), flat[start:stop])
+
+
+def test_nd_cube_reads_stay_within_memory_limit():
+    rng = np.random.default_rng(0)
+    data = rng.random((4, 25, 25, 32)).astype(np.float32)
+    cube = CountingCube(data)
+    pca = ChunkedPCA(n_components=3, memory_limit=2e5, workers=1)
+    pca.fit(cube)
+    # Every pixel is read once, in reads no larger than a chunk
+    assert sum(cube.reads) == data.size
+    assert max(cube.reads) * 4 * 4 <= 2e5
+    reference = ChunkedPCA(n_components=3, memory_limit=1e9, workers=1).fit(data)
+    assert np.allclose(pca.mean, reference.mean, atol=1e-5)
+    assert np.allclose(np.abs(pca.components), np.abs(reference.components), atol=1e-3)
+
+
+def test_pca_matches_numpy_on_memmap(tmp_path):
+    rng = np.random.default_rng(1)
+    data = rng.random((6, 9, 5)).astype(np.float32)
+    np.save(tmp_path / "cube.npy", data)
+    cube = np.load(tmp_path / "cube.npy", mmap_mode="r")
+    pca = ChunkedPCA(n_components=2, memory_limit=2000, workers=2).fit(cube)
+    scores = pca.transform(cube)
+    x = data.reshape(-1, 5).astype(np.float64)
+    values = np.linalg.eigvalsh(np.cov(x.T))[::-1][:2]
+    assert np.allclose(pca.explained_variance, values, rtol=1e-4)
+    assert scores.shape == (6, 9, 2)
+
+
+def test_nmf_recovers_endmembers():
+    rng = np.random.default_rng(2)
+    endmembers = np.array([[1, 0.5, 0, 0, 0.2], [0, 0.2, 1, 0.7, 0]], dtype=np.float32)
+    abundances = rng.random((20, 20, 2)).astype(np.float32)
+    cube = abundances @ endmembers
+    nmf = ChunkedNMF(n_components=2, memory_limit=5000, workers=2, passes=3)
+    result = nmf.fit_transform(cube)
+    assert result.shape == (20, 20, 2)
+    reconstruction = result.reshape(-1, 2) @ nmf.components
+    assert np.abs(reconstruction - cube.reshape(-1, 5)).mean() < 0.05 * cube.mean()